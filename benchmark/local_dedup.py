@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from preprocessing.dedup.local import compute_file_signatures, cluster_signatures
+from preprocessing.dedup.minhash import create_minhash_lsh, to_minhash, cluster_documents
+from preprocessing.lib import Logger
+from benchmark.morphology import synthetic_documents
+
+
+def near_duplicate_corpus(num_docs: int, duplicate_rate: float, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    texts = synthetic_documents(num_docs, 10, seed)
+    for i in range(num_docs):
+        if i and rng.random() < duplicate_rate:
+            source = texts[rng.randrange(i)]
+            position = rng.randrange(len(source))
+            texts[i] = source[:position] + "。" + source[position:]
+    return texts
+
+
+def canonical(groups: list[list[int]]) -> list[list[int]]:
+    return sorted(sorted(group) for group in groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the local dedup backend with MinHashLSH clustering.')
+    parser.add_argument('--num_docs', type=int, default=20_000)
+    parser.add_argument('--num_files', type=int, default=8)
+    parser.add_argument('--duplicate_rate', type=float, default=0.3)
+    parser.add_argument('--num_jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    texts = near_duplicate_corpus(args.num_docs, args.duplicate_rate)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_files = []
+        per_file = -(-len(texts) // args.num_files)
+        for i in range(args.num_files):
+            input_file = os.path.join(tmpdir, f"{i:03d}.jsonl")
+            with open(input_file, "w") as writer:
+                for text in texts[i * per_file:(i + 1) * per_file]:
+                    writer.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+            input_files.append(input_file)
+
+        start = time.perf_counter()
+        signatures_by_file = compute_file_signatures(input_files, num_jobs=args.num_jobs)
+        signatures = np.concatenate([signatures_by_file[input_file] for input_file in input_files])
+        signing_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        local_groups = canonical(cluster_signatures(signatures, verify=False).groups())
+        local_elapsed = time.perf_counter() - start
+
+        os.makedirs(os.path.join(tmpdir, "log"))
+        logger = Logger.get_logger(__name__, logdir=os.path.join(tmpdir, "log"))
+        start = time.perf_counter()
+        lsh = create_minhash_lsh(storage_config={'type': 'dict'})
+        minhashes = {doc_id: to_minhash(signature.astype(np.uint64)) for doc_id, signature in enumerate(signatures)}
+        with lsh.insertion_session() as session:
+            for doc_id, minhash in minhashes.items():
+                session.insert(doc_id, minhash)
+        lsh_groups = canonical(cluster_documents(list(minhashes), [minhashes], lsh, logger=logger).groups())
+        lsh_elapsed = time.perf_counter() - start
+
+    assert local_groups == lsh_groups
+    print(f"{len(texts)} docs, {len(local_groups)} clusters (identical to MinHashLSH)")
+    print(f"signatures ({args.num_jobs} processes): {signing_elapsed:.2f}s")
+    print(f"local band index + union: {local_elapsed:.2f}s")
+    print(f"MinHashLSH insert + query + union: {lsh_elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import tempfile
+import time
+
+from preprocessing.dedup.minhash import compute_signatures, create_minhash_lsh, deduplicate_ids, to_minhash
+from preprocessing.lib import Logger
+from benchmark.local_dedup import near_duplicate_corpus
+
+
+class DictSignatureCache():
+    def __init__(self, doc_ids, signatures) -> None:
+        self.signatures = dict(zip(doc_ids, signatures))
+
+    def get_many(self, doc_ids):
+        return {doc_id: self.signatures[doc_id] for doc_id in doc_ids if doc_id in self.signatures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the LSH query phase scales with the number of processes.')
+    parser.add_argument('--num_docs', type=int, default=100_000)
+    parser.add_argument('--duplicate_rate', type=float, default=0.3)
+    parser.add_argument('--max_jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--redis', type=bool, default=False,
+                        help='Store the LSH in redis (REDIS_HOST/REDIS_PORT/REDIS_DB) under benchmark.lsh_query '
+                             'instead of a dict')
+    args = parser.parse_args()
+
+    texts = near_duplicate_corpus(args.num_docs, args.duplicate_rate)
+    doc_ids = [f"0:{i}:0" for i in range(len(texts))]
+    signatures = compute_signatures(texts)
+    cache = DictSignatureCache(doc_ids, signatures)
+
+    if args.redis:
+        storage_config = {"type": "redis", "basename": b"benchmark.lsh_query", "redis": {
+            "host": os.environ.get("REDIS_HOST", "localhost"), "port": int(os.environ.get("REDIS_PORT", 6379)),
+            "db": int(os.environ.get("REDIS_DB", 0))}}
+    else:
+        storage_config = {"type": "dict"}
+    lsh = create_minhash_lsh(storage_config=storage_config)
+    with lsh.insertion_session() as session:
+        for doc_id, signature in zip(doc_ids, signatures):
+            session.insert(doc_id, to_minhash(signature))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logger = Logger.get_logger(__name__, logdir=tmpdir)
+        num_jobs_list = sorted({1, *[2 ** i for i in range(1, args.max_jobs.bit_length())], args.max_jobs})
+        expected = None
+        baseline = None
+        for num_jobs in num_jobs_list:
+            start = time.perf_counter()
+            survivors = deduplicate_ids(doc_ids, lsh, cache=cache, num_jobs=num_jobs, logger=logger)
+            elapsed = time.perf_counter() - start
+            expected = expected if expected is not None else survivors
+            assert survivors == expected
+            baseline = baseline or elapsed
+            print(f"{num_jobs:3d} processes: {elapsed:.2f}s, {len(doc_ids) / elapsed:,.0f} docs/sec, "
+                  f"speedup {baseline / elapsed:.2f}x, kept {len(survivors)} of {len(doc_ids)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import json
+import random
+import time
+
+from hojichar import document_filters, Document
+
+from preprocessing import lib
+from preprocessing.filters import morphology
+from preprocessing.filters.morphology import AnalyzeMorphologyJa
+from preprocessing.filters.document_filters import DiscardAdultContentJa, DiscardBBSComments, DiscardDiscriminationContentJa, RemoveRepetition
+
+
+SUBJECTS = ["今日は", "昨日の午後は", "駅前の商店街では", "図書館で", "地域の子どもたちが", "新しい研究によると", "週末に", "友人と"]
+OBJECTS = ["天気が良いので", "公園の近くで", "玉ねぎをじっくり炒めて", "借りた本を", "川の清掃活動として", "睡眠時間について", "大きなお祭りで"]
+PREDICATES = ["散歩に出かけました。", "読み終えることができました。", "強い関係があるそうです。", "色々な話をしました。", "みんなで協力しました。"]
+
+
+def synthetic_documents(num_docs: int, num_sentences: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+
+    def sentence() -> str:
+        return rng.choice(SUBJECTS) + rng.choice(OBJECTS) + str(rng.randint(1, 10_000)) + rng.choice(PREDICATES)
+
+    return ["\n".join(sentence() for _ in range(num_sentences)) for _ in range(num_docs)]
+
+
+def load_documents(input_file: str, num_docs: int) -> list[str]:
+    texts = []
+    for line in lib.readlines(input_file):
+        texts.append(str(json.loads(line)["text"]))
+        if len(texts) >= num_docs:
+            break
+    return texts
+
+
+def run(texts: list[str], shared: bool) -> tuple[int, float]:
+    """
+    shared=False のときは各フィルタの前に解析結果を破棄し, フィルタごとに解析していた従来の挙動を再現する
+    """
+    filters = [
+        document_filters.DocumentNormalizer(),
+        DiscardAdultContentJa(),
+        DiscardBBSComments(),
+        DiscardDiscriminationContentJa(),
+        RemoveRepetition(),
+    ]
+    if shared:
+        filters.insert(1, AnalyzeMorphologyJa())
+
+    calls = 0
+    tokenize = morphology.tokenize
+
+    def counting_tokenize(text: str) -> list[str]:
+        nonlocal calls
+        calls += 1
+        return tokenize(text)
+
+    morphology.tokenize = counting_tokenize
+    try:
+        start = time.perf_counter()
+        for text in texts:
+            doc = Document(text)
+            for f in filters:
+                if doc.is_rejected:
+                    break
+                if not shared:
+                    doc.analyzed_text = None
+                f.apply(doc)
+        elapsed = time.perf_counter() - start
+    finally:
+        morphology.tokenize = tokenize
+
+    return calls, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark morphological analysis sharing across filters.')
+    parser.add_argument('--input_file', type=str, help='JSONL file to read documents from', required=False)
+    parser.add_argument('--num_docs', type=int, default=1000)
+    parser.add_argument('--num_sentences', type=int, default=40)
+    args = parser.parse_args()
+
+    if args.input_file:
+        texts = load_documents(args.input_file, args.num_docs)
+    else:
+        texts = synthetic_documents(args.num_docs, args.num_sentences)
+
+    morphology.get_tagger()
+    for label, shared in (("per-filter", False), ("shared", True)):
+        calls, elapsed = run(texts, shared)
+        print(f"{label:>10}: {calls / len(texts):.2f} parse calls/doc, {len(texts) / elapsed:.1f} docs/sec")
+
+
+if __name__ == "__main__":
+    main()
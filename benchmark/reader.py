@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+
+from preprocessing import lib
+from preprocessing.reader import JsonlReader
+from benchmark.morphology import synthetic_documents
+
+
+def write_corpus(path: str, size_mb: int) -> int:
+    lines = [json.dumps({"text": text}, ensure_ascii=False) + "\n" for text in synthetic_documents(1000, 10)]
+    block = "".join(lines).encode("utf-8")
+    num_lines = 0
+    with open(path, "wb") as writer:
+        while writer.tell() < size_mb << 20:
+            writer.write(block)
+            num_lines += len(lines)
+    return num_lines
+
+
+def count_chunk(args) -> int:
+    path, start, end = args
+    with JsonlReader(path) as reader:
+        return sum(1 for _ in reader.iter_raw(start, end))
+
+
+def measure(name: str, func, num_lines: int) -> None:
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    assert count == num_lines, (name, count, num_lines)
+    print(f"{name}: {elapsed:.2f}s, {count / elapsed:,.0f} lines/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the mmap JSONL reader with lib.readlines.')
+    parser.add_argument('--size_mb', type=int, default=2048)
+    parser.add_argument('--num_jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--tmpdir', type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmpdir:
+        path = os.path.join(tmpdir, "corpus.jsonl")
+        num_lines = write_corpus(path, args.size_mb)
+        print(f"{os.path.getsize(path) / 2**20:.0f} MiB, {num_lines} lines")
+
+        measure("lib.readlines", lambda: sum(1 for _ in lib.readlines(path)), num_lines)
+
+        def read_raw():
+            with JsonlReader(path) as reader:
+                return sum(1 for _ in reader.iter_raw())
+        measure("JsonlReader.iter_raw", read_raw, num_lines)
+
+        def read_decoded():
+            with JsonlReader(path) as reader:
+                return sum(1 for _ in reader.iter_lines())
+        measure("JsonlReader.iter_lines", read_decoded, num_lines)
+
+        def read_parallel():
+            with JsonlReader(path) as reader:
+                chunks = [(path, start, end) for start, end in reader.split(args.num_jobs)]
+            with Pool(args.num_jobs) as pool:
+                return sum(pool.map(count_chunk, chunks))
+        measure(f"JsonlReader.split x {args.num_jobs} processes", read_parallel, num_lines)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import random
+import time
+
+import nltk
+
+from preprocessing.filters.repetition import NgramRepetitionDetector, TOP_NGRAM_CHARACTER_FRACTIONS, DUPLICATE_NGRAM_CHARACTER_FRACTIONS
+
+
+def legacy_is_repetitive(word_list: list[str], text_length: int) -> bool:
+    for ngram, threshold in TOP_NGRAM_CHARACTER_FRACTIONS:
+        fdist = nltk.FreqDist(nltk.ngrams(word_list, ngram))
+        for gram, repeat in fdist.items():
+            char_count = sum([len(word) for word in gram])
+            if char_count * (repeat - 1) / text_length > threshold:
+                return True
+
+    for ngram, threshold in DUPLICATE_NGRAM_CHARACTER_FRACTIONS:
+        fdist = {}
+        mark = [0] * len(word_list)
+        for i in range(len(word_list) - ngram + 1):
+            bag = tuple(word_list[i: i + ngram])
+            if bag in fdist:
+                for j in range(i, i + ngram):
+                    mark[j] = len(word_list[j])
+                fdist[bag] += 1
+            else:
+                fdist[bag] = 1
+
+        if sum(mark) / float(text_length) > threshold:
+            return True
+
+    return False
+
+
+def repetitive_document(num_words: int, rng: random.Random) -> list[str]:
+    vocab = ["単語" * rng.randint(1, 3) + str(i) for i in range(2_000)]
+    words = []
+    while len(words) < num_words:
+        if words and rng.random() < 0.3:
+            start = rng.randrange(len(words))
+            words.extend(words[start:start + rng.randint(5, 50)])
+        else:
+            words.extend(rng.choice(vocab) for _ in range(rng.randint(5, 50)))
+    return words[:num_words]
+
+
+def measure(func, documents: list[tuple[list[str], int]]) -> tuple[list[bool], float]:
+    start = time.perf_counter()
+    decisions = [func(words, text_length) for words, text_length in documents]
+    return decisions, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark n-gram repetition detection.')
+    parser.add_argument('--num_docs', type=int, default=50)
+    parser.add_argument('--num_words', type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    documents = []
+    for _ in range(args.num_docs):
+        words = repetitive_document(args.num_words, rng)
+        # 閾値付近の判定になるよう, 本文長に単語以外の文字数を上乗せする
+        documents.append((words, sum(len(word) for word in words) * rng.randint(2, 12)))
+
+    detector = NgramRepetitionDetector()
+    legacy_decisions, legacy_elapsed = measure(legacy_is_repetitive, documents)
+    decisions, elapsed = measure(detector.is_repetitive, documents)
+    assert decisions == legacy_decisions
+
+    print(f"rejected: {sum(decisions)}/{len(decisions)}")
+    print(f"legacy:   {len(documents) / legacy_elapsed:.1f} docs/sec")
+    print(f"detector: {len(documents) / elapsed:.1f} docs/sec")
+
+
+if __name__ == "__main__":
+    main()
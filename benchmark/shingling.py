@@ -0,0 +1,42 @@
+import argparse
+import time
+
+from preprocessing.dedup.minhash import normalize_document
+from preprocessing.dedup.shingling import SHINGLERS, get_shingler
+from benchmark.morphology import synthetic_documents, load_documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark shingling backends for minhash deduplication.')
+    parser.add_argument('--input_file', type=str, help='JSONL file to read documents from', required=False)
+    parser.add_argument('--num_docs', type=int, default=2000)
+    parser.add_argument('--num_sentences', type=int, default=20)
+    parser.add_argument('--n', type=int, default=5)
+    parser.add_argument('--shinglers', type=str, nargs='+', default=list(SHINGLERS))
+    args = parser.parse_args()
+
+    if args.input_file:
+        texts = load_documents(args.input_file, args.num_docs)
+    else:
+        texts = synthetic_documents(args.num_docs, args.num_sentences)
+    texts = [normalize_document(text) for text in texts]
+
+    for name in args.shinglers:
+        shingler = get_shingler(name)
+        try:
+            start = time.perf_counter()
+            shingler(texts[0], args.n)
+            startup = time.perf_counter() - start
+        except Exception as e:
+            print(f"{name:>6}: unavailable ({type(e).__name__}: {e})")
+            continue
+
+        start = time.perf_counter()
+        num_shingles = sum(len(shingler(text, args.n)) for text in texts)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>6}: startup {startup * 1000:.1f} ms, {len(texts) / elapsed:.1f} docs/sec, "
+              f"{num_shingles / len(texts):.1f} shingles/doc")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from preprocessing.dedup.lsh import iter_band_edges
+from preprocessing.dedup.minhash import create_minhash_lsh, lsh_params, to_minhash
+
+
+def synthetic_signatures(num_docs: int, num_perm: int, duplicate_rate: float, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    signatures = rng.integers(0, 1 << 32, size=(num_docs, num_perm), dtype=np.uint64).astype(np.uint32)
+    duplicated = np.flatnonzero(rng.random(num_docs) < duplicate_rate)
+    duplicated = duplicated[duplicated > 0]
+    signatures[duplicated] = signatures[rng.integers(0, duplicated)]
+    return signatures
+
+
+def measure(name: str, func, num_docs: int) -> None:
+    start = time.perf_counter()
+    num_edges = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed:.2f}s, {num_docs / elapsed:,.0f} docs/sec, {num_edges} edges")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the sort-based LSH engine with MinHashLSH.')
+    parser.add_argument('--num_docs', type=int, default=1_000_000)
+    parser.add_argument('--num_lsh_docs', type=int, default=20_000,
+                        help='MinHashLSH is measured on this many documents only')
+    parser.add_argument('--duplicate_rate', type=float, default=0.3)
+    parser.add_argument('--max_memory', type=int, default=64 << 20, help='Memory budget of the spilled run')
+    args = parser.parse_args()
+
+    b, r = lsh_params(0.9, 128)
+    signatures = synthetic_signatures(args.num_docs, 128, args.duplicate_rate)
+    print(f"{args.num_docs} docs, b={b}, r={r}")
+
+    measure("sort LSH (in memory)", lambda: sum(len(src) for src, _ in iter_band_edges(signatures, b, r)),
+            args.num_docs)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        measure(f"sort LSH (spilled, {args.max_memory >> 20} MiB)",
+                lambda: sum(len(src) for src, _ in iter_band_edges(signatures, b, r, max_memory=args.max_memory,
+                                                                   spill_dir=tmpdir)), args.num_docs)
+
+    def minhash_lsh():
+        lsh = create_minhash_lsh(storage_config={'type': 'dict'})
+        minhashes = [to_minhash(signature) for signature in signatures[:args.num_lsh_docs]]
+        with lsh.insertion_session() as session:
+            for i, minhash in enumerate(minhashes):
+                session.insert(i, minhash)
+        return sum(len(lsh.query(minhash)) - 1 for minhash in minhashes)
+    measure("MinHashLSH (dict storage)", minhash_lsh, args.num_lsh_docs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from preprocessing.dedup.substring import build_buffer, iter_deduplicated, mark_repeats
+from preprocessing.lib import peak_rss
+
+
+def write_corpus(path: str, num_bytes: int, num_passages: int, passage_rate: float, seed: int = 0) -> int:
+    """
+    ランダムな語の並びの文書に, 共通の段落を passage_rate の割合で埋め込んだ JSONL を num_bytes ほど書き出す
+    """
+    rng = np.random.default_rng(seed)
+    chars = np.array(list("あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"))
+    vocabulary = ["".join(rng.choice(chars, size=rng.integers(2, 6))) for _ in range(5000)]
+    passages = ["".join(vocabulary[i] for i in rng.integers(0, len(vocabulary), size=80)) + "。"
+                for _ in range(num_passages)]
+    written = 0
+    num_docs = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < num_bytes:
+            words = [vocabulary[i] for i in rng.integers(0, len(vocabulary), size=rng.integers(100, 400))]
+            if rng.random() < passage_rate:
+                words.insert(int(rng.integers(0, len(words))), passages[rng.integers(0, num_passages)])
+            line = json.dumps({"text": "".join(words)}, ensure_ascii=False) + "\n"
+            f.write(line)
+            written += len(line.encode("utf-8"))
+            num_docs += 1
+    return num_docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure exact substring dedup on a synthetic multi-GB corpus.')
+    parser.add_argument('--size_gb', type=float, default=2.0)
+    parser.add_argument('--min_length', type=int, default=100)
+    parser.add_argument('--max_memory', type=int, default=512 << 20, help='Memory budget of one partition sort')
+    parser.add_argument('--num_jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--num_passages', type=int, default=10_000)
+    parser.add_argument('--passage_rate', type=float, default=0.3)
+    parser.add_argument('--work_dir', type=str, default=None, help='Directory for the corpus and spill files')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as tmpdir:
+        input_path = os.path.join(tmpdir, "input.jsonl")
+        num_docs = write_corpus(input_path, int(args.size_gb * (1 << 30)), args.num_passages, args.passage_rate)
+        print(f"{num_docs} docs, {os.path.getsize(input_path) / 2**30:.2f} GiB of JSONL")
+
+        buffer_path = os.path.join(tmpdir, "buffer.bin")
+        flags_path = os.path.join(tmpdir, "flags.bin")
+        start = time.perf_counter()
+        bounds = build_buffer([input_path], buffer_path)
+        elapsed = time.perf_counter() - start
+        print(f"concatenate: {elapsed:.1f}s, {bounds[-1] / 2**20 / elapsed:.1f} MiB/sec")
+
+        start = time.perf_counter()
+        num_marked = mark_repeats(buffer_path, flags_path, length=args.min_length, max_memory=args.max_memory,
+                                  num_jobs=args.num_jobs, spill_dir=tmpdir)
+        elapsed = time.perf_counter() - start
+        print(f"suffix array and repeats: {elapsed:.1f}s, {bounds[-1] / 2**20 / elapsed:.1f} MiB/sec, "
+              f"{num_marked} repeated windows")
+
+        start = time.perf_counter()
+        num_bytes = sum(len(text.encode("utf-8")) for text in iter_deduplicated(
+            buffer_path, flags_path, bounds, args.min_length, num_jobs=args.num_jobs))
+        elapsed = time.perf_counter() - start
+        total_bytes = int(bounds[-1]) - num_docs
+        print(f"remove: {elapsed:.1f}s, removed {1 - num_bytes / total_bytes:.1%} of {total_bytes} bytes")
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    # mmap で読んだ本文のページも含む
+    print(f"peak RSS: {peak_rss() / 2**20:.1f} MiB (workers {children / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import time
+
+import numpy as np
+
+from preprocessing.models.datastructures.unionfind import UnionFind
+
+
+def near_duplicate_edges(num_elements: int, edges_per_element: float, cluster_size: int, seed: int = 0):
+    """
+    cluster_size 個ずつの連続した要素の中で辺を張る (LSH の候補対に近い分布)
+    """
+    rng = np.random.default_rng(seed)
+    num_edges = int(num_elements * edges_per_element)
+    src = rng.integers(0, num_elements, num_edges)
+    dst = np.clip(src + rng.integers(-cluster_size, cluster_size + 1, num_edges), 0, num_elements - 1)
+    return src, dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the array backed UnionFind.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--edges_per_element', type=float, default=0.5)
+    parser.add_argument('--cluster_size', type=int, default=8)
+    args = parser.parse_args()
+
+    for num_elements in args.sizes:
+        src, dst = near_duplicate_edges(num_elements, args.edges_per_element, args.cluster_size)
+
+        start = time.perf_counter()
+        uf = UnionFind(num_elements)
+        uf.union_edges(src, dst)
+        union_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels = uf.labels()
+        labels_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, offsets = uf.group_offsets()
+        groups_elapsed = time.perf_counter() - start
+
+        print(f"{num_elements:>12,} elements, {len(src):>12,} edges: union_edges {union_elapsed:.2f}s, "
+              f"labels {labels_elapsed:.2f}s, group_offsets {groups_elapsed:.2f}s, "
+              f"{len(offsets) - 1:,} groups, parent array {uf.root.nbytes / 2**20:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,87 @@
 import argparse
 from datetime import datetime
 import os
+from typing import Optional
 
 from preprocessing.lib import Logger
-from preprocessing.dedup.dedup import exec_deduplication
-from preprocessing.filters.pipeline import execute_filtering, execute_url_dedup
+from preprocessing.dedup.dedup import exec_deduplication, exec_substring_deduplication, DEDUP_BACKENDS, SIGNATURE_CACHES
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER, SHINGLERS
+from preprocessing.dedup.url import LOCAL_URL_INDEXES
+from preprocessing.manifest import RunManifest, run_stage
+from preprocessing.output import COMPRESSIONS
+from preprocessing.filters.pipeline import execute_filtering, execute_fused, execute_line_dedup, execute_url_dedup
 
 
-def execute_preprocessing(input_dir: str, output_base: str, url_dedup: bool, filtering: bool, dedup: bool, *, logger=None):
+def execute_preprocessing(input_dir: str, output_base: str, url_dedup: bool, filtering: bool, dedup: bool,
+                          shingler: str = DEFAULT_SHINGLER, streaming_dedup: bool = False, dedup_backend: str = "redis",
+                          url_index: str = "redis", url_index_path: Optional[str] = None,
+                          signature_cache: str = "redis", shard_bytes: int = 1 << 30, output_compression: str = "none",
+                          fused: bool = False, keep_intermediate: bool = False,
+                          manifest: Optional[RunManifest] = None, dedup_index: Optional[str] = None,
+                          online_dedup: bool = False, line_dedup: bool = False, line_dedup_min_count: int = 100,
+                          substring_dedup: bool = False, substring_min_length: int = 100, *, logger=None):
+    """
+    manifest を渡すと各ステージの完了を記録し, 記録済みのステージは実行せずにその出力を次のステージの入力にする
+    """
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    if fused:
+        # 3つの段階をまとめて1回のパスで実行する. MinHash のクラスタリングはこのマシンで行う
+        logger.info("Executing fused url dedup, filtering and dedup")
+        start = datetime.now()
+        run_stage(manifest, "fused", input_dir, lambda: execute_fused(
+            input_dir=input_dir, output_base=output_base, url_index=url_index, url_index_path=url_index_path,
+            shingler=shingler, shard_bytes=shard_bytes, compression=output_compression,
+            keep_intermediate=keep_intermediate, index_dir=dedup_index, logger=logger), logger=logger)
+        end = datetime.now()
+        logger.info(f"Finished fused preprocessing in {end - start}")
+        return
+
     if url_dedup:
         logger.info("Executing url dedup")
         start = datetime.now()
-        input_dir = execute_url_dedup(input_dir=input_dir, output_base=output_base, logger=logger)
+        input_dir = run_stage(manifest, "url_dedup", input_dir, lambda: execute_url_dedup(
+            input_dir=input_dir, output_base=output_base, url_index=url_index, url_index_path=url_index_path,
+            shard_bytes=shard_bytes, logger=logger), logger=logger)
         end = datetime.now()
         logger.info(f"Finished url dedup in {end - start}")
 
     if filtering:
         logger.info("Executing filtering")
         start = datetime.now()
-        input_dir = execute_filtering(input_dir=input_dir, output_base=output_base, logger=logger)
+        input_dir = run_stage(manifest, "filtering", input_dir, lambda: execute_filtering(
+            input_dir=input_dir, output_base=output_base, shard_bytes=shard_bytes, logger=logger), logger=logger)
         end = datetime.now()
         logger.info(f"Finished filtering in {end - start}")
 
+    if line_dedup:
+        logger.info("Executing line dedup")
+        start = datetime.now()
+        input_dir = run_stage(manifest, "line_dedup", input_dir, lambda: execute_line_dedup(
+            input_dir=input_dir, output_base=output_base, min_count=line_dedup_min_count, shard_bytes=shard_bytes,
+            logger=logger), logger=logger)
+        end = datetime.now()
+        logger.info(f"Finished line dedup in {end - start}")
+
     if dedup:
         logger.info("Executing dedup")
         start = datetime.now()
-        exec_deduplication(input_dir=input_dir, output_base=output_base, logger=logger)
+        input_dir = run_stage(manifest, "dedup", input_dir, lambda: exec_deduplication(
+            input_dir=input_dir, output_base=output_base, shingler=shingler, streaming=streaming_dedup,
+            backend=dedup_backend, signature_cache=signature_cache, compression=output_compression,
+            shard_bytes=shard_bytes, manifest=manifest, index_dir=dedup_index, online=online_dedup, logger=logger),
+            logger=logger)
         end = datetime.now()
         logger.info(f"Finished dedup in {end - start}")
 
+    if substring_dedup:
+        logger.info("Executing substring dedup")
+        start = datetime.now()
+        run_stage(manifest, "substring_dedup", input_dir, lambda: exec_substring_deduplication(
+            output_base=output_base, input_dir=input_dir, min_length=substring_min_length,
+            compression=output_compression, shard_bytes=shard_bytes, logger=logger), logger=logger)
+        end = datetime.now()
+        logger.info(f"Finished substring dedup in {end - start}")
+
 
 def arg_parser():
     parser = argparse.ArgumentParser(description='Process some documents.')
@@ -39,8 +91,44 @@ def arg_parser():
                         help='The input file containing documents to process', required=False, default="./output")
     parser.add_argument('--url_dedup', type=bool, help='Whether to execute url deduplication',
                         required=False, default=True)
+    parser.add_argument('--url_index', type=str, choices=["redis", *LOCAL_URL_INDEXES], default="redis",
+                        help='Where to keep the urls seen by url deduplication', required=False)
+    parser.add_argument('--url_index_path', type=str, required=False, default=None,
+                        help='File to load the local url index from and save it to after the run')
     parser.add_argument('--filtering', type=bool, help='Whether to execute filtering', required=False, default=True)
+    parser.add_argument('--line_dedup', type=bool, default=False, required=False,
+                        help='Whether to remove lines repeated across many documents of the corpus after filtering')
+    parser.add_argument('--line_dedup_min_count', type=int, default=100, required=False,
+                        help='Remove lines found in at least this many documents')
     parser.add_argument('--dedup', type=bool, help='Whether to execute deduplication', required=False, default=True)
+    parser.add_argument('--substring_dedup', type=bool, default=False, required=False,
+                        help='Whether to remove passages repeated across documents after deduplication')
+    parser.add_argument('--substring_min_length', type=int, default=100, required=False,
+                        help='Remove passages matching an earlier one over at least this many bytes')
+    parser.add_argument('--shingler', type=str, choices=list(SHINGLERS), default=DEFAULT_SHINGLER,
+                        help='The shingling backend used by minhash deduplication (char and mecab need no GPT-2 tokenizer)', required=False)
+    parser.add_argument('--streaming_dedup', type=bool,
+                        help='Whether to cluster only document ids and stream survivors from the input files',
+                        required=False, default=False)
+    parser.add_argument('--online_dedup', type=bool, default=False, required=False,
+                        help='Let redis workers query then insert band buckets and only merge the found edges')
+    parser.add_argument('--dedup_backend', type=str, choices=DEDUP_BACKENDS, default="redis",
+                        help='Whether to run minhash deduplication on redis or on this machine only', required=False)
+    parser.add_argument('--dedup_index', type=str, default=None, required=False,
+                        help='Directory of a persistent minhash index. Documents matching earlier runs are dropped '
+                             'and the kept documents are added to it (local backend or --fused only)')
+    parser.add_argument('--signature_cache', type=str, choices=SIGNATURE_CACHES, default="redis",
+                        help='Where workers keep minhash signatures for the redis dedup backend', required=False)
+    parser.add_argument('--shard_bytes', type=int, default=1 << 30,
+                        help='Start a new output shard after this many (uncompressed) bytes', required=False)
+    parser.add_argument('--output_compression', type=str, choices=list(COMPRESSIONS), default="none",
+                        help='Compression of the final deduplicated output', required=False)
+    parser.add_argument('--fused', type=bool, default=False, required=False,
+                        help='Run url dedup, filtering and minhash signatures in a single pass over the input')
+    parser.add_argument('--keep_intermediate', type=bool, default=False, required=False,
+                        help='Keep the filtered documents written by the fused pass')
+    parser.add_argument('--resume', type=str, default=None, required=False,
+                        help='Resume an interrupted run in this output directory, skipping completed stages and files')
     parser.add_argument('--verbose', type=bool, help='Verbose mode', required=False, default=False)
 
     return parser.parse_args()
@@ -49,14 +137,22 @@ def arg_parser():
 def main():
     args = arg_parser()
     start = datetime.now()
-    output_base = os.path.join(args.output_dir, start.strftime("%Y%m%d%H%M%S"))
+    output_base = args.resume or os.path.join(args.output_dir, start.strftime("%Y%m%d%H%M%S"))
     logdir = os.path.join(output_base, "log")
     os.makedirs(logdir, exist_ok=True)
 
     logger = Logger.get_logger(name=__name__, logdir=logdir, verbose=args.verbose)
 
     execute_preprocessing(args.input_dir, output_base, url_dedup=args.url_dedup,
-                          filtering=args.filtering, dedup=args.dedup, logger=logger)
+                          filtering=args.filtering, dedup=args.dedup, shingler=args.shingler,
+                          streaming_dedup=args.streaming_dedup, dedup_backend=args.dedup_backend,
+                          url_index=args.url_index, url_index_path=args.url_index_path,
+                          signature_cache=args.signature_cache, shard_bytes=args.shard_bytes,
+                          output_compression=args.output_compression, fused=args.fused,
+                          keep_intermediate=args.keep_intermediate, manifest=RunManifest(output_base),
+                          dedup_index=args.dedup_index, online_dedup=args.online_dedup, line_dedup=args.line_dedup,
+                          line_dedup_min_count=args.line_dedup_min_count, substring_dedup=args.substring_dedup,
+                          substring_min_length=args.substring_min_length, logger=logger)
 
 
 if __name__ == "__main__":
@@ -9,22 +9,74 @@ import json
 import random
 import string
 import multiprocessing
+import tempfile
+from typing import Hashable, Iterable, Optional, Sequence, Union
 
-from preprocessing.dedup.minhash import deduplicate_documents, create_minhash_lsh, create_minhash_index
+from preprocessing.dedup.index import MinHashIndex
+from preprocessing.dedup.docid import doc_ids_from_offsets, input_files, load_offset_index
+from preprocessing.dedup.exact import RedisExactIndex, load_duplicates
+from preprocessing.dedup.minhash import deduplicate_documents, deduplicate_ids, create_minhash_lsh, create_minhash_index
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER
+from preprocessing.dedup.substring import build_buffer, iter_deduplicated, mark_repeats
+from preprocessing.dedup.signatures import NpySignatureCache, RedisSignatureCache
+from preprocessing.dedup.local import deduplicate_local, representatives
+from preprocessing.dedup.online import RedisBandIndex, load_edges, merge_edges
+from preprocessing.dedup.url import RedisURLIndex, connect_redis
 from preprocessing.filters.document_filters import JSONHTMLLoader, DeduplicationByURL
 from preprocessing.models.document import DocumentFromHTML
 from preprocessing.dedup import worker
-from multiprocessing import Pool, cpu_count
+from preprocessing.manifest import DONE, FAILED, RunManifest, file_hash
+from preprocessing.output import ShardedWriter
+from preprocessing.reader import read_input_lines
+from preprocessing.scheduler import StagePool
 import preprocessing.lib as lib
 
 
 NUM_WORKER = (multiprocessing.cpu_count() - 2)
 
 
-def exec_deduplication(output_base: str, input_dir: str, basename: str = "", *, logger=None) -> list[str]:
+DEDUP_BACKENDS = ["redis", "local"]
+
+SIGNATURE_CACHES = ["redis", "npy"]
+
+
+def exec_deduplication(output_base: str, input_dir: str, basename: str = "", shingler: str = DEFAULT_SHINGLER,
+                       streaming: bool = False, backend: str = "redis", signature_cache: str = "redis",
+                       signature_dir: Optional[str] = None, compression: str = "none", shard_bytes: int = 1 << 30,
+                       manifest: Optional[RunManifest] = None, index_dir: Optional[str] = None,
+                       online: bool = False, *, logger=None) -> list[str]:
+    """
+    ワーカーは本文を Redis に保存せず, 文書IDは入力ファイル内の位置から決まる.
+    streaming=True のときは文書IDと MinHash だけでクラスタリングし, 残す文書を入力ファイルから直接出力する.
+    streaming=False のときは本文を入力ファイルから読み出してクラスタリングする.
+    backend="local" のときは Redis を使わず, このマシンのプロセスプールだけで処理する.
+    signature_cache="npy" のときは MinHash のシグネチャを signature_dir (既定は output_base/signatures) の npy に保存する.
+    出力は shard_bytes ごとのシャードに分け, compression で圧縮する.
+    manifest を渡すと, 以前の実行でインデックスを作り終えたファイルは読み飛ばし, 同じ basename の LSH に追加する.
+    index_dir を指定すると, そこに保存した MinHashIndex (以前の実行で残した文書) と一致する文書も除く.
+    online=True のときはワーカーがバッチごとにバンドのインデックスへ問い合わせてから登録し, 見つけた辺を保存する.
+    このプロセスは辺をまとめるだけで, 文書ごとの問い合わせは行わない (streaming は無視する).
+    ワーカーが他の文書と完全に一致するとした文書はシグネチャがないので, クラスタリングせずに除く
+    """
     logger = logger or lib.Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
 
+    if backend == "local":
+        return exec_local_deduplication(output_base=output_base, input_dir=input_dir, shingler=shingler,
+                                        compression=compression, shard_bytes=shard_bytes, index_dir=index_dir,
+                                        logger=logger)
+    if backend != "redis":
+        raise ValueError(f"Unknown dedup backend: {backend}. Available: {', '.join(DEDUP_BACKENDS)}")
+    if index_dir:
+        raise ValueError("A persistent dedup index is only supported by the local dedup backend")
+    if signature_cache not in SIGNATURE_CACHES:
+        raise ValueError(f"Unknown signature cache: {signature_cache}. Available: {', '.join(SIGNATURE_CACHES)}")
+    if signature_cache == "npy":
+        signature_dir = signature_dir or os.path.join(output_base, "signatures")
+        os.makedirs(signature_dir, exist_ok=True)
+
     log_dir = os.path.join(output_base, "log")
+    offset_dir = os.path.join(output_base, "offsets")
+    edge_dir = os.path.join(output_base, "edges") if online else ""
 
     redis_host = os.environ.get("REDIS_HOST", "localhost")
     redis_port = os.environ.get("REDIS_PORT", 6379)
@@ -32,22 +84,36 @@ def exec_deduplication(output_base: str, input_dir: str, basename: str = "", *,
     r = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db, decode_responses=True)
 
     r.set("dedup_status", "processing")
+    if manifest is not None:
+        basename = basename or manifest.stage("dedup").get("basename", "")
     basename: str = basename if basename else ''.join(random.choice(string.ascii_lowercase)
                                                       for _ in range(11))
+    if manifest is not None:
+        manifest.stage("dedup")["basename"] = basename
+        manifest.save()
     try:
-        # Queue files to be processed
-        for filename in os.listdir(input_dir):
-            if not filename.endswith(".jsonl"):
-                continue
-
+        # 中断した実行の残りを消してからキューに入れる
+        r.delete("dedup_files.before_processing", "dedup_files.processing", "dedup_files.error")
+        filenames = input_files(input_dir)
+        hashes: dict[str, str] = {}
+        for filename in filenames:
+            if manifest is not None:
+                path = os.path.join(input_dir, filename)
+                hashes[filename] = file_hash(path)
+                if manifest.is_file_done("dedup", path, hashes[filename]) and \
+                        load_offset_index(offset_dir, filename) is not None:
+                    logger.info(f"Skipping {filename}: already indexed")
+                    continue
             logger.info(f"Queueing {filename}")
             r.rpush("dedup_files.before_processing", filename)
 
         starttime = time.time()
-        num_jobs = os.environ.get("NUM_WORKER", NUM_WORKER)
-        for worker_id in range(num_jobs):
+        num_jobs = lib.num_workers(NUM_WORKER)
+        for worker_id in range(num_jobs if r.llen("dedup_files.before_processing") > 0 else 0):
             logger.info(f"Starting worker {worker_id}")
-            worker.evoke_worker(worker_id=worker_id, input_dir=input_dir, log_dir=log_dir, basename=basename)
+            worker.evoke_worker(worker_id=worker_id, input_dir=input_dir, log_dir=log_dir, basename=basename,
+                                 shingler=shingler, offset_dir=offset_dir,
+                                 signature_dir=signature_dir if signature_cache == "npy" else "", edge_dir=edge_dir)
 
         while r.llen("dedup_files.before_processing") > 0 or r.hlen("dedup_files.processing") > 0:
             logger.info(f"Waiting for processing to finish. {r.llen('dedup_files.before_processing')} files left")
@@ -55,76 +121,278 @@ def exec_deduplication(output_base: str, input_dir: str, basename: str = "", *,
         endtime = time.time()
         logger.info(f"Processing time to create minhash index : {endtime - starttime}")
 
-        starttime = time.time()
-        docs: dict[str, str] = r.hgetall("dedup.docs")
+        if manifest is not None:
+            errors = set(r.lrange("dedup_files.error", 0, -1))
+            for filename in hashes:
+                path = os.path.join(input_dir, filename)
+                if manifest.is_file_done("dedup", path, hashes[filename]):
+                    continue
+                offsets = load_offset_index(offset_dir, filename)
+                if filename in errors or offsets is None:
+                    manifest.mark_file("dedup", path, FAILED, hashes[filename], save=False)
+                else:
+                    manifest.mark_file("dedup", path, DONE, hashes[filename], output=offset_dir,
+                                       stats={"num_docs": len(offsets)}, save=False)
+            manifest.save()
+
+        exact_index = RedisExactIndex(redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db), basename)
+        if online:
+            return _merge_online_result(input_dir=input_dir, filenames=filenames, offset_dir=offset_dir,
+                                        edge_dir=edge_dir, output_base=output_base, band_index=RedisBandIndex(
+                                            redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db),
+                                            basename), exact_index=exact_index,
+                                        compression=compression, shard_bytes=shard_bytes, logger=logger)
 
+        starttime = time.time()
         lsh = create_minhash_lsh(storage_config={"type": "redis", "basename": basename.encode('utf8'), "redis":  {
             'host': redis_host, 'port': redis_port, 'db': redis_db}})
-        deduplicated: list[str] = deduplicate_documents(docs, lsh, redis=r, logger=logger)
-        endtime = time.time()
-        logger.info(f"Processing time to dedup: {endtime - starttime}")
-
         output_dir = os.path.join(output_base, "minhash_dedup")
         os.makedirs(output_dir, exist_ok=True)
-        write_dedup_result(texts=deduplicated, output_dir=output_dir)
+        if signature_cache == "npy":
+            cache = NpySignatureCache(signature_dir, shard="coordinator")
+        else:
+            cache = RedisSignatureCache(redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db))
+
+        doc_ids_by_file: dict[str, list[str]] = {}
+        duplicates: set[str] = set()
+        for file_index, filename in enumerate(filenames):
+            offsets = load_offset_index(offset_dir, filename)
+            if offsets is None:
+                logger.error(f"Missing offset index for {filename}")
+                continue
+            doc_ids_by_file[filename] = doc_ids_from_offsets(file_index, offsets)
+            duplicates.update(doc_ids_by_file[filename][row] for row in load_duplicates(offset_dir, filename).tolist())
+        doc_ids = [doc_id for doc_ids in doc_ids_by_file.values() for doc_id in doc_ids if doc_id not in duplicates]
+        logger.info(f"Skipped signing {len(duplicates)} of {len(doc_ids) + len(duplicates)} documents "
+                    f"(exact duplicates)")
+
+        if streaming:
+            survivors = deduplicate_ids(doc_ids, lsh, cache=cache, num_jobs=num_jobs, logger=logger)
+            endtime = time.time()
+            logger.info(f"Processing time to dedup: {endtime - starttime}")
+            logger.info(f"Kept {len(survivors)} of {len(doc_ids)} documents")
+
+            write_streaming_dedup_result(input_dir=input_dir, doc_ids_by_file=doc_ids_by_file,
+                                         survivors=survivors, output_dir=output_dir, max_bytes=shard_bytes,
+                                         compression=compression)
+        else:
+            # 入力ファイルを先頭から順に読むので, 圧縮した入力でも使える
+            docs: dict[str, str] = {
+                doc_id: str(json.loads(line)["text"])
+                for filename, file_doc_ids in doc_ids_by_file.items()
+                for doc_id, line in zip(file_doc_ids, read_input_lines(os.path.join(input_dir, filename)))
+                if doc_id not in duplicates}
+            deduplicated: list[str] = deduplicate_documents(docs, lsh, cache=cache, shingler=shingler,
+                                                            num_jobs=num_jobs, logger=logger)
+            endtime = time.time()
+            logger.info(f"Processing time to dedup: {endtime - starttime}")
 
+            write_dedup_result(texts=deduplicated, output_dir=output_dir, max_bytes=shard_bytes, compression=compression)
+
+        logger.info(f"Deleted {exact_index.cleanup()} exact index keys")
+        logger.info(f"Peak RSS of dedup coordinator: {lib.peak_rss() / 2**20:.1f} MiB")
         return output_dir
     except Exception as e:
         r.delete("dedup_files.before_processing")
         raise e
 
 
-def __write_to_file(args):
-    texts, file_id, output_dir, order = args
-    with open(os.path.join(output_dir, file_id.zfill(order) + ".jsonl"), "w") as writer:
-        for text in texts:
-            writer.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+def _merge_online_result(input_dir: str, filenames: list[str], offset_dir: str, edge_dir: str, output_base: str,
+                         band_index: RedisBandIndex, exact_index: RedisExactIndex, compression: str = "none",
+                         shard_bytes: int = 1 << 30, *, logger) -> str:
+    """
+    ワーカーが保存した辺を UnionFind にまとめ, クラスタごとに最大の通し番号の文書を残す.
+    他の文書と完全に一致した文書は辺を持たないので, 別に除く
+    """
+    starttime = time.time()
+    offsets_by_file = []
+    edges = []
+    for filename in filenames:
+        offsets = load_offset_index(offset_dir, filename)
+        file_edges = load_edges(edge_dir, filename)
+        if offsets is None or file_edges is None:
+            logger.error(f"Missing offset index or edges for {filename}")
+            offsets = None
+        offsets_by_file.append(offsets)
+        if file_edges is not None:
+            edges.append(file_edges)
+    uf = merge_edges(offsets_by_file, edges)
+    survivors = representatives(uf)
+
+    doc_ids_by_file: dict[str, range] = {}
+    start = 0
+    num_duplicates = 0
+    for filename, offsets in zip(filenames, offsets_by_file):
+        if offsets is not None:
+            doc_ids_by_file[filename] = range(start, start + len(offsets))
+            duplicates = (start + load_duplicates(offset_dir, filename)).tolist()
+            survivors.difference_update(duplicates)
+            num_duplicates += len(duplicates)
+            start += len(offsets)
+    endtime = time.time()
+    logger.info(f"Processing time to merge {sum(len(e) for e in edges)} edges: {endtime - starttime}")
+    logger.info(f"Skipped signing {num_duplicates} of {len(uf)} documents (exact duplicates)")
+    logger.info(f"Kept {len(survivors)} of {len(uf)} documents")
+
+    output_dir = os.path.join(output_base, "minhash_dedup")
+    write_streaming_dedup_result(input_dir=input_dir, doc_ids_by_file=doc_ids_by_file, survivors=survivors,
+                                 output_dir=output_dir, max_bytes=shard_bytes, compression=compression)
+    deleted = band_index.cleanup()
+    logger.info(f"Deleted {deleted} band index keys")
+    logger.info(f"Deleted {exact_index.cleanup()} exact index keys")
+    logger.info(f"Peak RSS of dedup coordinator: {lib.peak_rss() / 2**20:.1f} MiB")
+    return output_dir
+
 
+def exec_local_deduplication(output_base: str, input_dir: str, shingler: str = DEFAULT_SHINGLER,
+                             compression: str = "none", shard_bytes: int = 1 << 30, index_dir: Optional[str] = None,
+                             *, logger=None) -> str:
+    filenames = input_files(input_dir)
+    num_jobs = lib.num_workers(NUM_WORKER)
+    index = open_dedup_index(index_dir, output_base) if index_dir else None
+    doc_ids_by_file, survivors = deduplicate_local([os.path.join(input_dir, filename) for filename in filenames],
+                                                   shingler=shingler, num_jobs=num_jobs, index=index,
+                                                   spill_dir=output_base, logger=logger)
+    logger.info(f"Kept {len(survivors)} of {sum(len(doc_ids) for doc_ids in doc_ids_by_file.values())} documents")
 
-def write_dedup_result(texts: list[str], output_dir: str):
-    num_jobs = os.environ.get("NUM_WORKER", NUM_WORKER)
-    num_items = len(texts)
-    num_lines_per_file = 10_000
-    order = (num_items // num_lines_per_file) + 1
+    output_dir = os.path.join(output_base, "minhash_dedup")
+    os.makedirs(output_dir, exist_ok=True)
+    write_streaming_dedup_result(input_dir=input_dir, doc_ids_by_file={os.path.basename(input_file): doc_ids for input_file, doc_ids in doc_ids_by_file.items()},
+                                 survivors=survivors, output_dir=output_dir, max_bytes=shard_bytes,
+                                 compression=compression)
 
-    # Split deduplicated.values() into chunks for each process
-    chunks = [list() for _ in range(num_jobs)]
-    for i, text in enumerate(texts):
-        chunks[i % num_jobs].append(text)
+    logger.info(f"Peak RSS of dedup coordinator: {lib.peak_rss() / 2**20:.1f} MiB")
+    return output_dir
 
-    # Prepare arguments for each process
-    args = [(chunks[i], str(i), output_dir, order) for i in range(num_jobs)]
 
-    # Use multiprocessing Pool to write to files in parallel
-    with Pool(num_jobs) as p:
-        p.map(__write_to_file, args)
+def exec_substring_deduplication(output_base: str, input_dir: str, min_length: int = 100,
+                                 compression: str = "none", shard_bytes: int = 1 << 30, max_memory: int = 1 << 30,
+                                 *, logger=None) -> str:
+    """
+    先に現れた部分と min_length バイト以上一致する部分を文書から除く. 一致する部分の最初の1か所は残す.
+    本文を output_base の一時ファイルに連結して mmap で読むので, メモリに載らない大きさの入力でも使える.
+    全て除かれた文書は出力しない
+    """
+    logger = logger or lib.Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+    num_jobs = lib.num_workers(NUM_WORKER)
+    output_dir = os.path.join(output_base, "substring_dedup")
+    os.makedirs(output_base, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=output_base) as tmpdir:
+        starttime = time.time()
+        buffer_path = os.path.join(tmpdir, "buffer.bin")
+        flags_path = os.path.join(tmpdir, "flags.bin")
+        bounds = build_buffer([os.path.join(input_dir, filename) for filename in input_files(input_dir)], buffer_path)
+        logger.info(f"Processing time to concatenate {len(bounds) - 1} documents ({bounds[-1]} bytes): "
+                    f"{time.time() - starttime}")
+
+        starttime = time.time()
+        num_marked = mark_repeats(buffer_path, flags_path, length=min_length, max_memory=max_memory,
+                                  num_jobs=num_jobs, spill_dir=tmpdir)
+        logger.info(f"Processing time to find repeated substrings: {time.time() - starttime}")
+        logger.info(f"Found {num_marked} repeated windows of {min_length} bytes")
+
+        starttime = time.time()
+        # 区切りのバイトを除いた本文のバイト数
+        total_bytes = int(bounds[-1]) - (len(bounds) - 1)
+        num_bytes = 0
+        num_empty = 0
+        with ShardedWriter(output_dir, max_bytes=shard_bytes, compression=compression) as writer:
+            for text in iter_deduplicated(buffer_path, flags_path, bounds, min_length, num_jobs=num_jobs):
+                num_bytes += len(text.encode("utf-8"))
+                if text.strip():
+                    writer.write_text(text)
+                else:
+                    num_empty += 1
+        logger.info(f"Processing time to remove repeated substrings: {time.time() - starttime}")
+        logger.info(f"Removed {total_bytes - num_bytes} of {total_bytes} bytes and discarded {num_empty} documents "
+                    f"left empty")
+
+    logger.info(f"Peak RSS of substring dedup: {lib.peak_rss() / 2**20:.1f} MiB")
+    return output_dir
+
+
+def open_dedup_index(index_dir: str, output_base: str, threshold: float = 0.9, num_perm: int = 128) -> MinHashIndex:
+    """
+    実行ディレクトリ名をラベルにして開く. --resume でやり直しても, 中断前に追加した文書とは突き合わせない
+    """
+    return MinHashIndex(index_dir, threshold=threshold, num_perm=num_perm,
+                        label=os.path.basename(os.path.normpath(output_base)))
 
 
-def url_dedup(input_file: str, output_base: str, output_file: str, debug: bool = False, *, logger=None) -> list[str]:
+def write_dedup_result(texts: Iterable[str], output_dir: str, max_bytes: Optional[int] = 1 << 30,
+                       max_rows: Optional[int] = None, compression: str = "none"):
+    """
+    残す文書を順に書き出す. 結果全体をプロセス間で受け渡さないので, 書き出しは文書数に比例するだけで済む
+    """
+    with ShardedWriter(output_dir, max_bytes=max_bytes, max_rows=max_rows, compression=compression) as writer:
+        for text in texts:
+            writer.write_text(text)
+
+
+def write_streaming_dedup_result(input_dir: str, doc_ids_by_file: dict[str, Sequence[Hashable]], survivors: set[Hashable],
+                                 output_dir: str, max_bytes: Optional[int] = 1 << 30, max_rows: Optional[int] = None,
+                                 compression: str = "none"):
+    """
+    残す文書を入力ファイルから順に読み出し, シャードに分けて書き出す
+    """
+    with ShardedWriter(output_dir, max_bytes=max_bytes, max_rows=max_rows, compression=compression) as writer:
+        for filename, doc_ids in doc_ids_by_file.items():
+            for doc_id, line in zip(doc_ids, read_input_lines(os.path.join(input_dir, filename))):
+                if doc_id in survivors:
+                    writer.write_text(str(json.loads(line)["text"]))
+
+
+def url_dedup(input_file: Union[str, list[str]], output_base: str, writer: ShardedWriter, debug: bool = False,
+              window: int = 1000, ttl: Optional[int] = None, index=None, *, logger=None) -> list[str]:
+    """
+    input_file にファイルのリストを渡すと, 1つのプロセスプールで全ファイルをバイト範囲に分けて処理する.
+    window > 0 のときは window 件ずつまとめて1回の往復で URL を登録する.
+    window = 0 のときは DeduplicationByURL で1件ずつ登録する.
+    index に ExactURLIndex/BloomURLIndex を渡すと Redis の代わりにこのプロセス内で重複を判定する.
+    複数のファイルで同じ index を使えば, ファイルをまたいで重複を除去できる
+    """
     logger = logger or lib.Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+    input_files = [input_file] if isinstance(input_file, str) else input_file
     redis_host = os.environ.get("REDIS_HOST", "localhost")
     redis_port = os.environ.get("REDIS_PORT", 6379)
     redis_db = os.environ.get("REDIS_DB", 0)
-    cleaner = Compose([
-        JSONHTMLLoader(),
-        DeduplicationByURL(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db, basename=output_base),
-        document_filters.JSONDumper(),
-    ])
-
-    input_doc_iter = (DocumentFromHTML(line) for line in lib.readlines(input_file))
-    num_jobs = os.environ.get("NUM_WORKER", NUM_WORKER)
-    with hojichar.Parallel(cleaner, num_jobs=num_jobs) as filter:
-        out_doc_iter = filter.imap_apply(input_doc_iter)
-        with open(output_file, "w") as writer:
-            for result in out_doc_iter:
-                try:
-                    if not result.is_rejected:
-                        writer.write(result.text + "\n")
-                except Exception as e:
-                    logger.error(f"Error processing document: {e}")
+    if index is not None:
+        window = max(window, 1)
+
+    filters = [JSONHTMLLoader()]
+    if window <= 0:
+        filters.append(DeduplicationByURL(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                                          basename=output_base, ttl=ttl))
+    filters.append(document_filters.JSONDumper())
+    cleaner = Compose(filters)
+    if index is None and window > 0:
+        index = RedisURLIndex(connect_redis(), basename=output_base, ttl=ttl)
+
+    num_duplicated = 0
+    with StagePool(cleaner, document_class=DocumentFromHTML, fields=("text", "is_rejected", "url"),
+                   num_jobs=lib.num_workers(NUM_WORKER)) as pool:
+        for result in pool.imap(input_files):
+            documents = [(text, url) for text, is_rejected, url in result.rows if not is_rejected]
+            if window <= 0:
+                writer.write_many(text for text, _ in documents)
+                continue
+
+            for i in range(0, len(documents), window):
+                batch = documents[i:i + window]
+                for (text, _), is_new in zip(batch, index.add_many(url for _, url in batch)):
+                    if is_new:
+                        writer.write(text)
+                    else:
+                        num_duplicated += 1
+        pool.log_utilization(logger, "url dedup")
+        statistics = pool.statistics
+
+    if window > 0:
+        logger.info(f"Rejected {num_duplicated} documents with duplicated urls in {', '.join(input_files)}")
 
     if debug:
         os.makedirs(os.path.join(output_base, "stat", "url_dedup"), exist_ok=True)
-        input_file_prefix = os.path.splitext(os.path.basename(input_file))[0]
-        with open(os.path.join(output_base, f"{input_file_prefix}.jsonl"), "w") as writer:
-            writer.write(json.dumps(cleaner.statistics, ensure_ascii=False) + "\n")
+        input_file_prefix = os.path.splitext(os.path.basename(input_files[0]))[0]
+        with open(os.path.join(output_base, f"{input_file_prefix}.jsonl"), "w") as stat_writer:
+            stat_writer.write(json.dumps(statistics, ensure_ascii=False) + "\n")
@@ -0,0 +1,93 @@
+import json
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+
+from preprocessing.reader import is_input_file, iter_input_with_offsets
+
+
+def input_files(input_dir: str) -> list[str]:
+    """
+    重複除去の対象となるファイル名. 並び順がファイル番号になる
+    """
+    return sorted(filename for filename in os.listdir(input_dir) if is_input_file(filename))
+
+
+def make_doc_id(file_index: int, offset: int, length: int) -> str:
+    """
+    (ファイル番号, 行のバイトオフセット, 行のバイト長) から文書IDを作る. 同じ入力からは常に同じIDになる
+    """
+    return f"{file_index}:{offset}:{length}"
+
+
+def parse_doc_id(doc_id: str) -> tuple[int, int, int]:
+    file_index, offset, length = doc_id.split(":")
+    return int(file_index), int(offset), int(length)
+
+
+def iter_lines_with_offsets(input_file: str) -> Iterator[tuple[int, bytes]]:
+    """
+    改行を除いた各行のバイト列とその先頭のオフセット. 圧縮ファイルでは展開後のオフセットになる
+    """
+    yield from iter_input_with_offsets(input_file)
+
+
+def offset_index_path(offset_dir: str, filename: str) -> str:
+    return os.path.join(offset_dir, f"{filename}.offsets.npy")
+
+
+def save_offset_index(offset_dir: str, filename: str, offsets: np.ndarray) -> None:
+    """
+    (行数, 2) の [オフセット, 長さ] を保存する. 書き終えてから名前を変えるので, 途中までのファイルは残らない
+    """
+    os.makedirs(offset_dir, exist_ok=True)
+    path = offset_index_path(offset_dir, filename)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.asarray(offsets, dtype=np.int64).reshape(-1, 2))
+    os.replace(path + ".tmp", path)
+
+
+def load_offset_index(offset_dir: str, filename: str) -> Optional[np.ndarray]:
+    path = offset_index_path(offset_dir, filename)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def doc_ids_from_offsets(file_index: int, offsets: np.ndarray) -> list[str]:
+    return [make_doc_id(file_index, offset, length) for offset, length in offsets.tolist()]
+
+
+class DocumentReader():
+    """
+    文書IDから入力ファイルの該当する行を pread で直接読み出す. 圧縮していない .jsonl のみ
+    """
+
+    def __init__(self, input_dir: str, filenames: Optional[list[str]] = None) -> None:
+        self.input_dir = input_dir
+        self.filenames = filenames if filenames is not None else input_files(input_dir)
+        self._fds: dict[int, int] = {}
+
+    def _fd(self, file_index: int) -> int:
+        if file_index not in self._fds:
+            self._fds[file_index] = os.open(os.path.join(self.input_dir, self.filenames[file_index]), os.O_RDONLY)
+        return self._fds[file_index]
+
+    def read_line(self, doc_id: str) -> bytes:
+        file_index, offset, length = parse_doc_id(doc_id)
+        return os.pread(self._fd(file_index), length, offset)
+
+    def read_text(self, doc_id: str) -> str:
+        return str(json.loads(self.read_line(doc_id))["text"])
+
+    def close(self) -> None:
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+
+    def __enter__(self) -> "DocumentReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
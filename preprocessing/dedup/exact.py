@@ -0,0 +1,114 @@
+import hashlib
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import redis
+
+from preprocessing.dedup.minhash import normalize_document
+
+
+DIGEST_SIZE = 16
+
+# 128 bit のダイジェストを1要素として比較・ソートする
+DIGEST_DTYPE = np.dtype(f"V{DIGEST_SIZE}")
+
+
+def exact_digest(text: str) -> bytes:
+    """
+    正規化した文書の 128 bit ハッシュ. 一致すれば MinHash のシグネチャも一致する
+    """
+    return hashlib.blake2b(normalize_document(text).encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+def exact_digests(texts: Iterable[str]) -> np.ndarray:
+    return np.frombuffer(b"".join(exact_digest(text) for text in texts), dtype=DIGEST_DTYPE)
+
+
+def last_occurrences(digests: np.ndarray) -> np.ndarray:
+    """
+    同じダイジェストの文書のうち, 最後に現れたもの (最大の通し番号) だけを True にする.
+    クラスタごとに最大の通し番号の文書を残すので, 代表だけで MinHash をかけても残る文書は変わらない
+    """
+    _, reversed_first = np.unique(digests[::-1], return_index=True)
+    keep = np.zeros(len(digests), dtype=bool)
+    keep[len(digests) - 1 - reversed_first] = True
+    return keep
+
+
+class RedisExactIndex():
+    """
+    ダイジェストを 2**bucket_bits 個の Redis ハッシュに振り分け, 最初に登録した文書ID (代表) を保持する.
+    登録は HSETNX で行うので, 複数のワーカーが同時に同じ文書を登録しても代表は1件に決まる.
+    ワーカーがファイルをやり直しても, 自分が代表として登録した文書は代表のまま扱う
+    """
+
+    def __init__(self, redis_client: redis.Redis, basename: str, bucket_bits: int = 20) -> None:
+        self.redis_client = redis_client
+        self.basename = basename
+        self.bucket_bits = bucket_bits
+
+    def key_prefix(self) -> str:
+        return f"{self.basename}.exact."
+
+    def _key(self, digest: bytes) -> str:
+        return f"{self.key_prefix()}{int.from_bytes(digest[:4], 'big') >> (32 - self.bucket_bits):x}"
+
+    def add_many(self, doc_ids: list[str], texts: Iterable[str]) -> list[bool]:
+        """
+        文書を登録し, 代表になった (同じ文書が他にない) 場合に True を返す
+        """
+        slots = [(doc_id, self._key(digest), digest) for doc_id, digest in zip(doc_ids, map(exact_digest, texts))]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for doc_id, key, field in slots:
+            pipe.hsetnx(key, field, doc_id)
+        inserted = pipe.execute() if slots else []
+
+        conflicts = [i for i, is_new in enumerate(inserted) if not is_new]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for i in conflicts:
+            pipe.hget(slots[i][1], slots[i][2])
+        heads = pipe.execute() if conflicts else []
+
+        added = [bool(is_new) for is_new in inserted]
+        for i, head in zip(conflicts, heads):
+            head = head.decode("utf-8") if isinstance(head, bytes) else head
+            added[i] = head == slots[i][0]
+        return added
+
+    def cleanup(self, batch_size: int = 10_000) -> int:
+        """
+        このインデックスのキーを全て削除し, 削除したキーの数を返す
+        """
+        deleted = 0
+        keys = []
+        for key in self.redis_client.scan_iter(match=f"{self.key_prefix()}*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                deleted += self.redis_client.unlink(*keys)
+                keys = []
+        if keys:
+            deleted += self.redis_client.unlink(*keys)
+        return deleted
+
+
+def duplicates_path(offset_dir: str, filename: str) -> str:
+    return os.path.join(offset_dir, f"{filename}.duplicates.npy")
+
+
+def save_duplicates(offset_dir: str, filename: str, rows: np.ndarray) -> None:
+    """
+    ファイル内で MinHash にかけなかった (他の文書と完全に一致した) 行番号を保存する
+    """
+    os.makedirs(offset_dir, exist_ok=True)
+    path = duplicates_path(offset_dir, filename)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.asarray(rows, dtype=np.int64))
+    os.replace(path + ".tmp", path)
+
+
+def load_duplicates(offset_dir: str, filename: str) -> np.ndarray:
+    path = duplicates_path(offset_dir, filename)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=np.int64)
+    return np.load(path)
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Optional
+
+import numpy as np
+
+from preprocessing.dedup.minhash import lsh_params
+
+
+INDEX_FILENAME = "index.json"
+
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def band_hashes(signatures: np.ndarray, b: int, r: int) -> np.ndarray:
+    """
+    (文書数, num_perm) のシグネチャから, バンドごとの 64 bit ハッシュ (文書数, b) を計算する
+    """
+    bands = np.asarray(signatures)[:, :b * r].reshape(len(signatures), b, r).astype(np.uint64)
+    hashes = np.full((len(signatures), b), _FNV_OFFSET, dtype=np.uint64)
+    for j in range(r):
+        hashes = (hashes ^ bands[:, :, j]) * _FNV_PRIME
+    # splitmix64 の仕上げで上位ビットまで混ぜる
+    hashes ^= hashes >> np.uint64(30)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    hashes ^= hashes >> np.uint64(31)
+    return hashes
+
+
+class Segment():
+    """
+    1回の追加で書き出す不変のファイル群. keys.npy はバンドごとにソートしたハッシュを連結したもので,
+    バンド i の範囲は offsets.npy の [i, i+1). rows.npy はそれぞれのハッシュをもつ代表文書の ids.txt 内の行番号
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+
+    @property
+    def label(self) -> Optional[str]:
+        return self.meta.get("label")
+
+    @property
+    def num_docs(self) -> int:
+        return self.meta["num_docs"]
+
+    def ids(self) -> list[str]:
+        with open(os.path.join(self.path, "ids.txt"), "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def band(self, band: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[band], self.offsets[band + 1]
+        return self.keys[start:end], self.rows[start:end]
+
+    def query(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        いずれかのバンドが一致した代表文書の行番号. 一致しなければ -1
+        """
+        matches = np.full(len(hashes), -1, dtype=np.int64)
+        for band in range(len(self.offsets) - 1):
+            keys, rows = self.band(band)
+            if len(keys) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(keys, hashes[:, band]), len(keys) - 1)
+            hit = (keys[positions] == hashes[:, band]) & (matches < 0)
+            matches[hit] = rows[positions[hit]]
+        return matches
+
+    @staticmethod
+    def write(path: str, keys: list[np.ndarray], rows: list[np.ndarray], ids: list[str], **meta) -> "Segment":
+        """
+        バンドごとにソート済みで重複のないハッシュと行番号を書き出す. 一時ディレクトリに書いてから名前を変える
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "keys.npy"), np.concatenate(keys).astype(np.uint64))
+        np.save(os.path.join(tmp_path, "rows.npy"), np.concatenate(rows).astype(np.int64))
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.cumsum([0] + [len(k) for k in keys]).astype(np.int64))
+        with open(os.path.join(tmp_path, "ids.txt"), "w", encoding="utf-8") as f:
+            f.write("".join(doc_id + "\n" for doc_id in ids))
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "num_docs": len(ids), "created_at": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return Segment(path)
+
+
+def _unique_bands(keys: list[np.ndarray], rows: list[np.ndarray]) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """
+    バンドごとに同じハッシュの最初の1件だけを残す
+    """
+    unique_keys = []
+    unique_rows = []
+    for band_keys, band_rows in zip(keys, rows):
+        band_keys, first_index = np.unique(band_keys, return_index=True)
+        unique_keys.append(band_keys)
+        unique_rows.append(np.asarray(band_rows)[first_index])
+    return unique_keys, unique_rows
+
+
+class MinHashIndex():
+    """
+    以前の実行で残した文書のバンドのハッシュと代表文書IDを directory に保持する, 名前付きの永続 LSH インデックス.
+    新しい入力は query で既存の文書と一致するものを除き, 残した文書だけを add で追加するので,
+    1回の実行のコストは新しい入力の量に比例する.
+
+    add のたびに不変のセグメントを1つ書き, それまでのセグメントに加えた新しいバージョンを index.json に記録する.
+    label を指定すると同じ label のセグメントは query の対象にせず, add で置き換える.
+    中断した実行をやり直しても, 自身が追加した文書で全て重複と判定されることはない
+    """
+
+    def __init__(self, directory: str, threshold: float = 0.9, num_perm: int = 128,
+                 label: Optional[str] = None) -> None:
+        self.directory = directory
+        self.label = label
+        self.path = os.path.join(directory, INDEX_FILENAME)
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+            if self.data["num_perm"] != num_perm or self.data["threshold"] != threshold:
+                raise ValueError(f"Index {directory} was built with num_perm={self.data['num_perm']} and "
+                                 f"threshold={self.data['threshold']}, not num_perm={num_perm} and threshold={threshold}")
+        else:
+            b, r = lsh_params(threshold, num_perm)
+            self.data = {"threshold": threshold, "num_perm": num_perm, "b": b, "r": r, "next_segment": 0,
+                         "current": 0, "versions": [{"version": 0, "segments": [], "created_at": time.time(),
+                                                     "message": "create"}]}
+        self.b = self.data["b"]
+        self.r = self.data["r"]
+        self._segments: dict[str, Segment] = {}
+
+    def save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def version(self, version: Optional[int] = None) -> dict:
+        version = self.data["current"] if version is None else version
+        for entry in self.data["versions"]:
+            if entry["version"] == version:
+                return entry
+        raise ValueError(f"Unknown index version: {version}")
+
+    def segment(self, name: str) -> Segment:
+        if name not in self._segments:
+            self._segments[name] = Segment(os.path.join(self.directory, name))
+        return self._segments[name]
+
+    def segments(self) -> list[Segment]:
+        return [self.segment(name) for name in self.version()["segments"]]
+
+    def __len__(self) -> int:
+        return sum(segment.num_docs for segment in self.segments())
+
+    def query(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        いずれかのバンドが既存の文書と一致した文書を True とする
+        """
+        hashes = band_hashes(signatures, self.b, self.r)
+        seen = np.zeros(len(signatures), dtype=bool)
+        for segment in self.segments():
+            if segment.label is None or segment.label != self.label:
+                seen |= segment.query(hashes) >= 0
+        return seen
+
+    def add(self, signatures: np.ndarray, ids: list[str], message: str = "") -> int:
+        """
+        文書を新しいセグメントとして追加し, 新しいバージョンの番号を返す. 追加する文書がなければ何もしない
+        """
+        if len(ids) == 0 and not any(segment.label == self.label for segment in self.segments()
+                                     if self.label is not None):
+            return self.data["current"]
+        hashes = band_hashes(signatures, self.b, self.r)
+        rows = np.arange(len(ids))
+        keys, rows = _unique_bands([hashes[:, band] for band in range(self.b)], [rows] * self.b)
+        name = self._next_segment_name()
+        Segment.write(os.path.join(self.directory, name), keys, rows, ids, label=self.label)
+
+        segments = [segment.name for segment in self.segments()
+                    if self.label is None or segment.label != self.label]
+        return self._commit(segments + [name], message or f"add {len(ids)} documents")
+
+    def compact(self) -> int:
+        """
+        現在のバージョンのセグメントを1つにまとめる. どのバンドでも最初に一致しない代表文書は除く
+        """
+        segments = self.segments()
+        if len(segments) <= 1:
+            return self.data["current"]
+
+        ids: list[str] = []
+        keys: list[list[np.ndarray]] = [[] for _ in range(self.b)]
+        rows: list[list[np.ndarray]] = [[] for _ in range(self.b)]
+        for segment in segments:
+            for band in range(self.b):
+                band_keys, band_rows = segment.band(band)
+                keys[band].append(np.asarray(band_keys))
+                rows[band].append(np.asarray(band_rows) + len(ids))
+            ids.extend(segment.ids())
+        keys, rows = _unique_bands([np.concatenate(k) for k in keys], [np.concatenate(r) for r in rows])
+
+        referenced = np.unique(np.concatenate(rows))
+        remap = np.full(len(ids), -1, dtype=np.int64)
+        remap[referenced] = np.arange(len(referenced))
+        name = self._next_segment_name()
+        Segment.write(os.path.join(self.directory, name), keys, [remap[r] for r in rows],
+                      [ids[row] for row in referenced.tolist()], label=None,
+                      compacted_from=[segment.name for segment in segments])
+        return self._commit([name], f"compact {len(segments)} segments")
+
+    def checkout(self, version: int) -> None:
+        self.data["current"] = self.version(version)["version"]
+        self.save()
+
+    def prune(self, keep: int = 1) -> list[str]:
+        """
+        最新の keep 個と現在のバージョンだけを残し, どのバージョンからも参照されないセグメントを削除する
+        """
+        versions = sorted(self.data["versions"], key=lambda entry: entry["version"])
+        kept = versions[-keep:] if keep > 0 else []
+        if self.version() not in kept:
+            kept.append(self.version())
+        self.data["versions"] = sorted(kept, key=lambda entry: entry["version"])
+        self.save()
+
+        referenced = {name for entry in self.data["versions"] for name in entry["segments"]}
+        removed = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("segment-") and name not in referenced:
+                shutil.rmtree(os.path.join(self.directory, name))
+                self._segments.pop(name, None)
+                removed.append(name)
+        return removed
+
+    def _next_segment_name(self) -> str:
+        name = f"segment-{self.data['next_segment']:05d}"
+        self.data["next_segment"] += 1
+        return name
+
+    def _commit(self, segments: list[str], message: str) -> int:
+        version = max(entry["version"] for entry in self.data["versions"]) + 1
+        self.data["versions"].append({"version": version, "segments": segments, "created_at": time.time(),
+                                      "label": self.label, "message": message})
+        self.data["current"] = version
+        self.save()
+        return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the persistent minhash index used by incremental dedup.')
+    parser.add_argument('command', choices=['info', 'compact', 'checkout', 'prune'])
+    parser.add_argument('--index_dir', type=str, help='The directory of the index', required=True)
+    parser.add_argument('--version', type=int, help='The version to checkout', required=False, default=None)
+    parser.add_argument('--keep', type=int, help='The number of latest versions kept by prune', required=False,
+                        default=1)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.index_dir, INDEX_FILENAME), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    index = MinHashIndex(args.index_dir, threshold=data["threshold"], num_perm=data["num_perm"])
+
+    if args.command == 'info':
+        print(f"threshold={data['threshold']} num_perm={data['num_perm']} b={index.b} r={index.r}")
+        for entry in data["versions"]:
+            marker = "*" if entry["version"] == data["current"] else " "
+            num_docs = sum(index.segment(name).num_docs for name in entry["segments"])
+            print(f"{marker} {entry['version']}: {len(entry['segments'])} segments, {num_docs} documents, "
+                  f"{entry['message']}")
+    elif args.command == 'compact':
+        print(f"Created version {index.compact()}")
+    elif args.command == 'checkout':
+        if args.version is None:
+            parser.error("checkout needs --version")
+        index.checkout(args.version)
+        print(f"Checked out version {args.version}")
+    elif args.command == 'prune':
+        removed = index.prune(args.keep)
+        print(f"Removed {len(removed)} segments")
+
+
+if __name__ == "__main__":
+    main()
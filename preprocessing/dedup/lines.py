@@ -0,0 +1,110 @@
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Optional
+
+import numpy as np
+
+from preprocessing.dedup.minhash import normalize_document
+
+
+# 分割した計数の表の1件 (行の 64 bit ハッシュと, その行を含む文書数)
+_COUNT_DTYPE = np.dtype([("key", "<u8"), ("count", "<i8")])
+
+
+def line_hash(line: str) -> Optional[int]:
+    """
+    正規化した行の 64 bit ハッシュ. 正規化すると空になる行は None
+    """
+    line = normalize_document(line)
+    if not line:
+        return None
+    return int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def line_hashes(lines: Iterable[str]) -> np.ndarray:
+    """
+    文書に含まれる行のハッシュ (重複なし). 同じ文書の中で繰り返す行は1回だけ数える
+    """
+    hashes = [value for value in map(line_hash, lines) if value is not None]
+    return np.unique(np.array(hashes, dtype=np.uint64))
+
+
+class LineCounter():
+    """
+    行のハッシュごとに, その行を含む文書の数を数える.
+
+    追加したハッシュは buffer_size 件まで溜め, 溜まったら np.unique で数えてハッシュの上位ビットで
+    num_partitions 個に分け, spill_dir の一時ファイルに追記する. frequent では分割ごとに読み込んでソートし,
+    同じハッシュの件数を合計する. メモリは buffer_size と分割1つ分の大きさで抑えられる
+    """
+
+    def __init__(self, spill_dir: Optional[str] = None, num_partitions: int = 64, buffer_size: int = 1 << 24) -> None:
+        if num_partitions & (num_partitions - 1):
+            raise ValueError(f"num_partitions must be a power of two: {num_partitions}")
+        self.num_partitions = num_partitions
+        self.buffer_size = buffer_size
+        self.num_documents = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self._tmpdir = tempfile.TemporaryDirectory(dir=spill_dir)
+        self._paths = [os.path.join(self._tmpdir.name, f"{partition}.bin") for partition in range(num_partitions)]
+        self._buffer: list[np.ndarray] = []
+        self._buffered = 0
+
+    def __enter__(self) -> "LineCounter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._tmpdir.cleanup()
+
+    def add(self, hashes: np.ndarray) -> None:
+        """
+        1文書の行のハッシュ (重複なし) を追加する
+        """
+        self.num_documents += 1
+        self._buffer.append(hashes)
+        self._buffered += len(hashes)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        keys, counts = np.unique(np.concatenate(self._buffer).astype(np.uint64), return_counts=True)
+        self._buffer = []
+        self._buffered = 0
+
+        records = np.empty(len(keys), dtype=_COUNT_DTYPE)
+        records["key"] = keys
+        records["count"] = counts
+        # keys はソート済みなので, 上位ビットの分割も連続した範囲になる
+        shift = np.uint64(64 - (self.num_partitions.bit_length() - 1))
+        partitions = (keys >> shift).astype(np.int64) if self.num_partitions > 1 else np.zeros(len(keys), dtype=np.int64)
+        bounds = np.searchsorted(partitions, np.arange(self.num_partitions + 1))
+        for partition in range(self.num_partitions):
+            if bounds[partition] < bounds[partition + 1]:
+                with open(self._paths[partition], "ab") as f:
+                    records[bounds[partition]:bounds[partition + 1]].tofile(f)
+
+    def frequent(self, min_count: int, stats: Optional[dict] = None) -> np.ndarray:
+        """
+        min_count 個以上の文書に含まれる行のハッシュをソートして返す.
+        stats を渡すと, 異なる行の数を "distinct" に加える
+        """
+        self.flush()
+        result = []
+        for path in self._paths:
+            if not os.path.exists(path):
+                continue
+            records = np.fromfile(path, dtype=_COUNT_DTYPE)
+            records.sort(order="key", kind="stable")
+            starts = np.flatnonzero(np.r_[True, records["key"][1:] != records["key"][:-1]])
+            counts = np.add.reduceat(records["count"], starts)
+            result.append(records["key"][starts[counts >= min_count]])
+            if stats is not None:
+                stats["distinct"] = stats.get("distinct", 0) + len(starts)
+        return np.concatenate(result) if result else np.empty(0, dtype=np.uint64)
@@ -0,0 +1,163 @@
+from multiprocessing import Pool
+import json
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from preprocessing.dedup.exact import exact_digests, last_occurrences
+from preprocessing.dedup.index import MinHashIndex
+from preprocessing.dedup.lsh import iter_band_edges
+from preprocessing.dedup.minhash import compute_signatures, count_edges, lsh_params, verify_edges
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER
+from preprocessing.models.datastructures.unionfind import UnionFind
+from preprocessing.reader import read_input_lines
+import preprocessing.lib as lib
+
+
+def _file_signatures(args) -> tuple[str, np.ndarray]:
+    input_file, n, num_perm, shingler, keep = args
+    texts = [str(json.loads(line)["text"]) for i, line in enumerate(read_input_lines(input_file))
+             if keep is None or keep[i]]
+    # 値は 32 bit に収まるので, プロセス間の転送量を半分にする
+    return input_file, compute_signatures(texts, n, num_perm, shingler=shingler).astype(np.uint32)
+
+
+def compute_file_signatures(input_files: list[str], n: int = 5, num_perm: int = 128, shingler: str = DEFAULT_SHINGLER,
+                            num_jobs: int = 1, keep: Optional[dict[str, np.ndarray]] = None) -> dict[str, np.ndarray]:
+    """
+    ファイルごとの (文書数, num_perm) シグネチャを複数プロセスで計算する.
+    keep を渡すと, ファイルごとのマスクが True の行だけを計算する
+    """
+    args = [(input_file, n, num_perm, shingler, keep[input_file] if keep is not None else None)
+            for input_file in input_files]
+    with Pool(num_jobs) as pool:
+        return dict(pool.imap_unordered(_file_signatures, args))
+
+
+def _file_digests(input_file: str) -> tuple[str, np.ndarray]:
+    return input_file, exact_digests(str(json.loads(line)["text"]) for line in read_input_lines(input_file))
+
+
+def compute_file_digests(input_files: list[str], num_jobs: int = 1) -> dict[str, np.ndarray]:
+    """
+    ファイルごとに, 正規化した文書の 128 bit ダイジェストを複数プロセスで計算する
+    """
+    with Pool(num_jobs) as pool:
+        return dict(pool.imap_unordered(_file_digests, input_files))
+
+
+def band_edges(signatures: np.ndarray, b: int, r: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    いずれかのバンドが完全に一致する文書の組を, バケット内で最初の文書への辺として返す.
+    MinHashLSH の候補と同じ連結成分になる
+    """
+    edges = list(iter_band_edges(signatures, b, r))
+    if not edges:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate([src for src, _ in edges]), np.concatenate([dst for _, dst in edges])
+
+
+def cluster_signatures(signatures: np.ndarray, threshold: float = 0.9, max_memory: int = 4 << 30,
+                       spill_dir: Optional[str] = None, verify: bool = True, stats: Optional[dict] = None) -> UnionFind:
+    """
+    バンドの表が max_memory を超えるときは spill_dir に書き出してソートする. 辺はバンドごとに併合する.
+    verify=True のときは推定 Jaccard 係数が threshold 未満の辺を併合せず, その数を stats に加える
+    """
+    b, r = lsh_params(threshold, signatures.shape[1])
+    uf = UnionFind(len(signatures))
+    for src, dst in iter_band_edges(signatures, b, r, max_memory=max_memory, spill_dir=spill_dir):
+        if verify:
+            keep = verify_edges(signatures, src, dst, threshold)
+            count_edges(stats, keep)
+            src, dst = src[keep], dst[keep]
+        uf.union_edges(src, dst)
+    return uf
+
+
+def representatives(uf: UnionFind) -> set[int]:
+    """
+    クラスタごとに最大の通し番号をもつ文書
+    """
+    order, offsets = uf.group_offsets()
+    return set(np.maximum.reduceat(order, offsets[:-1]).tolist()) if len(order) else set()
+
+
+def select_survivors(signatures: np.ndarray, threshold: float = 0.9, spill_dir: Optional[str] = None,
+                     stats: Optional[dict] = None) -> set[int]:
+    """
+    Redis 版と同様に, クラスタ内で最大の通し番号をもつ文書を残す
+    """
+    return representatives(cluster_signatures(signatures, threshold, spill_dir=spill_dir, stats=stats))
+
+
+def select_new_survivors(signatures: np.ndarray, threshold: float = 0.9,
+                         index: Optional[MinHashIndex] = None, spill_dir: Optional[str] = None,
+                         stats: Optional[dict] = None) -> tuple[set[int], int]:
+    """
+    index にある文書と一致するものを除いてから select_survivors を行う.
+    残す文書の通し番号と, index と一致した文書の数を返す
+    """
+    if index is None:
+        return select_survivors(signatures, threshold, spill_dir, stats), 0
+    seen = index.query(signatures)
+    candidates = np.flatnonzero(~seen)
+    survivors = select_survivors(signatures[candidates], threshold, spill_dir, stats)
+    return set(candidates[sorted(survivors)].tolist()), int(seen.sum())
+
+
+def deduplicate_local(input_files: list[str], shingler: str = DEFAULT_SHINGLER, n: int = 5, num_perm: int = 128,
+                      threshold: float = 0.9, num_jobs: int = 1, index: Optional[MinHashIndex] = None,
+                      spill_dir: Optional[str] = None, *, logger=None) -> tuple[dict[str, range], set[int]]:
+    """
+    Redis を使わずに, 1台のマシン上で MinHash による重複除去を行う.
+    入力ファイルごとの文書ID (通し番号) と, 残す文書IDの集合を返す.
+    index を渡すと以前の実行で残した文書と一致するものも除き, 残した文書を index に追加する.
+    正規化した本文が完全に一致する文書は先にダイジェストでまとめ, 代表だけにシグネチャを計算する
+    """
+    logger = logger or lib.Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+
+    starttime = time.time()
+    digests_by_file = compute_file_digests(input_files, num_jobs)
+    doc_ids_by_file: dict[str, range] = {}
+    start = 0
+    for input_file in input_files:
+        num_docs = len(digests_by_file[input_file])
+        doc_ids_by_file[input_file] = range(start, start + num_docs)
+        start += num_docs
+    keep = last_occurrences(np.concatenate([digests_by_file.pop(input_file) for input_file in input_files])) \
+        if input_files else np.zeros(0, dtype=bool)
+    # シグネチャの行番号から通し番号への対応
+    rows = np.flatnonzero(keep)
+    endtime = time.time()
+    logger.info(f"Processing time to find exact duplicates : {endtime - starttime}")
+    logger.info(f"Skipped signing {len(keep) - len(rows)} of {len(keep)} documents (exact duplicates)")
+
+    starttime = time.time()
+    signatures_by_file = compute_file_signatures(
+        input_files, n, num_perm, shingler, num_jobs,
+        keep={input_file: keep[doc_ids.start:doc_ids.stop] for input_file, doc_ids in doc_ids_by_file.items()})
+    signatures = np.concatenate([signatures_by_file.pop(input_file) for input_file in input_files]) \
+        if input_files else np.empty((0, num_perm), dtype=np.uint32)
+    endtime = time.time()
+    logger.info(f"Processing time to compute minhash signatures : {endtime - starttime}")
+
+    starttime = time.time()
+    stats: dict = {}
+    selected, num_seen = select_new_survivors(signatures, threshold, index, spill_dir, stats)
+    selected = sorted(selected)
+    survivors = set(rows[selected].tolist())
+    endtime = time.time()
+    logger.info(f"Processing time to dedup: {endtime - starttime}")
+    logger.info(f"Rejected {stats.get('rejected', 0)} of {stats.get('candidates', 0)} candidate edges "
+                f"below the threshold {threshold}")
+
+    if index is not None:
+        logger.info(f"Dropped {num_seen} documents found in the index {index.directory}")
+        ids = [f"{os.path.basename(input_file)}:{row - doc_ids.start}"
+               for input_file, doc_ids in doc_ids_by_file.items() for row in doc_ids if row in survivors]
+        version = index.add(signatures[selected], ids)
+        logger.info(f"Added {len(ids)} documents to the index as version {version}")
+
+    return doc_ids_by_file, survivors
@@ -0,0 +1,95 @@
+import os
+import tempfile
+from typing import Iterator, Optional
+
+import numpy as np
+
+from preprocessing.dedup.index import band_hashes
+
+
+# 分割したバンドの表の1件 (64 bit のハッシュと通し番号)
+_RECORD_DTYPE = np.dtype([("key", "<u8"), ("row", "<i8")])
+
+
+def _bucket_edges(keys: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    同じハッシュの文書を, その中で最小の通し番号の文書 (バケットの先頭) への辺にする. rows は昇順に並んでいること
+    """
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    rows = rows[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    heads = np.repeat(rows[starts], np.diff(np.r_[starts, len(keys)]))
+    duplicated = rows != heads
+    return rows[duplicated], heads[duplicated]
+
+
+def _verify_band(signatures: np.ndarray, src: np.ndarray, dst: np.ndarray, band: int, r: int,
+                 chunk_size: int = 1 << 20) -> np.ndarray:
+    """
+    ハッシュの衝突を除くため, バンドの値そのものが一致する辺だけを True とする
+    """
+    same = np.empty(len(src), dtype=bool)
+    columns = slice(band * r, (band + 1) * r)
+    for start in range(0, len(src), chunk_size):
+        end = start + chunk_size
+        same[start:end] = np.all(signatures[src[start:end], columns] == signatures[dst[start:end], columns], axis=1)
+    return same
+
+
+def iter_band_edges(signatures: np.ndarray, b: int, r: int, max_memory: int = 4 << 30, spill_dir: Optional[str] = None,
+                    chunk_rows: int = 1 << 20) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    いずれかのバンドが完全に一致する文書の組を, バケット内で最初の文書への辺として順に返す.
+    MinHashLSH の候補と同じ連結成分になる.
+
+    シグネチャ (メモリマップでもよい) を chunk_rows 行ずつ読んで各バンドを 64 bit のハッシュにし, ソートしてまとめる.
+    バンドの表 (1件 16 バイト) の合計が max_memory を超えるときは, ハッシュの上位ビットで分割して spill_dir に書き出し,
+    分割ごとに読み込んでソートする
+    """
+    n = len(signatures)
+    num_partitions = 1
+    while n * b * _RECORD_DTYPE.itemsize > max_memory * num_partitions:
+        num_partitions *= 2
+
+    if num_partitions == 1:
+        keys = np.empty((b, n), dtype=np.uint64)
+        for start in range(0, n, chunk_rows):
+            keys[:, start:start + chunk_rows] = band_hashes(signatures[start:start + chunk_rows], b, r).T
+        rows = np.arange(n, dtype=np.int64)
+        for band in range(b):
+            src, dst = _bucket_edges(keys[band], rows)
+            same = _verify_band(signatures, src, dst, band, r)
+            yield src[same], dst[same]
+        return
+
+    shift = np.uint64(64 - num_partitions.bit_length() + 1)
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmpdir:
+        paths = [[os.path.join(tmpdir, f"{band}-{partition}.bin") for partition in range(num_partitions)]
+                 for band in range(b)]
+        writers = [[open(path, "wb") for path in band_paths] for band_paths in paths]
+        try:
+            for start in range(0, n, chunk_rows):
+                hashes = band_hashes(signatures[start:start + chunk_rows], b, r)
+                rows = np.arange(start, start + len(hashes), dtype=np.int64)
+                for band in range(b):
+                    records = np.empty(len(hashes), dtype=_RECORD_DTYPE)
+                    records["key"] = hashes[:, band]
+                    records["row"] = rows
+                    partitions = (records["key"] >> shift).astype(np.int64)
+                    order = np.argsort(partitions, kind="stable")
+                    bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1))
+                    for partition in range(num_partitions):
+                        records[order[bounds[partition]:bounds[partition + 1]]].tofile(writers[band][partition])
+        finally:
+            for band_writers in writers:
+                for writer in band_writers:
+                    writer.close()
+
+        for band in range(b):
+            for path in paths[band]:
+                records = np.fromfile(path, dtype=_RECORD_DTYPE)
+                os.remove(path)
+                src, dst = _bucket_edges(records["key"], records["row"])
+                same = _verify_band(signatures, src, dst, band, r)
+                yield src[same], dst[same]
@@ -1,10 +1,17 @@
 from datasketch import MinHash, MinHashLSH
-from transformers import GPT2Tokenizer
+from datasketch.hashfunc import sha1_hash32
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import Iterable, Optional
+import numpy as np
 import unicodedata
 import re
 import os
+import signal
+import tempfile
 
 from preprocessing.lib import Logger
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER, get_shingler
 from preprocessing.models.datastructures.unionfind import UnionFind
 
 
@@ -24,44 +31,112 @@ def normalize_document(text: str):
     return text
 
 
-def create_minhash(text: str, n: int = 5, num_perm: int = 128, redis=None, doc_id: str = ""):
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+@lru_cache(maxsize=None)
+def get_permutations(num_perm: int = 128, seed: int = 1) -> np.ndarray:
     """
-    文書をトークン化し、MinHashオブジェクトを生成する関数
+    datasketch.MinHash と同じ置換関数のパラメータ (2, num_perm) をプロセス内で使い回す
+    """
+    permutations = MinHash(num_perm=num_perm, seed=seed).permutations
+    permutations.setflags(write=False)
+    return permutations
+
+
+def minhash_signatures(shingle_sets: list[set[str]], num_perm: int = 128, seed: int = 1,
+                       chunk_size: int = 8192) -> np.ndarray:
+    """
+    シングルの集合のリストから (文書数, num_perm) の MinHash シグネチャを一括で計算する関数
+    datasketch.MinHash.update を繰り返した結果とビット単位で一致する
+    """
+    a, b = get_permutations(num_perm, seed)
+    signatures = np.full((len(shingle_sets), num_perm), _MAX_HASH, dtype=np.uint64)
+
+    sizes = np.array([len(shingles) for shingles in shingle_sets], dtype=np.int64)
+    hashes = np.fromiter((sha1_hash32(shingle.encode('utf8')) for shingles in shingle_sets for shingle in shingles),
+                         dtype=np.uint64, count=int(sizes.sum()))
+    doc_indices = np.repeat(np.arange(len(shingle_sets)), sizes)
+
+    for start in range(0, len(hashes), chunk_size):
+        hv = hashes[start:start + chunk_size, np.newaxis]
+        phv = np.bitwise_and((hv * a + b) % _MERSENNE_PRIME, _MAX_HASH)
+
+        chunk_doc_indices = doc_indices[start:start + chunk_size]
+        boundaries = np.flatnonzero(np.r_[True, chunk_doc_indices[1:] != chunk_doc_indices[:-1]])
+        rows = chunk_doc_indices[boundaries]
+        signatures[rows] = np.minimum(signatures[rows], np.minimum.reduceat(phv, boundaries, axis=0))
+
+    return signatures
+
+
+def compute_signatures(texts: list[str], n: int = 5, num_perm: int = 128, seed: int = 1,
+                       shingler: str = DEFAULT_SHINGLER) -> np.ndarray:
+    """
+    文書のリストをトークン化し, (文書数, num_perm) の MinHash シグネチャを計算する関数
+    """
+    return minhash_signatures([normalize_and_tokenize(text, n, shingler) for text in texts], num_perm, seed)
+
+
+def to_minhash(signature: np.ndarray, seed: int = 1) -> MinHash:
+    # LSH のバンドのキーは uint64 のバイト列なので, キャッシュの uint32 から変換する
+    return MinHash(seed=seed, hashvalues=signature.astype(np.uint64), permutations=get_permutations(len(signature), seed))
+
+
+def load_minhashes(doc_ids: Iterable[str], cache) -> dict[str, MinHash]:
+    """
+    キャッシュされた MinHash を読み込む関数. キャッシュのない文書は含まれない
+    """
+    return {doc_id: to_minhash(signature) for doc_id, signature in cache.get_many(doc_ids).items()}
+
+
+def get_signatures(documents: dict[str, str], n: int = 5, num_perm: int = 128, cache=None,
+                   shingler: str = DEFAULT_SHINGLER) -> np.ndarray:
+    """
+    文書の順に (文書数, num_perm) のシグネチャを返す関数. キャッシュにないものだけを計算してキャッシュに追加する
     """
-    if redis is not None and doc_id != "":
-        minhash = redis.lrange(f"dedup_files.minhash.{doc_id}", 0, -1)
-        if minhash:
-            return MinHash(num_perm, hashvalues=list(minhash))
+    cached = cache.get_many(documents) if cache is not None else {}
+    doc_ids = [doc_id for doc_id in documents if doc_id not in cached]
+    computed = compute_signatures([documents[doc_id] for doc_id in doc_ids], n, num_perm, shingler=shingler)
+    if cache is not None and doc_ids:
+        cache.set_many(doc_ids, computed)
 
-    n_grams = normalize_and_tokenize(text, n)
-    minhash = MinHash(num_perm=num_perm)
-    for n_gram in n_grams:
-        minhash.update(n_gram.encode('utf8'))
+    signatures = np.empty((len(documents), num_perm), dtype=np.uint64)
+    computed_rows = dict(zip(doc_ids, range(len(doc_ids))))
+    for i, doc_id in enumerate(documents):
+        signatures[i] = cached[doc_id] if doc_id in cached else computed[computed_rows[doc_id]]
+    return signatures
 
-    if redis:
-        redis.rpush(f"dedup_files.minhash.{doc_id}", *[str(v) for v in minhash.hashvalues])
 
-    return minhash
+def create_minhashes(documents: dict[str, str], n: int = 5, num_perm: int = 128, cache=None,
+                     shingler: str = DEFAULT_SHINGLER) -> dict[str, MinHash]:
+    """
+    文書をまとめてトークン化し、MinHashオブジェクトを生成する関数
+    """
+    signatures = get_signatures(documents, n, num_perm, cache, shingler)
+    return {doc_id: to_minhash(signature) for doc_id, signature in zip(documents, signatures)}
 
 
-def tokenize_docs(text: str, n=5):
+def create_minhash(text: str, n: int = 5, num_perm: int = 128, cache=None, doc_id: str = "",
+                   shingler: str = DEFAULT_SHINGLER):
     """
     文書をトークン化し、MinHashオブジェクトを生成する関数
     """
-    tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-    tokens = tokenizer.tokenize(text)
+    if cache is not None and doc_id != "":
+        return create_minhashes({doc_id: text}, n, num_perm, cache, shingler)[doc_id]
 
-    return set([' '.join(tokens[i:i+n]) for i in range(len(tokens) - n + 1)])
+    return to_minhash(compute_signatures([text], n, num_perm, shingler=shingler)[0])
 
 
-def normalize_and_tokenize(text: str, n: int = 5):
+def normalize_and_tokenize(text: str, n: int = 5, shingler: str = DEFAULT_SHINGLER):
     normalized_text = normalize_document(text)
-    return tokenize_docs(normalized_text, n)
+    return get_shingler(shingler)(normalized_text, n)
 
 
-def process_batch(batch: dict[str, str], lsh, n=5, num_perm=128, *, redis=None, logger=None):
+def process_batch(batch: dict[str, str], lsh, n=5, num_perm=128, *, cache=None, shingler: str = DEFAULT_SHINGLER, logger=None):
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
-    minhashes = {doc_id: create_minhash(text, n, num_perm, redis, doc_id) for doc_id, text in batch.items()}
+    minhashes = create_minhashes(batch, n, num_perm, cache, shingler)
     with lsh.insertion_session() as session:
         for doc_id, minhash in minhashes.items():
             try:
@@ -71,11 +146,13 @@ def process_batch(batch: dict[str, str], lsh, n=5, num_perm=128, *, redis=None,
                 logger.error(e)
 
 
-def create_minhash_index(lsh: MinHashLSH, documents: dict[str, str], batch_size=1000, redis=None):
+def create_minhash_index(lsh: MinHashLSH, documents: dict[str, str], batch_size=1000, cache=None, shingler: str = DEFAULT_SHINGLER):
     doc_ids = list(documents.keys())
     for i in range(0, len(documents), batch_size):
         batch = {doc_id: documents[doc_id] for doc_id in doc_ids[i:i+batch_size]}
-        process_batch(batch, lsh, redis=redis)
+        process_batch(batch, lsh, cache=cache, shingler=shingler)
+    if cache is not None:
+        cache.flush()
     return lsh
 
 
@@ -85,30 +162,295 @@ def create_minhash_lsh(threshold=0.9, num_perm=128, storage_config=None):
             'type': os.environ.get('LSH_STORAGE_CONFIG_TYPE', 'dict'),
             'name': os.environ.get('LSH_STORAGE_CONFIG_NAME'),
         }
-    return MinHashLSH(threshold=threshold, num_perm=num_perm, storage_config=storage_config)
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm, storage_config=storage_config)
+    # MinHashLSH は閾値を保持しないので, 候補の検証に使えるように残しておく
+    lsh.threshold = threshold
+    return lsh
 
 
-def deduplicate_documents(documents: dict[str, str], lsh: MinHashLSH, n: int = 5, num_perm: int = 128, *, redis=None, logger=None) -> list[str]:
-    logger = logger or Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+def lsh_params(threshold: float = 0.9, num_perm: int = 128) -> tuple[int, int]:
+    """
+    create_minhash_lsh と同じ (バンド数, バンドあたりの行数) を返す
+    """
+    lsh = create_minhash_lsh(threshold=threshold, num_perm=num_perm, storage_config={'type': 'dict'})
+    return lsh.b, lsh.r
+
+
+def estimated_jaccard(signatures1: np.ndarray, signatures2: np.ndarray) -> np.ndarray:
+    """
+    行ごとに一致する MinHash の値の割合 (Jaccard 係数の推定値)
+    """
+    return np.count_nonzero(signatures1 == signatures2, axis=1) / signatures1.shape[1]
+
+
+def verify_edges(signatures: np.ndarray, src: np.ndarray, dst: np.ndarray, threshold: float,
+                 chunk_size: int = 1 << 18) -> np.ndarray:
+    """
+    推定した Jaccard 係数が threshold 以上の辺を True とする. 偶然バンドが一致しただけの文書を連結しないために使う
+    """
+    keep = np.empty(len(src), dtype=bool)
+    for start in range(0, len(src), chunk_size):
+        end = start + chunk_size
+        keep[start:end] = estimated_jaccard(signatures[src[start:end]], signatures[dst[start:end]]) >= threshold
+    return keep
+
+
+def count_edges(stats: Optional[dict], keep: np.ndarray) -> None:
+    """
+    検証した辺の数 (candidates) と閾値未満で除いた辺の数 (rejected) を stats に加える
+    """
+    if stats is not None:
+        stats["candidates"] = stats.get("candidates", 0) + len(keep)
+        stats["rejected"] = stats.get("rejected", 0) + int(np.count_nonzero(~keep))
+
 
-    uf = UnionFind(list(documents.keys()))
-    for idx, doc in documents.items():
-        m = create_minhash(doc, n, num_perm, redis, idx)
-        try:
-            result = lsh.query(m)
-        except ValueError as e:
-            logger.error(f"Error in querying {idx}")
-            logger.error(e)
-        for res in result:
+def verify_candidates(pairs: list[tuple[str, str]], minhashes: dict[str, MinHash], cache, threshold: float) -> np.ndarray:
+    """
+    (文書ID, 候補の文書ID) の組を verify_edges と同じ基準で検証する. 候補の MinHash が minhashes になければ
+    cache から読み, どちらにもない組は検証せずに残す
+    """
+    missing = list({candidate for _, candidate in pairs if candidate not in minhashes})
+    cached = cache.get_many(missing) if cache is not None and missing else {}
+    signatures: dict[str, np.ndarray] = {doc_id: minhash.hashvalues for doc_id, minhash in minhashes.items()}
+    signatures.update(cached)
+
+    keep = np.ones(len(pairs), dtype=bool)
+    rows = [i for i, (_, candidate) in enumerate(pairs) if candidate in signatures]
+    if rows:
+        left = np.array([signatures[pairs[i][0]] for i in rows], dtype=np.uint64)
+        right = np.array([signatures[pairs[i][1]] for i in rows], dtype=np.uint64)
+        keep[rows] = estimated_jaccard(left, right) >= threshold
+    return keep
+
+
+def cluster_documents(doc_ids: list[str], minhash_batches: Iterable[dict[str, MinHash]], lsh: MinHashLSH,
+                      *, cache=None, threshold: Optional[float] = None, stats: Optional[dict] = None,
+                      logger) -> UnionFind:
+    """
+    LSH で見つかった候補同士を同じクラスタにまとめる関数. 文書の本文は必要としない.
+    threshold を指定すると, 推定 Jaccard 係数が threshold 未満の候補はバッチごとにまとめて除き, その数を stats に加える
+    """
+    uf = UnionFind(doc_ids)
+    src: list[int] = []
+    dst: list[int] = []
+    for minhashes in minhash_batches:
+        pairs: list[tuple[str, str]] = []
+        batch_src: list[int] = []
+        batch_dst: list[int] = []
+        for idx, m in minhashes.items():
+            try:
+                result = lsh.query(m)
+            except ValueError as e:
+                logger.error(f"Error in querying {idx}")
+                logger.error(e)
+                continue
+            for res in result:
+                if res == idx:
+                    continue
+                try:
+                    edge = (uf.index(idx), uf.index(res))
+                except KeyError:
+                    logger.error(f"Error in union {idx} and {res}")
+                    continue
+                batch_src.append(edge[0])
+                batch_dst.append(edge[1])
+                pairs.append((idx, res))
+        if threshold is not None and pairs:
+            keep = verify_candidates(pairs, minhashes, cache, threshold)
+            count_edges(stats, keep)
+            batch_src = np.array(batch_src)[keep].tolist()
+            batch_dst = np.array(batch_dst)[keep].tolist()
+        src.extend(batch_src)
+        dst.extend(batch_dst)
+    uf.union_edges(np.array(src), np.array(dst))
+    return uf
+
+
+_query_lsh: Optional[MinHashLSH] = None
+_query_cache = None
+_query_keys: Optional[np.ndarray] = None
+_query_order: Optional[np.ndarray] = None
+_query_sorted_keys: Optional[np.ndarray] = None
+_query_edge_dir: str = ""
+_query_threshold: Optional[float] = None
+
+
+def _init_query_worker(lsh: MinHashLSH, cache, keys: np.ndarray, order: np.ndarray, edge_dir: str,
+                       threshold: Optional[float]) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global _query_lsh, _query_cache, _query_keys, _query_order, _query_sorted_keys, _query_edge_dir, _query_threshold
+    _query_lsh = lsh
+    _query_cache = cache
+    _query_keys = keys
+    _query_order = order
+    _query_sorted_keys = keys[order]
+    _query_edge_dir = edge_dir
+    _query_threshold = threshold
+
+
+def _query_range(args) -> tuple[str, int, int, dict]:
+    """
+    通し番号 [start, end) の文書を問い合わせ, (通し番号, 候補の通し番号) の辺を npy に書き出す.
+    閾値が指定されていれば, 範囲内の全ての辺の両端のシグネチャをまとめて読んで検証する.
+    書き出したパス, 辺の数, 失敗した問い合わせの数, 検証の統計を返す
+    """
+    start, end, batch_size = args
+    sorted_keys = _query_sorted_keys
+    src: list[int] = []
+    candidates: list[bytes] = []
+    num_errors = 0
+    for batch_start in range(start, end, batch_size):
+        batch_end = min(batch_start + batch_size, end)
+        batch = [key.decode("utf-8") for key in _query_keys[batch_start:batch_end].tolist()]
+        minhashes = load_minhashes(batch, _query_cache)
+        for position, doc_id in enumerate(batch, start=batch_start):
+            if doc_id not in minhashes:
+                num_errors += 1
+                continue
             try:
-                uf.union(idx, res)
-            except KeyError:
-                logger.error(f"Error in union {idx} and {res}")
-    clusters = uf.groups()
+                result = _query_lsh.query(minhashes[doc_id])
+            except ValueError:
+                num_errors += 1
+                continue
+            for candidate in result:
+                src.append(position)
+                candidates.append(candidate.encode("utf-8") if isinstance(candidate, str) else candidate)
+
+    src_array = np.array(src, dtype=np.int64)
+    candidate_array = np.array(candidates, dtype=bytes)
+    positions = np.minimum(np.searchsorted(sorted_keys, candidate_array), max(len(sorted_keys) - 1, 0))
+    found = sorted_keys[positions] == candidate_array if len(candidate_array) else np.zeros(0, dtype=bool)
+    num_errors += int(np.count_nonzero(~found))
+    edges = np.stack([src_array[found], _query_order[positions[found]]], axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+
+    stats: dict = {}
+    if _query_threshold is not None and len(edges):
+        rows, inverse = np.unique(edges, return_inverse=True)
+        row_ids = [key.decode("utf-8") for key in _query_keys[rows].tolist()]
+        cached = _query_cache.get_many(row_ids)
+        has_signature = np.array([doc_id in cached for doc_id in row_ids])
+        signatures = np.zeros((len(rows), _query_lsh.h), dtype=np.uint64)
+        for i, doc_id in enumerate(row_ids):
+            if doc_id in cached:
+                signatures[i] = cached[doc_id]
+        inverse = inverse.reshape(edges.shape)
+        # シグネチャのない辺は検証せずに残す
+        verifiable = has_signature[inverse[:, 0]] & has_signature[inverse[:, 1]]
+        keep = np.ones(len(edges), dtype=bool)
+        keep[verifiable] = verify_edges(signatures, inverse[verifiable, 0], inverse[verifiable, 1], _query_threshold)
+        count_edges(stats, keep[verifiable])
+        edges = edges[keep]
+
+    path = os.path.join(_query_edge_dir, f"edges-{start:012d}.npy")
+    np.save(path, edges)
+    return path, len(edges), num_errors, stats
+
+
+def cluster_documents_parallel(doc_ids: list[str], lsh: MinHashLSH, cache, num_jobs: int = 1,
+                               batch_size: int = 1000, num_ranges: Optional[int] = None,
+                               edge_dir: Optional[str] = None, threshold: Optional[float] = None,
+                               stats: Optional[dict] = None, *, logger) -> UnionFind:
+    """
+    cluster_documents の問い合わせを, 文書IDの通し番号の範囲ごとに num_jobs 個のプロセスで行う関数.
+    各プロセスは (文書, 候補) の辺を通し番号の int64 配列として edge_dir (既定は一時ディレクトリ) に書き出し,
+    このプロセスはそれをまとめて UnionFind に併合する. lsh と cache は fork でワーカーに引き継ぐ.
+    threshold を指定すると, 各プロセスが推定 Jaccard 係数が threshold 未満の辺を除いてから書き出す
+    """
+    uf = UnionFind(doc_ids)
+    if not doc_ids:
+        return uf
+    keys = np.array([doc_id.encode("utf-8") for doc_id in doc_ids])
+    order = np.argsort(keys, kind="stable")
+    num_ranges = num_ranges or num_jobs * 4
+    range_size = max(1, -(-len(doc_ids) // num_ranges))
+    ranges = [(start, min(start + range_size, len(doc_ids)), batch_size)
+              for start in range(0, len(doc_ids), range_size)]
+
+    with tempfile.TemporaryDirectory(dir=edge_dir) as tmpdir:
+        num_edges = 0
+        num_errors = 0
+        with Pool(num_jobs, initializer=_init_query_worker,
+                  initargs=(lsh, cache, keys, order, tmpdir, threshold)) as pool:
+            for path, range_edges, range_errors, range_stats in pool.imap_unordered(_query_range, ranges):
+                edges = np.load(path)
+                uf.union_edges(edges[:, 0], edges[:, 1])
+                num_edges += range_edges
+                num_errors += range_errors
+                if stats is not None:
+                    for key, value in range_stats.items():
+                        stats[key] = stats.get(key, 0) + value
+    logger.info(f"Merged {num_edges} candidate edges from {len(ranges)} ranges")
+    if num_errors:
+        logger.error(f"Failed to query {num_errors} documents or candidates")
+    return uf
+
+
+def select_representatives(uf: UnionFind) -> list[str]:
+    return [max(cluster, key=lambda x: x) for cluster in uf.groups()]
+
+
+def _log_verification(stats: dict, threshold: Optional[float], logger) -> None:
+    if threshold is not None:
+        logger.info(f"Rejected {stats.get('rejected', 0)} of {stats.get('candidates', 0)} candidate edges "
+                    f"below the threshold {threshold}")
+
+
+def deduplicate_documents(documents: dict[str, str], lsh: MinHashLSH, n: int = 5, num_perm: int = 128, batch_size: int = 1000, *, cache=None, shingler: str = DEFAULT_SHINGLER, num_jobs: int = 1, verify: bool = True, stats: Optional[dict] = None, logger=None) -> list[str]:
+    """
+    num_jobs > 1 でキャッシュがあるときは, 不足するシグネチャをキャッシュに加えてから問い合わせを並列に行う.
+    verify=True のときは create_minhash_lsh の閾値で候補を検証する
+    """
+    logger = logger or Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+    threshold = getattr(lsh, "threshold", None) if verify else None
+    stats = stats if stats is not None else {}
+
+    doc_ids = list(documents.keys())
+    if num_jobs > 1 and cache is not None:
+        for i in range(0, len(doc_ids), batch_size):
+            get_signatures({doc_id: documents[doc_id] for doc_id in doc_ids[i:i+batch_size]}, n, num_perm, cache,
+                           shingler)
+        cache.flush()
+        uf = cluster_documents_parallel(doc_ids, lsh, cache, num_jobs=num_jobs, batch_size=batch_size,
+                                        threshold=threshold, stats=stats, logger=logger)
+    else:
+        minhash_batches = (
+            create_minhashes({doc_id: documents[doc_id] for doc_id in doc_ids[i:i+batch_size]}, n, num_perm, cache, shingler)
+            for i in range(0, len(doc_ids), batch_size)
+        )
+        uf = cluster_documents(doc_ids, minhash_batches, lsh, cache=cache, threshold=threshold, stats=stats,
+                               logger=logger)
+    _log_verification(stats, threshold, logger)
+
+    return [documents[k] for k in sorted(select_representatives(uf))]
+
+
+def deduplicate_ids(doc_ids: list[str], lsh: MinHashLSH, batch_size: int = 1000, *, cache, num_jobs: int = 1,
+                    verify: bool = True, stats: Optional[dict] = None, logger=None) -> set[str]:
+    """
+    キャッシュ済みの MinHash だけを使って重複を除去し, 残す文書IDの集合を返す関数.
+    num_jobs > 1 のときは問い合わせを cluster_documents_parallel で並列に行う.
+    verify=True のときは create_minhash_lsh の閾値で候補を検証する
+    """
+    logger = logger or Logger.get_logger(__name__, logdir=os.path.join(os.getcwd(), "log"))
+    threshold = getattr(lsh, "threshold", None) if verify else None
+    stats = stats if stats is not None else {}
+    if num_jobs > 1:
+        uf = cluster_documents_parallel(doc_ids, lsh, cache, num_jobs=num_jobs, batch_size=batch_size,
+                                        threshold=threshold, stats=stats, logger=logger)
+        _log_verification(stats, threshold, logger)
+        return set(select_representatives(uf))
 
-    deduplicated_docs = {}
-    for cluster in clusters:
-        k = max(cluster, key=lambda x: x)
-        deduplicated_docs.update({k: documents[k]})
+    def minhash_batches():
+        for i in range(0, len(doc_ids), batch_size):
+            batch = doc_ids[i:i+batch_size]
+            minhashes = load_minhashes(batch, cache)
+            for doc_id in batch:
+                if doc_id not in minhashes:
+                    logger.error(f"Missing minhash for {doc_id}")
+            yield minhashes
 
-    return deduplicated_docs.values()
+    uf = cluster_documents(doc_ids, minhash_batches(), lsh, cache=cache, threshold=threshold, stats=stats,
+                           logger=logger)
+    _log_verification(stats, threshold, logger)
+    return set(select_representatives(uf))
@@ -0,0 +1,145 @@
+import os
+from typing import Optional
+
+import numpy as np
+import redis
+
+from preprocessing.dedup.docid import parse_doc_id
+from preprocessing.dedup.index import band_hashes
+from preprocessing.dedup.minhash import get_signatures, lsh_params
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER
+from preprocessing.models.datastructures.unionfind import UnionFind
+
+
+class RedisBandIndex():
+    """
+    LSH のバンドのハッシュごとに, 最初に登録した文書ID (バケットの先頭) を保持する Redis ハッシュ.
+    バンド i のハッシュは {basename}.band.{i}.{上位 bucket_bits bit} のフィールド (8 バイト) になる.
+
+    query_insert は全文書の全バンドを HSETNX で一度に登録し, 登録できなかった (先頭が既にある) バンドの先頭を
+    HGET のパイプラインで一度に読む. 1バッチあたり2回の往復で, 問い合わせと登録を同時に行う.
+    HSETNX で登録するので, 複数のワーカーが同時に同じバケットへ登録しても先頭は1件に決まる
+    """
+
+    def __init__(self, redis_client: redis.Redis, basename: str, bucket_bits: int = 16) -> None:
+        self.redis_client = redis_client
+        self.basename = basename
+        self.bucket_bits = bucket_bits
+
+    def key_prefix(self) -> str:
+        return f"{self.basename}.band."
+
+    def _key(self, band: int, value: int) -> str:
+        return f"{self.key_prefix()}{band}.{value >> (64 - self.bucket_bits):x}"
+
+    def query_insert(self, doc_ids: list[str], hashes: np.ndarray) -> list[tuple[str, str]]:
+        """
+        (文書数, バンド数) のハッシュを登録し, 既に同じバケットにあった文書との辺 (文書ID, 先頭の文書ID) を返す
+        """
+        slots = [(doc_id, self._key(band, value), value.to_bytes(8, "big"))
+                 for doc_id, row in zip(doc_ids, hashes.tolist()) for band, value in enumerate(row)]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for doc_id, key, field in slots:
+            pipe.hsetnx(key, field, doc_id)
+        inserted = pipe.execute()
+
+        conflicts = [slot for slot, is_new in zip(slots, inserted) if not is_new]
+        pipe = self.redis_client.pipeline(transaction=False)
+        for _, key, field in conflicts:
+            pipe.hget(key, field)
+        heads = pipe.execute() if conflicts else []
+
+        edges = []
+        for (doc_id, _, _), head in zip(conflicts, heads):
+            head = head.decode("utf-8") if isinstance(head, bytes) else head
+            if head is not None and head != doc_id:
+                edges.append((doc_id, head))
+        return edges
+
+    def cleanup(self, batch_size: int = 10_000) -> int:
+        """
+        このインデックスのキーを全て削除し, 削除したキーの数を返す
+        """
+        deleted = 0
+        keys = []
+        for key in self.redis_client.scan_iter(match=f"{self.key_prefix()}*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                deleted += self.redis_client.unlink(*keys)
+                keys = []
+        if keys:
+            deleted += self.redis_client.unlink(*keys)
+        return deleted
+
+
+def query_insert_documents(band_index: RedisBandIndex, documents: dict[str, str], batch_size: int = 1000,
+                           threshold: float = 0.9, num_perm: int = 128, cache=None,
+                           shingler: str = DEFAULT_SHINGLER) -> list[tuple[str, str]]:
+    """
+    batch_size 件ずつシグネチャを計算してバンドのインデックスに問い合わせつつ登録し, 見つかった辺を返す
+    """
+    b, r = lsh_params(threshold, num_perm)
+    doc_ids = list(documents)
+    edges = []
+    for i in range(0, len(doc_ids), batch_size):
+        batch = {doc_id: documents[doc_id] for doc_id in doc_ids[i:i + batch_size]}
+        signatures = get_signatures(batch, num_perm=num_perm, cache=cache, shingler=shingler)
+        edges.extend(band_index.query_insert(list(batch), band_hashes(signatures, b, r)))
+    if cache is not None:
+        cache.flush()
+    return edges
+
+
+def edges_path(edge_dir: str, filename: str) -> str:
+    return os.path.join(edge_dir, f"{filename}.edges.npy")
+
+
+def save_edges(edge_dir: str, filename: str, edges: list[tuple[str, str]]) -> None:
+    """
+    辺を (件数, 4) の [ファイル番号, オフセット, 先頭のファイル番号, 先頭のオフセット] として保存する
+    """
+    os.makedirs(edge_dir, exist_ok=True)
+    array = np.array([(*parse_doc_id(src)[:2], *parse_doc_id(dst)[:2]) for src, dst in edges],
+                     dtype=np.int64).reshape(-1, 4)
+    path = edges_path(edge_dir, filename)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def load_edges(edge_dir: str, filename: str) -> Optional[np.ndarray]:
+    path = edges_path(edge_dir, filename)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+def merge_edges(offsets_by_file: list[Optional[np.ndarray]], edges: list[np.ndarray]) -> UnionFind:
+    """
+    ファイル番号順のオフセットの索引で辺の文書を通し番号に変換し, UnionFind にまとめる.
+    索引のないファイルの文書を含む辺は無視する
+    """
+    sizes = [0 if offsets is None else len(offsets) for offsets in offsets_by_file]
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    uf = UnionFind(int(starts[-1]))
+
+    def rows(file_indices: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        result = np.full(len(file_indices), -1, dtype=np.int64)
+        for file_index in np.unique(file_indices).tolist():
+            file_offsets = offsets_by_file[file_index] if 0 <= file_index < len(offsets_by_file) else None
+            if file_offsets is None or len(file_offsets) == 0:
+                continue
+            mask = file_indices == file_index
+            positions = np.minimum(np.searchsorted(file_offsets[:, 0], offsets[mask]), len(file_offsets) - 1)
+            found = file_offsets[positions, 0] == offsets[mask]
+            result[np.flatnonzero(mask)[found]] = starts[file_index] + positions[found]
+        return result
+
+    for file_edges in edges:
+        if len(file_edges) == 0:
+            continue
+        src = rows(file_edges[:, 0], file_edges[:, 1])
+        dst = rows(file_edges[:, 2], file_edges[:, 3])
+        valid = (src >= 0) & (dst >= 0)
+        uf.union_edges(src[valid], dst[valid])
+    return uf
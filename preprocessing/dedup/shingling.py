@@ -0,0 +1,61 @@
+from functools import lru_cache
+from typing import Callable
+import os
+
+from preprocessing.filters import morphology
+
+
+SHINGLERS: dict[str, Callable[[str, int], set[str]]] = {}
+DEFAULT_SHINGLER = "gpt2"
+
+
+def register_shingler(name: str):
+    def decorator(func: Callable[[str, int], set[str]]):
+        SHINGLERS[name] = func
+        return func
+    return decorator
+
+
+def get_shingler(name: str) -> Callable[[str, int], set[str]]:
+    try:
+        return SHINGLERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown shingler: {name}. Available: {', '.join(SHINGLERS)}")
+
+
+def _join_ngrams(tokens: list[str], n: int) -> set[str]:
+    return set([' '.join(tokens[i:i+n]) for i in range(len(tokens) - n + 1)])
+
+
+@register_shingler("char")
+def char_shingles(text: str, n: int = 5) -> set[str]:
+    """
+    文字 n-gram. モデルファイルを必要としない
+    """
+    return set([text[i:i+n] for i in range(len(text) - n + 1)])
+
+
+@register_shingler("mecab")
+def mecab_shingles(text: str, n: int = 5) -> set[str]:
+    """
+    MeCab で分かち書きした単語の n-gram
+    """
+    return _join_ngrams(morphology.tokenize(text), n)
+
+
+@lru_cache(maxsize=None)
+def get_fast_tokenizer(name_or_path: str):
+    """
+    トークナイザはプロセスごとに一度だけ読み込む
+    """
+    from transformers import GPT2TokenizerFast
+    return GPT2TokenizerFast.from_pretrained(name_or_path)
+
+
+@register_shingler("gpt2")
+def gpt2_shingles(text: str, n: int = 5) -> set[str]:
+    """
+    GPT-2 トークンの n-gram. オフライン環境では DEDUP_TOKENIZER にローカルのパスを指定する
+    """
+    tokenizer = get_fast_tokenizer(os.environ.get("DEDUP_TOKENIZER", "gpt2"))
+    return _join_ngrams(tokenizer.tokenize(text), n)
@@ -0,0 +1,112 @@
+import os
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+import redis
+
+
+# MinHash の値は 32 bit に収まるので, キャッシュには uint32 (リトルエンディアン) で保存する
+SIGNATURE_DTYPE = np.dtype("<u4")
+
+
+class RedisSignatureCache():
+    """
+    文書IDをフィールド, パックしたシグネチャのバイト列を値とする Redis ハッシュ.
+    読み書きはそれぞれ1回の往復でまとめて行う
+    """
+
+    def __init__(self, redis_client: redis.Redis, key: str = "dedup.minhash", chunk_size: int = 10_000) -> None:
+        self.redis_client = redis_client
+        self.key = key
+        self.chunk_size = chunk_size
+
+    def get_many(self, doc_ids: Iterable[str]) -> dict[str, np.ndarray]:
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return {}
+        values = self.redis_client.hmget(self.key, doc_ids)
+        return {doc_id: np.frombuffer(value, dtype=SIGNATURE_DTYPE)
+                for doc_id, value in zip(doc_ids, values) if value is not None}
+
+    def set_many(self, doc_ids: list[str], signatures: np.ndarray) -> None:
+        signatures = np.ascontiguousarray(signatures, dtype=SIGNATURE_DTYPE)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for i in range(0, len(doc_ids), self.chunk_size):
+            pipe.hset(self.key, mapping={doc_id: signature.tobytes()
+                                         for doc_id, signature in zip(doc_ids[i:i+self.chunk_size],
+                                                                      signatures[i:i+self.chunk_size])})
+        pipe.execute()
+
+    def flush(self) -> None:
+        pass
+
+
+class NpySignatureCache():
+    """
+    シャード (入力ファイル) ごとに <shard>.npy (文書数, num_perm) のシグネチャと
+    <shard>.ids (1行に1つの文書ID) を保存する. 読み込みはメモリマップで行い, コピーしない
+    """
+
+    def __init__(self, directory: str, shard: Optional[str] = None) -> None:
+        self.directory = directory
+        self.shard = shard
+        self._doc_ids: list[str] = []
+        self._signatures: list[np.ndarray] = []
+        self._index: Optional[dict[str, tuple[int, int]]] = None
+        self._shards: list[np.ndarray] = []
+
+    def shards(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        filenames = set(os.listdir(self.directory))
+        return sorted(filename[:-len(".npy")] for filename in filenames
+                      if filename.endswith(".npy") and filename[:-len(".npy")] + ".ids" in filenames)
+
+    def load_shard(self, shard: str) -> tuple[list[str], np.ndarray]:
+        with open(os.path.join(self.directory, f"{shard}.ids"), "r", encoding="utf-8") as f:
+            doc_ids = f.read().splitlines()
+        return doc_ids, np.load(os.path.join(self.directory, f"{shard}.npy"), mmap_mode="r")
+
+    def iter_shards(self) -> Iterator[tuple[list[str], np.ndarray]]:
+        for shard in self.shards():
+            yield self.load_shard(shard)
+
+    def _build_index(self) -> None:
+        self._index = {}
+        for shard_index, (doc_ids, signatures) in enumerate(self.iter_shards()):
+            self._shards.append(signatures)
+            for row, doc_id in enumerate(doc_ids):
+                self._index[doc_id] = (shard_index, row)
+
+    def get_many(self, doc_ids: Iterable[str]) -> dict[str, np.ndarray]:
+        if self._index is None:
+            self._build_index()
+        signatures = {}
+        for doc_id in doc_ids:
+            location = self._index.get(doc_id)
+            if location is not None:
+                shard_index, row = location
+                signatures[doc_id] = self._shards[shard_index][row]
+        return signatures
+
+    def set_many(self, doc_ids: list[str], signatures: np.ndarray) -> None:
+        if self.shard is None:
+            raise ValueError("NpySignatureCache needs a shard name to write signatures")
+        self._doc_ids.extend(doc_ids)
+        self._signatures.append(np.asarray(signatures, dtype=SIGNATURE_DTYPE))
+
+    def flush(self) -> None:
+        """
+        溜めたシグネチャをシャードのファイルに書き出す. ids を後に書くので, ids があれば npy は書き終わっている
+        """
+        if self.shard is None or not self._signatures:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        np.save(os.path.join(self.directory, f"{self.shard}.npy"), np.concatenate(self._signatures))
+        with open(os.path.join(self.directory, f"{self.shard}.ids"), "w", encoding="utf-8") as f:
+            f.write("".join(doc_id + "\n" for doc_id in self._doc_ids))
+        self._doc_ids = []
+        self._signatures = []
+        # 書き出したシャードを次の get_many で読み込み直す
+        self._index = None
+        self._shards = []
@@ -0,0 +1,201 @@
+import json
+import math
+import os
+import tempfile
+from multiprocessing import Pool
+from typing import Iterator, Optional
+
+import numpy as np
+
+from preprocessing.reader import read_input_lines
+
+
+# UTF-8 の文字列には現れないバイト. 文書の区切りにして, 文書をまたぐ一致を除く
+SEPARATOR = 0xff
+
+
+def build_buffer(input_files: list[str], path: str) -> np.ndarray:
+    """
+    全文書の本文 (UTF-8) を区切りのバイトをはさんで path に連結し, 文書ごとの境界 (文書数 + 1) を返す.
+    文書 i は [bounds[i], bounds[i + 1] - 1) の範囲になる. 末尾には 8 バイト単位で読むための区切りを足す
+    """
+    bounds = [0]
+    position = 0
+    with open(path, "wb", buffering=8 << 20) as f:
+        for input_file in input_files:
+            for line in read_input_lines(input_file):
+                data = str(json.loads(line)["text"]).encode("utf-8")
+                f.write(data)
+                f.write(bytes([SEPARATOR]))
+                position += len(data) + 1
+                bounds.append(position)
+        f.write(bytes([SEPARATOR]) * 8)
+    return np.array(bounds, dtype=np.int64)
+
+
+def _open_buffer(path: str) -> np.ndarray:
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def _words(text: np.ndarray) -> np.ndarray:
+    """
+    各位置から 8 バイトをビッグエンディアンの uint64 として読むビュー (コピーしない)
+    """
+    return np.ndarray(shape=(len(text) - 7,), dtype=">u8", buffer=text, strides=(1,))
+
+
+def _window_starts(text: np.ndarray, start: int, end: int, length: int) -> np.ndarray:
+    """
+    [start, end) のうち, length バイトの窓が1つの文書に収まり, 文字の先頭から始まる位置
+    """
+    segment = np.asarray(text[start:min(end + length - 1, len(text))])
+    num_starts = max(0, min(end - start, len(segment) - length + 1))
+    separators = np.concatenate(([0], np.cumsum(segment == SEPARATOR, dtype=np.int32)))
+    valid = separators[length:length + num_starts] == separators[:num_starts]
+    # UTF-8 の継続バイト (10xxxxxx) から始まる窓は除く
+    valid &= (segment[:num_starts] & 0xC0) != 0x80
+    return start + np.flatnonzero(valid)
+
+
+def sort_windows(words: np.ndarray, positions: np.ndarray, length: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    位置をそこからの length バイトでソートする (length で打ち切った接尾辞配列).
+    まだ同じ値が続く範囲だけを, 範囲の番号と次の数バイトを詰めた uint64 で繰り返しソートし直す.
+    並べ替えの順と, 直前の窓と異なるか (同じ窓の範囲の先頭か) を返す
+    """
+    order = np.arange(len(positions))
+    boundary = np.zeros(len(positions), dtype=bool)
+    boundary[:1] = True
+    # まだ同じ値が続いている範囲の, ソート後の添字
+    active = order.copy()
+    offset = 0
+    while offset < length:
+        group = np.cumsum(boundary[active]) - 1
+        tied = np.bincount(group)[group] > 1
+        active = active[tied]
+        if len(active) == 0:
+            break
+        group = group[tied]
+        # 範囲の番号を上位ビットに置くので, ソートしても範囲の外には出ない
+        group_bits = max(1, int(group[-1]).bit_length())
+        num_bytes = min((64 - group_bits) // 8, length - offset)
+        values = words[positions[order[active]] + offset].astype(np.uint64) >> np.uint64(8 * (8 - num_bytes))
+        keys = (group.astype(np.uint64) << np.uint64(8 * num_bytes)) | values
+        sub = np.argsort(keys)
+        order[active] = order[active][sub]
+        keys = keys[sub]
+        boundary[active] = np.concatenate(([True], keys[1:] != keys[:-1]))
+        offset += num_bytes
+    return order, boundary
+
+
+def _mark_partition(args) -> int:
+    """
+    分割内の窓をソートし, 同じ窓のうち最初に現れた位置以外を flags に記録する. 記録した数を返す
+    """
+    buffer_path, flags_path, partition_path, length = args
+    positions = np.fromfile(partition_path, dtype=np.int64)
+    os.remove(partition_path)
+    if len(positions) < 2:
+        return 0
+    order, boundary = sort_windows(_words(_open_buffer(buffer_path)), positions, length)
+    positions = positions[order]
+    starts = np.flatnonzero(boundary)
+    first = np.minimum.reduceat(positions, starts)
+    marked = np.sort(positions[positions != np.repeat(first, np.diff(np.r_[starts, len(positions)]))])
+    if len(marked):
+        flags = np.memmap(flags_path, dtype=np.uint8, mode="r+")
+        flags[marked] = 1
+        flags.flush()
+    return len(marked)
+
+
+def mark_repeats(buffer_path: str, flags_path: str, length: int = 100, max_memory: int = 1 << 30,
+                 chunk_bytes: Optional[int] = None, num_jobs: int = 1, spill_dir: Optional[str] = None,
+                 sample_size: int = 100_000, seed: int = 0) -> int:
+    """
+    連結した本文の中で, 先に現れたものと length バイト以上一致する窓の先頭を flags_path (1バイト/位置) に記録する.
+
+    本文は mmap で読み, メモリに載せない. 先頭 8 バイトの標本から分割の境界を決め,
+    chunk_bytes ずつ窓の位置を分割ごとのファイルに書き出す. 分割は先頭 8 バイトの順に並ぶので,
+    分割ごとにソートしたものをつなげると length バイトで打ち切った接尾辞配列になる.
+    1つの分割のソートに使うメモリが max_memory 程度になるように分割数を決め, 分割ごとに num_jobs のプロセスで処理する
+    """
+    if length < 8:
+        raise ValueError(f"length must be at least 8 bytes: {length}")
+    text = _open_buffer(buffer_path)
+    n = len(text)
+    with open(flags_path, "wb") as f:
+        f.truncate(n)
+    if n < length + 8:
+        return 0
+    words = _words(text)
+    # 1か所あたり, 位置, 並べ替えの順, キーとその作業領域でおよそ 64 バイト
+    num_partitions = max(1, math.ceil(n * 64 / max_memory))
+    chunk_bytes = chunk_bytes or max(1 << 20, max_memory // 48)
+
+    rng = np.random.default_rng(seed)
+    sample = np.unique(rng.integers(0, n - length + 1, size=max(sample_size, 100 * num_partitions)))
+    windows = np.asarray(text[sample[:, None] + np.arange(length)])
+    sample = sample[~np.any(windows == SEPARATOR, axis=1) & ((windows[:, 0] & 0xC0) != 0x80)]
+    sample_keys = np.sort(words[sample].astype(np.uint64))
+    splitters = np.unique(sample_keys[(np.arange(1, num_partitions) * len(sample_keys)) // num_partitions]) \
+        if len(sample_keys) else np.zeros(0, dtype=np.uint64)
+    num_partitions = len(splitters) + 1
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmpdir:
+        paths = [os.path.join(tmpdir, f"{partition}.bin") for partition in range(num_partitions)]
+        writers = [open(path, "wb") for path in paths]
+        try:
+            for start in range(0, n, chunk_bytes):
+                positions = _window_starts(text, start, start + chunk_bytes, length)
+                partitions = np.searchsorted(splitters, words[positions].astype(np.uint64), side="right")
+                order = np.argsort(partitions)
+                bounds = np.searchsorted(partitions[order], np.arange(num_partitions + 1))
+                for partition in range(num_partitions):
+                    positions[order[bounds[partition]:bounds[partition + 1]]].tofile(writers[partition])
+        finally:
+            for writer in writers:
+                writer.close()
+
+        args = [(buffer_path, flags_path, path, length) for path in paths]
+        if num_jobs > 1:
+            with Pool(num_jobs) as pool:
+                return sum(pool.imap_unordered(_mark_partition, args))
+        return sum(map(_mark_partition, args))
+
+
+def _remove_range(args) -> list[str]:
+    buffer_path, flags_path, bounds, length = args
+    text = _open_buffer(buffer_path)
+    flags = _open_buffer(flags_path)
+    results = []
+    for start, end in zip(bounds[:-1].tolist(), (bounds[1:] - 1).tolist()):
+        data = np.asarray(text[start:end])
+        marked = np.asarray(flags[start:end])
+        if not marked.any():
+            results.append(data.tobytes().decode("utf-8"))
+            continue
+        # 記録した窓のいずれかに含まれるバイトを除く
+        counts = np.concatenate(([0], np.cumsum(marked, dtype=np.int64)))
+        index = np.arange(len(data))
+        covered = counts[index + 1] > counts[np.maximum(index - length + 1, 0)]
+        results.append(data[~covered].tobytes().decode("utf-8", errors="ignore"))
+    return results
+
+
+def iter_deduplicated(buffer_path: str, flags_path: str, bounds: np.ndarray, length: int = 100,
+                      num_jobs: int = 1, batch_size: int = 10_000) -> Iterator[str]:
+    """
+    文書ごとに, 記録した窓に含まれる部分を除いた本文を文書の順に返す. 全て除いた文書は空文字列になる.
+    窓は文字の先頭からしか始まらないので, バイト数の異なる文字が混ざると一致した部分の末尾の1文字が残ることがある
+    """
+    args = [(buffer_path, flags_path, bounds[i:i + batch_size + 1], length)
+            for i in range(0, len(bounds) - 1, batch_size)]
+    if num_jobs > 1:
+        with Pool(num_jobs) as pool:
+            for texts in pool.imap(_remove_range, args):
+                yield from texts
+    else:
+        for texts in map(_remove_range, args):
+            yield from texts
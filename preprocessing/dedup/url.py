@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import math
+import os
+from typing import Iterable, Optional, Union
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+import redis
+
+
+def normalize_url(url: str) -> str:
+    """
+    スキームとホストを小文字にし, フラグメントを除いた URL
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+
+def url_digest(url: str) -> bytes:
+    """
+    正規化した URL の 64 bit ハッシュ
+    """
+    return hashlib.blake2b(normalize_url(url).encode("utf-8"), digest_size=8).digest()
+
+
+def url_hashes(urls: Iterable[str]) -> np.ndarray:
+    return np.array([int.from_bytes(url_digest(url), "little") for url in urls], dtype=np.uint64)
+
+
+class RedisURLIndex():
+    """
+    URL を固定長のハッシュに変換し, 2**bucket_bits 個の Redis ハッシュに振り分けて保持する.
+    フィールドは 8 バイトなので, 小さなハッシュのエンコーディング (listpack) に収まり URL 1件あたり十数バイトで済む.
+    登録は HSETNX で行うため, 複数のプロセスから同時に登録しても最初の1件だけが新規と判定される.
+    """
+
+    def __init__(self, redis_client: redis.Redis, basename: str, bucket_bits: int = 20, ttl: Optional[int] = None) -> None:
+        self.redis_client = redis_client
+        self.basename = basename
+        self.bucket_bits = bucket_bits
+        self.ttl = ttl
+
+    def key_prefix(self) -> str:
+        return f"{self.basename}.url."
+
+    def _key_and_field(self, url: str) -> tuple[str, bytes]:
+        digest = url_digest(url)
+        bucket = int.from_bytes(digest[:4], "big") >> (32 - self.bucket_bits)
+        return f"{self.key_prefix()}{bucket:x}", digest
+
+    def add(self, url: str) -> bool:
+        """
+        URL を登録し, 未登録だった場合に True を返す
+        """
+        return self.add_many([url])[0]
+
+    def add_many(self, urls: Iterable[str]) -> list[bool]:
+        """
+        複数の URL を1回の往復でまとめて登録する
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        keys = set()
+        num_urls = 0
+        for url in urls:
+            key, field = self._key_and_field(url)
+            pipe.hsetnx(key, field, 1)
+            keys.add(key)
+            num_urls += 1
+        if num_urls == 0:
+            return []
+        if self.ttl:
+            for key in keys:
+                pipe.expire(key, self.ttl)
+        return [bool(added) for added in pipe.execute()[:num_urls]]
+
+    def cleanup(self, batch_size: int = 10_000) -> int:
+        """
+        このインデックスのキーを全て削除し, 削除したキーの数を返す
+        """
+        deleted = 0
+        keys = []
+        for key in self.redis_client.scan_iter(match=f"{self.key_prefix()}*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                deleted += self.redis_client.unlink(*keys)
+                keys = []
+        if keys:
+            deleted += self.redis_client.unlink(*keys)
+        return deleted
+
+
+class ExactURLIndex():
+    """
+    URL の 64 bit ハッシュをソート済みの配列で保持する. URL 1件あたり 8 バイト.
+    新しく登録したハッシュは一旦集合に溜め, 一定数を超えたら配列にマージする
+    """
+
+    def __init__(self, hashes: Optional[np.ndarray] = None) -> None:
+        self.hashes = np.empty(0, dtype=np.uint64) if hashes is None else np.sort(np.asarray(hashes, dtype=np.uint64))
+        self.pending: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.hashes) + len(self.pending)
+
+    def _merge(self) -> None:
+        if self.pending:
+            pending = np.fromiter(self.pending, dtype=np.uint64, count=len(self.pending))
+            self.hashes = np.sort(np.concatenate((self.hashes, pending)))
+            self.pending = set()
+
+    def add_many(self, urls: Iterable[str]) -> list[bool]:
+        hashes = url_hashes(urls)
+        positions = np.searchsorted(self.hashes, hashes)
+        in_hashes = positions < len(self.hashes)
+        in_hashes[in_hashes] = self.hashes[positions[in_hashes]] == hashes[in_hashes]
+
+        added = []
+        for value, seen in zip(hashes.tolist(), in_hashes.tolist()):
+            if seen or value in self.pending:
+                added.append(False)
+            else:
+                self.pending.add(value)
+                added.append(True)
+
+        # マージの頻度を配列の大きさに応じて下げ, 償却コストを抑える
+        if len(self.pending) > max(1_000_000, len(self.hashes) // 8):
+            self._merge()
+        return added
+
+    def add(self, url: str) -> bool:
+        return self.add_many([url])[0]
+
+    def save(self, path: str) -> None:
+        self._merge()
+        with open(path, "wb") as f:
+            np.savez(f, kind="exact", hashes=self.hashes)
+
+
+class BloomURLIndex():
+    """
+    偽陽性率 error_rate の Bloom filter. capacity 件の URL を登録したときに 1件あたり約 -log2(error_rate) * 1.44 bit.
+    偽陽性の URL は重複として破棄される
+    """
+
+    def __init__(self, capacity: int = 100_000_000, error_rate: float = 0.001, bits: Optional[np.ndarray] = None,
+                 num_hashes: Optional[int] = None) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        num_bits = bits.size * 8 if bits is not None else \
+            int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2 / 8)) * 8
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes or max(1, round(num_bits / capacity * math.log(2)))
+        self.bits = np.zeros(num_bits // 8, dtype=np.uint8) if bits is None else bits
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        # Double hashing: h1 + i * h2
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, np.newaxis] + i * h2[:, np.newaxis]) % np.uint64(self.num_bits)
+
+    def add_many(self, urls: Iterable[str]) -> list[bool]:
+        hashes = url_hashes(urls)
+        if len(hashes) == 0:
+            return []
+        positions = self._positions(hashes)
+        seen = np.all((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1, axis=1)
+
+        # 同じ窓の中で重複する URL は最初の1件だけを新規とする
+        _, first_index = np.unique(hashes, return_index=True)
+        first = np.zeros(len(hashes), dtype=bool)
+        first[first_index] = True
+        added = ~seen & first
+
+        new_positions = positions[added].ravel()
+        np.bitwise_or.at(self.bits, new_positions >> np.uint64(3),
+                         np.left_shift(1, new_positions & np.uint64(7)).astype(np.uint8))
+        return added.tolist()
+
+    def add(self, url: str) -> bool:
+        return self.add_many([url])[0]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, kind="bloom", bits=self.bits, num_hashes=self.num_hashes, capacity=self.capacity,
+                     error_rate=self.error_rate)
+
+
+LOCAL_URL_INDEXES = ["exact", "bloom"]
+
+
+def create_local_url_index(kind: str = "exact", path: Optional[str] = None, capacity: int = 100_000_000,
+                           error_rate: float = 0.001) -> Union[ExactURLIndex, BloomURLIndex]:
+    """
+    path にファイルがあれば, 以前の実行で保存したインデックスを読み込む
+    """
+    if path and os.path.exists(path):
+        with np.load(path) as data:
+            if str(data["kind"]) == "exact":
+                return ExactURLIndex(data["hashes"])
+            return BloomURLIndex(capacity=int(data["capacity"]), error_rate=float(data["error_rate"]),
+                                 bits=data["bits"], num_hashes=int(data["num_hashes"]))
+
+    if kind == "exact":
+        return ExactURLIndex()
+    if kind == "bloom":
+        return BloomURLIndex(capacity=capacity, error_rate=error_rate)
+    raise ValueError(f"Unknown url index: {kind}. Available: {', '.join(LOCAL_URL_INDEXES)}")
+
+
+def connect_redis() -> redis.Redis:
+    redis_host = os.environ.get("REDIS_HOST", "localhost")
+    redis_port = os.environ.get("REDIS_PORT", 6379)
+    redis_db = os.environ.get("REDIS_DB", 0)
+    return redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the redis index used by url deduplication.')
+    parser.add_argument('command', choices=['cleanup'])
+    parser.add_argument('--basename', type=str, help='The basename of the url index (the output_base of the run)',
+                        required=True)
+    args = parser.parse_args()
+
+    if args.command == 'cleanup':
+        deleted = RedisURLIndex(connect_redis(), basename=args.basename).cleanup()
+        print(f"Deleted {deleted} keys")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,54 @@
 import argparse
 import os
 import subprocess
-import uuid
 import json
 from logging import getLogger, basicConfig, INFO
 
+import numpy as np
 import redis
 
+from preprocessing.dedup.docid import doc_ids_from_offsets, input_files, iter_lines_with_offsets, save_offset_index
+from preprocessing.dedup.exact import RedisExactIndex, save_duplicates
 from preprocessing.dedup.minhash import create_minhash_index, create_minhash_lsh
+from preprocessing.dedup.online import RedisBandIndex, query_insert_documents, save_edges
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER, SHINGLERS
+from preprocessing.dedup.signatures import NpySignatureCache, RedisSignatureCache
 from preprocessing import ROOT_PATH
 
 SCRIPT_PATH = os.path.join(ROOT_PATH, "scripts")
 
 
-def __readlines(input_file: str):
-    with open(input_file, "r", encoding="utf-8") as fp:
-        for line in fp:
-            yield line
-
-
-def evoke_worker(worker_id: int, input_dir: str, log_dir: str, basename: str) -> None:
+def evoke_worker(worker_id: int, input_dir: str, log_dir: str, basename: str, shingler: str = DEFAULT_SHINGLER,
+                 offset_dir: str = "", signature_dir: str = "", edge_dir: str = "") -> None:
     subprocess.Popen([os.path.join(SCRIPT_PATH, "throw_job.sh"), ROOT_PATH,
-                     str(worker_id), input_dir, log_dir, basename])
-
-
-def run(worker_id: int, input_dir: str, basename: str, *, logger=None):
+                     str(worker_id), input_dir, log_dir, basename, shingler, offset_dir, signature_dir, edge_dir])
+
+
+def run(worker_id: int, input_dir: str, basename: str, shingler: str = DEFAULT_SHINGLER, offset_dir: str = "",
+        signature_dir: str = "", edge_dir: str = "", *, logger=None):
+    """
+    文書IDは (ファイル番号, バイトオフセット, 長さ) から決まるので, 本文は Redis に保存しない.
+    各ファイルの行のオフセットは offset_dir (既定は input_dir/offsets) に保存し, コーディネータはそこから文書IDを復元する.
+    signature_dir を指定すると MinHash のシグネチャを Redis ではなく, 入力ファイルごとの npy に保存する.
+    edge_dir を指定すると, バッチごとにバンドのインデックスへ問い合わせてから登録し,
+    見つかった辺を入力ファイルごとに edge_dir に保存する. コーディネータは辺をまとめるだけでよい.
+    正規化した本文が他の文書と完全に一致する文書はシグネチャを計算せず, その行番号を offset_dir に保存する
+    """
     logger = logger or getLogger(__name__)
     logger.info(f"Worker {worker_id} started")
+    offset_dir = offset_dir or os.path.join(input_dir, "offsets")
+    file_indices = {filename: file_index for file_index, filename in enumerate(input_files(input_dir))}
     redis_host = os.environ.get("REDIS_HOST", "localhost")
     redis_port = os.environ.get("REDIS_PORT", 6379)
     redis_db = os.environ.get("REDIS_DB", 0)
     r = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db, decode_responses=True)
-    lsh = create_minhash_lsh(storage_config={"type": "redis", "basename": basename.encode('utf8'), "redis": {
-        'host': redis_host, 'port': redis_port, 'db': redis_db}})
+    signature_redis = redis.StrictRedis(host=redis_host, port=redis_port, db=redis_db)
+    exact_index = RedisExactIndex(signature_redis, basename)
+    if edge_dir:
+        band_index = RedisBandIndex(signature_redis, basename)
+    else:
+        lsh = create_minhash_lsh(storage_config={"type": "redis", "basename": basename.encode('utf8'), "redis": {
+            'host': redis_host, 'port': redis_port, 'db': redis_db}})
 
     while True:
         try:
@@ -48,17 +64,33 @@ def run(worker_id: int, input_dir: str, basename: str, *, logger=None):
 
         try:
             r.hset("dedup_files.processing", filename, 1)
-            lines = __readlines(os.path.join(input_dir, filename))
-
-            docs: dict[str, str] = {}
-            for line in lines:
-                doc_id = str(uuid.uuid4())
-                docs[doc_id] = str(json.loads(line)["text"])
-                r.hset("dedup.docs", doc_id, docs[doc_id])
-
-            create_minhash_index(lsh, docs, redis=r)
+            offsets = []
+            texts = []
+            for offset, line in iter_lines_with_offsets(os.path.join(input_dir, filename)):
+                offsets.append((offset, len(line)))
+                texts.append(str(json.loads(line)["text"]))
+            offsets = np.array(offsets, dtype=np.int64).reshape(-1, 2)
+            doc_ids = doc_ids_from_offsets(file_indices[filename], offsets)
+            keep = exact_index.add_many(doc_ids, texts)
+            docs: dict[str, str] = {doc_id: text for doc_id, text, is_new in zip(doc_ids, texts, keep) if is_new}
+            logger.info(f"Worker {worker_id} skipped signing {len(doc_ids) - len(docs)} of {len(doc_ids)} "
+                        f"documents in {filename} (exact duplicates)")
+
+            if edge_dir:
+                # コーディネータはシグネチャを読まないので, Redis にはキャッシュしない
+                cache = NpySignatureCache(signature_dir, shard=filename) if signature_dir else None
+                save_edges(edge_dir, filename, query_insert_documents(band_index, docs, cache=cache,
+                                                                      shingler=shingler))
+            else:
+                cache = NpySignatureCache(signature_dir, shard=filename) if signature_dir \
+                    else RedisSignatureCache(signature_redis)
+                create_minhash_index(lsh, docs, cache=cache, shingler=shingler)
+            save_duplicates(offset_dir, filename, np.flatnonzero(~np.array(keep, dtype=bool)))
+            # インデックスへの登録が済んでから書き出すので, オフセットがあるファイルは処理済み
+            save_offset_index(offset_dir, filename, offsets)
             r.hdel("dedup_files.processing", filename)
         except Exception as e:
+            logger.error(f"Worker {worker_id} failed to process {filename}: {e}")
             r.rpush("dedup_files.error", filename)
             r.hdel("dedup_files.processing", filename)
             r.set("dedup_status", "error")
@@ -73,13 +105,23 @@ def main():
                         help='The directory where the logs will be stored', required=True)
     parser.add_argument('--basename', type=str,
                         help='The basename to use for the redis keys', required=True)
+    parser.add_argument('--shingler', type=str, choices=list(SHINGLERS), default=DEFAULT_SHINGLER,
+                        help='The shingling backend used to build minhash signatures', required=False)
+    parser.add_argument('--offset_dir', type=str, default="",
+                        help='The directory where the line offsets of each input file will be stored', required=False)
+    parser.add_argument('--signature_dir', type=str, default="",
+                        help='Store minhash signatures as npy files in this directory instead of redis', required=False)
+    parser.add_argument('--edge_dir', type=str, default="",
+                        help='Query then insert into the band index and store the found edges in this directory',
+                        required=False)
     args = parser.parse_args()
 
     os.makedirs(args.log_dir, exist_ok=True)
     logger = getLogger(__name__)
     basicConfig(filename=os.path.join(args.log_dir, f"worker_{args.worker_id}.log"), level=INFO)
 
-    run(worker_id=args.worker_id, input_dir=args.input_dir, basename=args.basename, logger=logger)
+    run(worker_id=args.worker_id, input_dir=args.input_dir, basename=args.basename, shingler=args.shingler,
+        offset_dir=args.offset_dir, signature_dir=args.signature_dir, edge_dir=args.edge_dir, logger=logger)
 
 
 if __name__ == "__main__":
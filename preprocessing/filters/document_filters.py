@@ -1,20 +1,25 @@
 from hojichar import document_filters, Filter, Document, Token
-from fugashi import Tagger
 import redis
 from redis import ConnectionPool
 
 from os import PathLike
-from typing import Any, Union
+from typing import Any, Optional, Union
 import re
 import json
-import hashlib
-import nltk
 import random
 import string
 import pathlib
 
+import numpy as np
+
 
 from preprocessing.models.document import DocumentFromHTML
+from preprocessing.dedup.lines import line_hashes
+from preprocessing.dedup.minhash import compute_signatures
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER
+from preprocessing.dedup.url import RedisURLIndex
+from preprocessing.filters import morphology
+from preprocessing.filters.repetition import NgramRepetitionDetector
 from preprocessing import filters
 
 DICT_PATH = pathlib.Path(filters.__path__[0]) / "dict"
@@ -50,26 +55,56 @@ class DeduplicationByURL(Filter):
             cls._pool = ConnectionPool(host=redis_host, port=redis_port, db=redis_db)
         return cls._pool
 
-    def __init__(self, redis_host: str, redis_port: int, redis_db: int, basename: str = "", *args, **kwargs):
+    def __init__(self, redis_host: str, redis_port: int, redis_db: int, basename: str = "", bucket_bits: int = 20,
+                 ttl: Optional[int] = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.basename: str = basename if basename else ''.join(random.choice(string.ascii_lowercase)
                                                                for _ in range(11))
-        self.redis_client = None
+        self.index = None
         self.redis_host = redis_host
         self.redis_port = redis_port
         self.redis_db = redis_db
+        self.bucket_bits = bucket_bits
+        self.ttl = ttl
 
     def __connect(self):
-        if self.redis_client is None:
+        if self.index is None:
             pool = self.__get_pool(self.redis_host, self.redis_port, self.redis_db)
-            self.redis_client = redis.Redis(connection_pool=pool)
+            self.index = RedisURLIndex(redis.Redis(connection_pool=pool), basename=self.basename,
+                                       bucket_bits=self.bucket_bits, ttl=self.ttl)
 
     def apply(self, document: DocumentFromHTML) -> DocumentFromHTML:
         self.__connect()
-        if self.redis_client.get(self.basename + document.url):
+        if not self.index.add(document.url):
             document.is_rejected = True
-        else:
-            self.redis_client.set(self.basename + document.url, "1")
+        return document
+
+
+class ComputeMinHashSignature(Filter):
+    """
+    本文の MinHash シグネチャを計算し, document.signature に uint32 の配列として保持する
+    """
+
+    def __init__(self, n: int = 5, num_perm: int = 128, shingler: str = DEFAULT_SHINGLER, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n = n
+        self.num_perm = num_perm
+        self.shingler = shingler
+
+    def apply(self, document: Document) -> Document:
+        document.signature = compute_signatures([document.text], self.n, self.num_perm,
+                                                shingler=self.shingler)[0].astype(np.uint32)
+        return document
+
+
+class ComputeLineHashes(Filter):
+    """
+    破棄されていないトークン (行) のハッシュを重複なしで計算し, document.line_hashes に uint64 の配列として保持する.
+    前処理として NewLineSentenceTokenizer で行に分割する必要があります
+    """
+
+    def apply(self, document: Document) -> Document:
+        document.line_hashes = line_hashes(token.text for token in document.tokens if not token.is_rejected)
         return document
 
 
@@ -90,9 +125,8 @@ class DiscardBBSComments(Filter):
         >>> DiscardBBSComments().apply(Document("鏡餅")).is_rejected
         False
         """
-        tagger = Tagger('-Owakati')
         bbs_factor = self.keyword_pat.findall(doc.text)
-        total_words = len(tagger.parse(doc.text).split())
+        total_words = morphology.get_word_count(doc)
         if total_words > 0 and len(bbs_factor) / total_words > self.threshold:
             doc.is_rejected = True
         return doc
@@ -103,12 +137,9 @@ class RemoveRepetition(Filter):
         super().__init__(*args, **kwargs)
         self.duplicate_line_fraction = 0.5
         self.duplicate_line_character_fraction = 0.5
-
-    def _hash_text(self, text: str) -> str:
-        return hashlib.md5(text.encode("utf-8")).hexdigest()
+        self.detector = NgramRepetitionDetector()
 
     def apply(self, document: Document) -> Document:
-        tagger = Tagger('-Owakati')
         if not document.text:
             return document
 
@@ -117,14 +148,13 @@ class RemoveRepetition(Filter):
         line_count = 0
         dup_line = 0
         dup_line_chars = 0
-        visit_lines = {}
+        visit_lines = set()
         for token in document.tokens:
-            line_hash = self._hash_text(token.text)
-            if line_hash in visit_lines:
+            if token.text in visit_lines:
                 dup_line += 1
                 dup_line_chars += len(token.text)
                 token.is_rejected = True
-            visit_lines[line_hash] = True
+            visit_lines.add(token.text)
 
             line_count += 1
 
@@ -136,45 +166,9 @@ class RemoveRepetition(Filter):
             document.is_rejected = True
             return document
 
-        top_ngram_character_fractions = [
-            (2, 0.2),
-            (3, 0.18),
-            (4, 0.16),
-        ]
-        for ngram, threshold in top_ngram_character_fractions:
-            word_list = tagger.parse(document.text).split()
-            bgs = nltk.ngrams(word_list, ngram)
-            fdist = nltk.FreqDist(bgs)
-            for word_list, repeat in fdist.items():
-                char_count = sum([len(word) for word in word_list])
-                if char_count * (repeat - 1) / len(document.text) > threshold:
-                    document.is_rejected = True
-                    return document
-
-        duplicate_ngram_character_fractions = [
-            (5, 0.15),
-            (6, 0.14),
-            (7, 0.13),
-            (8, 0.12),
-            (9, 0.11),
-            (10, 0.10),
-        ]
-        for ngram, threshold in duplicate_ngram_character_fractions:
-            fdist = {}
-            word_list = tagger.parse(document.text).split()
-            mark = [0] * len(word_list)
-            for i in range(len(word_list) - ngram + 1):
-                bag = tuple(word_list[i: i + ngram])
-                if bag in fdist:
-                    for j in range(i, i + ngram):
-                        mark[j] = len(word_list[j])
-                    fdist[bag] += 1
-                else:
-                    fdist[bag] = 1
-
-            if sum(mark) / float(len(document.text)) > threshold:
-                document.is_rejected = True
-                return document
+        if self.detector.is_repetitive(morphology.get_words(document), len(document.text)):
+            document.is_rejected = True
+            return document
 
         document.text = "\n".join([token.text for token in document.tokens if not token.is_rejected])
 
@@ -252,11 +246,10 @@ class DiscardAdultContentJa(document_filters.NgWordsFilterJa):
         self.threshold = threshold
 
     def apply(self, doc: Document) -> Document:
-        tagger = Tagger('-Owakati')
         adult_keywords_pattern = self.keyword_pat
         matches = re.findall(adult_keywords_pattern, doc.text)
         adult_content_count = len(matches)
-        total_words_count = len(tagger.parse(doc.text).split())
+        total_words_count = morphology.get_word_count(doc)
 
         if total_words_count > 0 and adult_content_count / total_words_count > self.threshold:
             doc.is_rejected = True
@@ -276,11 +269,10 @@ class DiscardDiscriminationContentJa(document_filters.NgWordsFilterJa):
         self.threshold = threshold
 
     def apply(self, doc: Document) -> Document:
-        tagger = Tagger('-Owakati')
         adult_keywords_pattern = self.keyword_pat
         matches = re.findall(adult_keywords_pattern, doc.text)
         discrimination_content_count = len(matches)
-        total_words_count = len(tagger.parse(doc.text).split())
+        total_words_count = morphology.get_word_count(doc)
 
         if total_words_count > 0 and discrimination_content_count / total_words_count > self.threshold:
             doc.is_rejected = True
@@ -0,0 +1,53 @@
+from hojichar import Filter, Document
+from fugashi import Tagger
+
+
+_tagger = None
+
+
+def get_tagger() -> Tagger:
+    """
+    プロセスごとに一つだけ Tagger を生成して使い回す
+    """
+    global _tagger
+    if _tagger is None:
+        _tagger = Tagger('-Owakati')
+    return _tagger
+
+
+def tokenize(text: str) -> list[str]:
+    return get_tagger().parse(text).split()
+
+
+def analyze(document: Document) -> list[str]:
+    """
+    文書を形態素解析し, 単語リストと単語数を Document に保持する
+    """
+    document.words = tokenize(document.text)
+    document.word_count = len(document.words)
+    document.analyzed_text = document.text
+    return document.words
+
+
+def get_words(document: Document) -> list[str]:
+    """
+    解析済みの単語リストを返す. 未解析もしくは解析後に本文が変更されている場合は解析し直す
+    """
+    if getattr(document, "analyzed_text", None) == document.text:
+        return document.words
+    return analyze(document)
+
+
+def get_word_count(document: Document) -> int:
+    get_words(document)
+    return document.word_count
+
+
+class AnalyzeMorphologyJa(Filter):
+    """
+    形態素解析を一度だけ行い, 後続のフィルタで単語リストと単語数を共有する
+    """
+
+    def apply(self, document: Document) -> Document:
+        analyze(document)
+        return document
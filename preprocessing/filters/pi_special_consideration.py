@@ -6,18 +6,28 @@ import os
 import json
 import multiprocessing
 from datetime import datetime
+from typing import Union
 
 
 from preprocessing import lib
 from preprocessing.lib import Logger
 from preprocessing.filters.document_filters import DiscardMedicalHistory, DiscardCriminalHistory
+from preprocessing.output import ShardedWriter
+from preprocessing.reader import is_input_file
+from preprocessing.scheduler import StagePool
 
 
 NUM_WORKER = (multiprocessing.cpu_count() - 2)
 
 
-def process_filtering(input_file: str, output_base: str, output_file: str, debug: bool = False, run_medical_history: bool = True, run_criminal_history: bool = True, *, logger=None):
+def process_filtering(input_file: Union[str, list[str]], output_base: str, writer: ShardedWriter,
+                      reject_writer: ShardedWriter, debug: bool = False, run_medical_history: bool = True,
+                      run_criminal_history: bool = True, *, logger=None):
+    """
+    input_file にファイルのリストを渡すと, 1つのプロセスプールで全ファイルをバイト範囲に分けて処理する
+    """
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    input_files = [input_file] if isinstance(input_file, str) else input_file
 
     filters = [document_filters.JSONLoader(), document_filters.DocumentNormalizer()]
     if run_medical_history:
@@ -27,31 +37,23 @@ def process_filtering(input_file: str, output_base: str, output_file: str, debug
     filters.append(document_filters.JSONDumper(dump_reason=True))
     cleaner = Compose(filters)
 
-    input_doc_iter = (Document(line) for line in lib.readlines(input_file))
-    num_jobs = os.environ.get("NUM_WORKER", NUM_WORKER)
-
-    reject_dir = os.path.join(os.path.dirname(output_file), "rejected")
-    os.makedirs(reject_dir, exist_ok=True)
-    reject_file = os.path.join(reject_dir, os.path.basename(output_file))
-    with hojichar.Parallel(cleaner, num_jobs=num_jobs) as filter:
-        out_doc_iter = filter.imap_apply(input_doc_iter)
-
-        with open(output_file, "w") as writer:
-            with open(reject_file, "w") as reject_writer:
-                for result in out_doc_iter:
-                    try:
-                        if result.is_rejected:
-                            reject_writer.write(result.text + "\n")
-                        else:
-                            writer.write(result.text + "\n")
-                    except Exception as e:
-                        logger.error(f"Error processing document: {e}")
+    with StagePool(cleaner, num_jobs=lib.num_workers(NUM_WORKER)) as pool:
+        for text, is_rejected in pool.rows(input_files):
+            try:
+                if is_rejected:
+                    reject_writer.write(text)
+                else:
+                    writer.write(text)
+            except Exception as e:
+                logger.error(f"Error processing document: {e}")
+        pool.log_utilization(logger, "pi filtering")
+        statistics = pool.statistics
 
     if debug:
         os.makedirs(os.path.join(output_base, "stat", "filtering"), exist_ok=True)
-        input_file_prefix = os.path.splitext(os.path.basename(input_file))[0]
-        with open(os.path.join(output_base, "stat", "filtering", f"{input_file_prefix}.jsonl"), "w") as writer:
-            writer.write(json.dumps(cleaner.statistics, ensure_ascii=False) + "\n")
+        input_file_prefix = os.path.splitext(os.path.basename(input_files[0]))[0]
+        with open(os.path.join(output_base, "stat", "filtering", f"{input_file_prefix}.jsonl"), "w") as stat_writer:
+            stat_writer.write(json.dumps(statistics, ensure_ascii=False) + "\n")
 
 
 def arg_parser():
@@ -78,14 +80,12 @@ def main():
     os.makedirs(logdir, exist_ok=True)
 
     logger = Logger.get_logger(name=__name__, logdir=logdir, verbose=args.verbose)
-    for input_file in os.listdir(args.input_dir):
-        if not input_file.endswith(".jsonl"):
-            continue
-
-        input_full_path = os.path.join(args.input_dir, input_file)
-
-        process_filtering(input_file=input_full_path, output_base=output_base, output_file=os.path.join(output_base, input_file),
-                          debug=args.debug, run_medical_history=args.run_medical_history, run_criminal_history=args.run_criminal_history, logger=logger)
+    input_files = [os.path.join(args.input_dir, input_file) for input_file in os.listdir(args.input_dir)
+                   if is_input_file(input_file)]
+    with ShardedWriter(output_base) as writer, ShardedWriter(os.path.join(output_base, "rejected")) as reject_writer:
+        process_filtering(input_file=input_files, output_base=output_base, writer=writer, reject_writer=reject_writer,
+                          debug=args.debug, run_medical_history=args.run_medical_history,
+                          run_criminal_history=args.run_criminal_history, logger=logger)
 
 
 if __name__ == "__main__":
@@ -4,12 +4,25 @@ from hojichar import document_filters, Compose, Document
 import os
 import json
 import multiprocessing
+import shutil
+import time
+from typing import Optional, Union
 
+import numpy as np
 
 from preprocessing.lib import Logger
-from preprocessing.filters.token_filters import RemoveIncompleteSentence, RemoveHeadTailWhitespaceTokenizer, DiscardSpecialCharactersJa, RemoveOnewordNumber
-from preprocessing.filters.document_filters import DiscardAdultContentJa, DiscardBBSComments, DiscardDiscriminationContentJa, RemoveRepetition, NewLineSentenceTokenizer, MergeTokens
-from preprocessing.dedup.dedup import url_dedup
+from preprocessing.filters.token_filters import RemoveIncompleteSentence, RemoveHeadTailWhitespaceTokenizer, DiscardSpecialCharactersJa, RemoveOnewordNumber, RemoveFrequentLines
+from preprocessing.filters.morphology import AnalyzeMorphologyJa
+from preprocessing.filters.document_filters import DiscardAdultContentJa, DiscardBBSComments, DiscardDiscriminationContentJa, RemoveRepetition, NewLineSentenceTokenizer, MergeTokens, JSONHTMLLoader, ComputeMinHashSignature, ComputeLineHashes
+from preprocessing.dedup.dedup import open_dedup_index, url_dedup, write_streaming_dedup_result
+from preprocessing.dedup.docid import input_files
+from preprocessing.dedup.lines import LineCounter
+from preprocessing.dedup.local import select_new_survivors
+from preprocessing.dedup.shingling import DEFAULT_SHINGLER
+from preprocessing.dedup.url import RedisURLIndex, connect_redis, create_local_url_index
+from preprocessing.output import ShardedWriter, read_manifest
+from preprocessing.models.document import DocumentFromHTML
+from preprocessing.scheduler import StagePool
 import preprocessing.lib as lib
 
 
@@ -24,46 +37,119 @@ def __output_dir_after_filtering(base: str):
     return os.path.join(base, "filtering")
 
 
-def execute_url_dedup(input_dir: str, output_base: str, *, logger=None) -> str:
+def __output_dir_after_line_dedup(base: str):
+    return os.path.join(base, "line_dedup")
+
+
+def execute_url_dedup(input_dir: str, output_base: str, keep_url_index: bool = False, url_index: str = "redis",
+                      url_index_path: Optional[str] = None, shard_bytes: int = 1 << 30, *, logger=None) -> str:
+    """
+    url_index が "exact" または "bloom" のときは Redis を使わず, このプロセス内のインデックスで全ファイルを通して重複を除去する.
+    url_index_path を指定すると, 以前の実行で保存したインデックスを読み込み, 実行後に保存し直す.
+    出力は入力ファイルによらず shard_bytes ごとのシャードにまとめる
+    """
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    index = None if url_index == "redis" else create_local_url_index(url_index, path=url_index_path)
+    if index is None:
+        # 中断した実行をやり直すときは, 途中まで登録した URL で全て重複と判定されないように消しておく
+        deleted = RedisURLIndex(connect_redis(), basename=output_base).cleanup()
+        if deleted:
+            logger.info(f"Deleted {deleted} url index keys left by an interrupted run")
 
     output_dir = __output_dir_after_url_dedup(output_base)
     os.makedirs(output_dir, exist_ok=True)
 
-    for input_file in os.listdir(input_dir):
-        if not input_file.endswith(".jsonl"):
-            continue
+    with ShardedWriter(output_dir, max_bytes=shard_bytes) as writer:
+        url_dedup(input_file=[os.path.join(input_dir, input_file) for input_file in input_files(input_dir)],
+                  output_base=output_base, writer=writer, index=index, logger=logger)
 
-        input_full_path = os.path.join(input_dir, input_file)
-        url_dedup(input_file=input_full_path, output_base=output_base,
-                  output_file=os.path.join(output_dir, input_file),
-                  logger=logger)
+    if index is not None:
+        if url_index_path:
+            index.save(url_index_path)
+            logger.info(f"Saved url index to {url_index_path}")
+    elif not keep_url_index:
+        deleted = RedisURLIndex(connect_redis(), basename=output_base).cleanup()
+        logger.info(f"Deleted {deleted} url index keys")
 
     return output_dir
 
 
-def execute_filtering(input_dir: str, output_base: str, *, logger=None) -> list[str]:
+def execute_filtering(input_dir: str, output_base: str, shard_bytes: int = 1 << 30, *, logger=None) -> list[str]:
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
 
     output_dir = __output_dir_after_filtering(output_base)
     os.makedirs(output_dir, exist_ok=True)
 
-    for input_file in os.listdir(input_dir):
-        if not input_file.endswith(".jsonl"):
-            continue
-
-        input_full_path = os.path.join(input_dir, input_file)
-        process_filtering(input_file=input_full_path, output_base=output_base,
-                          output_file=os.path.join(output_dir, input_file), logger=logger)
+    with ShardedWriter(output_dir, max_bytes=shard_bytes) as writer:
+        process_filtering(input_file=[os.path.join(input_dir, input_file) for input_file in input_files(input_dir)],
+                          output_base=output_base, writer=writer, logger=logger)
 
     return output_dir
 
 
-def process_filtering(input_file: str, output_base: str, output_file: str, debug: bool = False, *, logger=None):
+def execute_line_dedup(input_dir: str, output_base: str, min_count: int = 100, shard_bytes: int = 1 << 30,
+                       num_partitions: int = 64, *, logger=None) -> str:
+    """
+    コーパス全体で min_count 個以上の文書に現れる行を除く. 2回のパスで行う.
+    1回目はワーカーが各文書の行のハッシュを計算し, このプロセスが LineCounter で文書数を数える.
+    2回目は多く現れた行のハッシュをワーカーに渡して行を除き, 空になった文書は破棄する
+    """
     logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    paths = [os.path.join(input_dir, input_file) for input_file in input_files(input_dir)]
+    num_jobs = lib.num_workers(NUM_WORKER)
+
+    starttime = time.time()
+    counter = Compose([
+        document_filters.JSONLoader(),
+        NewLineSentenceTokenizer(),
+        ComputeLineHashes(),
+    ])
+    stats: dict = {}
+    with LineCounter(spill_dir=output_base, num_partitions=num_partitions) as line_counter:
+        with StagePool(counter, fields=("line_hashes",), num_jobs=num_jobs) as pool:
+            for (hashes,) in pool.rows(paths):
+                if hashes is not None:
+                    line_counter.add(hashes)
+            pool.log_utilization(logger, "line counting")
+        frequent = line_counter.frequent(min_count, stats)
+        num_documents = line_counter.num_documents
+    endtime = time.time()
+    logger.info(f"Processing time to count lines: {endtime - starttime}")
+    logger.info(f"Found {len(frequent)} of {stats.get('distinct', 0)} distinct lines "
+                f"in at least {min_count} of {num_documents} documents")
+
+    starttime = time.time()
+    output_dir = __output_dir_after_line_dedup(output_base)
     cleaner = Compose([
         document_filters.JSONLoader(),
+        NewLineSentenceTokenizer(),
+        RemoveFrequentLines(frequent),
+        MergeTokens(delimiter="\n"),
+        document_filters.DocumentLengthFilter(min_doc_len=1),
+        document_filters.JSONDumper(dump_reason=True),
+    ])
+    num_rejected = 0
+    with ShardedWriter(output_dir, max_bytes=shard_bytes) as writer, \
+            StagePool(cleaner, num_jobs=num_jobs) as pool:
+        for text, is_rejected in pool.rows(paths):
+            if is_rejected:
+                num_rejected += 1
+            else:
+                writer.write(text)
+        pool.log_utilization(logger, "line dedup")
+    endtime = time.time()
+    logger.info(f"Processing time to remove frequent lines: {endtime - starttime}")
+    logger.info(f"Discarded {num_rejected} documents left empty")
+    return output_dir
+
+
+def filtering_filters() -> list:
+    """
+    JSON の読み込みと書き出しを除いたフィルタリングの処理
+    """
+    return [
         document_filters.DocumentNormalizer(),
+        AnalyzeMorphologyJa(),
         DiscardAdultContentJa(),
         DiscardBBSComments(),
         document_filters.DiscardAds(),
@@ -80,24 +166,119 @@ def process_filtering(input_file: str, output_base: str, output_file: str, debug
         RemoveOnewordNumber(),
         MergeTokens(delimiter="\n"),
         document_filters.MaskPersonalInformation(),
+    ]
+
+
+def process_filtering(input_file: Union[str, list[str]], output_base: str, writer: ShardedWriter, debug: bool = False,
+                      *, logger=None):
+    """
+    input_file にファイルのリストを渡すと, 1つのプロセスプールで全ファイルをバイト範囲に分けて処理する
+    """
+    logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    input_files = [input_file] if isinstance(input_file, str) else input_file
+    cleaner = Compose([
+        document_filters.JSONLoader(),
+        *filtering_filters(),
         document_filters.JSONDumper(dump_reason=True),
     ])
 
-    input_doc_iter = (Document(line) for line in lib.readlines(input_file))
-    num_jobs = os.environ.get("NUM_WORKER", NUM_WORKER)
-    with hojichar.Parallel(cleaner, num_jobs=num_jobs) as filter:
-        out_doc_iter = filter.imap_apply(input_doc_iter)
-
-        with open(output_file, "w") as writer:
-            for result in out_doc_iter:
-                try:
-                    if not result.is_rejected:
-                        writer.write(result.text + "\n")
-                except Exception as e:
-                    logger.error(f"Error processing document: {e}")
+    with StagePool(cleaner, num_jobs=lib.num_workers(NUM_WORKER)) as pool:
+        for text, is_rejected in pool.rows(input_files):
+            try:
+                if not is_rejected:
+                    writer.write(text)
+            except Exception as e:
+                logger.error(f"Error processing document: {e}")
+        pool.log_utilization(logger, "filtering")
+        statistics = pool.statistics
 
     if debug:
         os.makedirs(os.path.join(output_base, "stat", "filtering"), exist_ok=True)
-        input_file_prefix = os.path.splitext(os.path.basename(input_file))[0]
-        with open(os.path.join(output_base, f"{input_file_prefix}.jsonl"), "w") as writer:
-            writer.write(json.dumps(cleaner.statistics, ensure_ascii=False) + "\n")
+        input_file_prefix = os.path.splitext(os.path.basename(input_files[0]))[0]
+        with open(os.path.join(output_base, f"{input_file_prefix}.jsonl"), "w") as stat_writer:
+            stat_writer.write(json.dumps(statistics, ensure_ascii=False) + "\n")
+
+
+def execute_fused(input_dir: str, output_base: str, url_index: str = "exact", url_index_path: Optional[str] = None,
+                  shingler: str = DEFAULT_SHINGLER, threshold: float = 0.9, num_perm: int = 128, window: int = 1000,
+                  shard_bytes: int = 1 << 30, compression: str = "none", keep_intermediate: bool = False,
+                  index_dir: Optional[str] = None, *, logger=None) -> str:
+    """
+    URL による重複除去, フィルタリング, MinHash シグネチャの計算を, 文書ごとに1回のワーカー処理で行う.
+    JSON の読み込みは1回だけで, 段階ごとの中間ファイルは作らない.
+    フィルタを通過した本文だけを filtering/ に書き出し, シグネチャをこのプロセスでクラスタリングした後,
+    残す文書を minhash_dedup/ に書き出す. filtering/ は keep_intermediate=True のときだけ残す.
+
+    URL は段階を分けた場合と同じく, フィルタで破棄された文書も含めて最初に現れたものだけを新規とする.
+    index_dir を指定すると, 以前の実行で残した文書と一致するものも除き, 残した文書をそのインデックスに追加する
+    """
+    logger = logger or Logger.get_logger(__name__, logdir=os.path.join(output_base, "log"))
+    if url_index == "redis":
+        index = RedisURLIndex(connect_redis(), basename=output_base)
+        index.cleanup()
+    else:
+        index = create_local_url_index(url_index, path=url_index_path)
+
+    filtered_dir = __output_dir_after_filtering(output_base)
+    cleaner = Compose([
+        JSONHTMLLoader(),
+        *filtering_filters(),
+        ComputeMinHashSignature(num_perm=num_perm, shingler=shingler),
+    ])
+
+    starttime = time.time()
+    signatures: list[np.ndarray] = []
+    num_duplicated = 0
+    num_rejected = 0
+    with ShardedWriter(filtered_dir, max_bytes=shard_bytes) as writer, \
+            StagePool(cleaner, document_class=DocumentFromHTML, fields=("text", "is_rejected", "url", "signature"),
+                      num_jobs=lib.num_workers(NUM_WORKER)) as pool:
+        for result in pool.imap([os.path.join(input_dir, input_file) for input_file in input_files(input_dir)]):
+            for i in range(0, len(result.rows), window):
+                batch = result.rows[i:i + window]
+                for (text, is_rejected, _, signature), is_new in zip(batch, index.add_many(row[2] for row in batch)):
+                    if not is_new:
+                        num_duplicated += 1
+                    elif is_rejected:
+                        num_rejected += 1
+                    else:
+                        writer.write_text(text)
+                        signatures.append(signature)
+        pool.log_utilization(logger, "fused")
+
+    endtime = time.time()
+    logger.info(f"Processing time of fused url dedup, filtering and minhash: {endtime - starttime}")
+    logger.info(f"Rejected {num_duplicated} documents with duplicated urls and {num_rejected} documents by filters")
+    if url_index != "redis" and url_index_path:
+        index.save(url_index_path)
+
+    starttime = time.time()
+    signatures = np.array(signatures, dtype=np.uint32).reshape(-1, num_perm)
+    dedup_index = open_dedup_index(index_dir, output_base, threshold, num_perm) if index_dir else None
+    stats: dict = {}
+    survivors, num_seen = select_new_survivors(signatures, threshold, dedup_index, spill_dir=output_base,
+                                               stats=stats)
+    logger.info(f"Rejected {stats.get('rejected', 0)} of {stats.get('candidates', 0)} candidate edges "
+                f"below the threshold {threshold}")
+    doc_ids_by_file = {}
+    start = 0
+    for shard in read_manifest(filtered_dir)["shards"]:
+        doc_ids_by_file[shard["file"]] = range(start, start + shard["num_docs"])
+        start += shard["num_docs"]
+    logger.info(f"Kept {len(survivors)} of {len(signatures)} documents")
+    if dedup_index is not None:
+        logger.info(f"Dropped {num_seen} documents found in the index {index_dir}")
+        rows = sorted(survivors)
+        # filtering/ は削除されることがあるので, 出力された順の番号を代表文書IDにする
+        version = dedup_index.add(signatures[rows], [f"minhash_dedup:{i}" for i in range(len(rows))])
+        logger.info(f"Added {len(rows)} documents to the index as version {version}")
+
+    output_dir = os.path.join(output_base, "minhash_dedup")
+    write_streaming_dedup_result(input_dir=filtered_dir, doc_ids_by_file=doc_ids_by_file, survivors=survivors,
+                                 output_dir=output_dir, max_bytes=shard_bytes, compression=compression)
+    endtime = time.time()
+    logger.info(f"Processing time to dedup: {endtime - starttime}")
+
+    if not keep_intermediate:
+        shutil.rmtree(filtered_dir)
+    return output_dir
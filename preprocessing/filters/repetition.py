@@ -0,0 +1,81 @@
+import numpy as np
+
+
+TOP_NGRAM_CHARACTER_FRACTIONS = [
+    (2, 0.2),
+    (3, 0.18),
+    (4, 0.16),
+]
+
+DUPLICATE_NGRAM_CHARACTER_FRACTIONS = [
+    (5, 0.15),
+    (6, 0.14),
+    (7, 0.13),
+    (8, 0.12),
+    (9, 0.11),
+    (10, 0.10),
+]
+
+
+class NgramRepetitionDetector():
+    """
+    単語列を一度だけ整数IDに変換し, 全ての n について n-gram の繰り返し率をまとめて計算する.
+
+    n-gram のIDは (n-1)-gram のIDと末尾の単語IDの組を振り直して求めるため, ハッシュの衝突は起きない.
+    閾値を超えた時点で打ち切る.
+    """
+
+    def __init__(self, top_ngram_character_fractions: list[tuple[int, float]] = TOP_NGRAM_CHARACTER_FRACTIONS,
+                 duplicate_ngram_character_fractions: list[tuple[int, float]] = DUPLICATE_NGRAM_CHARACTER_FRACTIONS) -> None:
+        self.top_ngram_character_fractions = dict(top_ngram_character_fractions)
+        self.duplicate_ngram_character_fractions = dict(duplicate_ngram_character_fractions)
+        self.max_n = max([*self.top_ngram_character_fractions, *self.duplicate_ngram_character_fractions])
+
+    def is_repetitive(self, words: list[str], text_length: int) -> bool:
+        if text_length == 0 or len(words) < 2:
+            return False
+
+        vocab: dict[str, int] = {}
+        word_ids = np.array([vocab.setdefault(word, len(vocab)) for word in words], dtype=np.int64)
+        word_lengths = np.array([len(word) for word in words], dtype=np.int64)
+        cumulative_lengths = np.concatenate(([0], np.cumsum(word_lengths)))
+        vocab_size = len(vocab)
+
+        ngram_ids = word_ids
+        for n in range(2, self.max_n + 1):
+            num_ngrams = len(words) - n + 1
+            if num_ngrams <= 0:
+                break
+
+            keys = ngram_ids[:num_ngrams] * vocab_size + word_ids[n - 1:]
+            _, first_index, ngram_ids, counts = np.unique(
+                keys, return_index=True, return_inverse=True, return_counts=True)
+
+            if n in self.top_ngram_character_fractions:
+                if self._top_ngram_fraction_exceeds(n, first_index, counts, cumulative_lengths, text_length):
+                    return True
+
+            if n in self.duplicate_ngram_character_fractions:
+                if self._duplicate_ngram_fraction_exceeds(n, first_index, ngram_ids, word_lengths, text_length):
+                    return True
+
+        return False
+
+    def _top_ngram_fraction_exceeds(self, n: int, first_index: np.ndarray, counts: np.ndarray,
+                                    cumulative_lengths: np.ndarray, text_length: int) -> bool:
+        char_counts = cumulative_lengths[first_index + n] - cumulative_lengths[first_index]
+        fractions = char_counts * (counts - 1) / text_length
+        return bool(np.any(fractions > self.top_ngram_character_fractions[n]))
+
+    def _duplicate_ngram_fraction_exceeds(self, n: int, first_index: np.ndarray, ngram_ids: np.ndarray,
+                                          word_lengths: np.ndarray, text_length: int) -> bool:
+        positions = np.arange(len(ngram_ids))
+        duplicated = np.flatnonzero(first_index[ngram_ids] != positions)
+        if len(duplicated) == 0:
+            return False
+
+        coverage = np.zeros(len(word_lengths) + 1, dtype=np.int64)
+        np.add.at(coverage, duplicated, 1)
+        np.add.at(coverage, duplicated + n, -1)
+        covered = np.cumsum(coverage[:-1]) > 0
+        return int(word_lengths[covered].sum()) / float(text_length) > self.duplicate_ngram_character_fractions[n]
@@ -1,9 +1,12 @@
 from hojichar import document_filters, TokenFilter, Document, Compose, Filter, Token
-from fugashi import Tagger
 
 import os
 import re
 
+import numpy as np
+
+from preprocessing.dedup.lines import line_hash
+from preprocessing.filters import morphology
 from preprocessing.filters.document_filters import NewLineSentenceTokenizer, MergeTokens, BeforeMergeTokenCallback
 
 
@@ -45,9 +48,8 @@ class RemoveOnewordNumber(TokenFilter):
         return re.compile(r'((\d{2,4}([-年/])\d{1,2}([-月/])\d{1,2}日?)|(\d{2,4}([-年/])\d{1,2}([-月])?)|(\d{1,2}([-月/])\d{1,2}日?)).{0,8}$')
 
     def apply(self, token: Token) -> Token:
-        tagger = Tagger('-Owakati')
         text = token.text
-        word_count = len(tagger.parse(text).split())
+        word_count = len(morphology.tokenize(text))
         if word_count <= 1:
             token.is_rejected = True
         elif text.isdigit() or text.isdecimal() or text.isnumeric():
@@ -71,6 +73,25 @@ class DiscardSpecialCharactersJa(TokenFilter):
         return token
 
 
+class RemoveFrequentLines(TokenFilter):
+    """
+    コーパス全体で多くの文書に現れる行 (フッター, メニュー, Cookie の告知など) を破棄します.
+    frequent は LineCounter.frequent が返すソート済みのハッシュです
+    """
+
+    def __init__(self, frequent: np.ndarray, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frequent = np.asarray(frequent, dtype=np.uint64)
+
+    def apply(self, token: Token) -> Token:
+        value = line_hash(token.text)
+        if value is not None and len(self.frequent):
+            position = min(int(np.searchsorted(self.frequent, np.uint64(value))), len(self.frequent) - 1)
+            if self.frequent[position] == value:
+                token.is_rejected = True
+        return token
+
+
 def __debug_token_filter(lines, output_base: str, token_filter: Filter):
     removed_tokens: dict[str, set[str]] = {}
     cleaner = Compose([
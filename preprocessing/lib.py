@@ -1,6 +1,7 @@
 from doctest import debug
 from typing import Generator
 import os
+import resource
 from logging import getLogger, WARN, DEBUG,  ERROR, INFO, StreamHandler, FileHandler, Filter, Formatter, warn
 
 from numpy import info
@@ -12,6 +13,20 @@ def readlines(file: str) -> Generator[str, None, None]:
             yield line
 
 
+def num_workers(default: int) -> int:
+    """
+    環境変数 NUM_WORKER があればその値, なければ default を, 1 以上の整数で返す
+    """
+    return max(1, int(os.environ.get("NUM_WORKER", default)))
+
+
+def peak_rss() -> int:
+    """
+    このプロセスの最大常駐メモリ (バイト)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
 class Logger:
     class InfoFilter(Filter):
         def filter(self, record):
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Optional
+
+from preprocessing.dedup.docid import input_files
+from preprocessing.output import MANIFEST_FILENAME, read_manifest
+
+
+RUN_MANIFEST_FILENAME = "run_manifest.json"
+
+DONE = "done"
+RUNNING = "running"
+FAILED = "failed"
+
+
+def file_hash(path: str, sample_bytes: int = 1 << 20) -> str:
+    """
+    ファイルサイズと先頭・末尾 sample_bytes の blake2b. 巨大な入力を全て読まずに, 差し替えられたファイルを検出する
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode("utf-8"), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(sample_bytes))
+        if size > sample_bytes:
+            f.seek(max(sample_bytes, size - sample_bytes))
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+class RunManifest():
+    """
+    実行ディレクトリの run_manifest.json. ステージごと, 入力ファイルごとに状態, 入力のハッシュ, 出力先, 統計を記録し,
+    --resume で完了した部分を読み飛ばすのに使う
+    """
+
+    def __init__(self, run_dir: str) -> None:
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, RUN_MANIFEST_FILENAME)
+        self.data: dict = {"stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def save(self) -> None:
+        os.makedirs(self.run_dir, exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def stage(self, name: str) -> dict:
+        return self.data["stages"].setdefault(name, {"status": RUNNING, "files": {}})
+
+    def start_stage(self, name: str, **params) -> dict:
+        stage = self.stage(name)
+        stage["status"] = RUNNING
+        stage.update(params)
+        stage["started_at"] = time.time()
+        self.save()
+        return stage
+
+    def finish_stage(self, name: str, output: Optional[str] = None, stats: Optional[dict] = None) -> None:
+        stage = self.stage(name)
+        stage["status"] = DONE
+        stage["output"] = output
+        stage["stats"] = stats or {}
+        stage["finished_at"] = time.time()
+        self.save()
+
+    def mark_file(self, name: str, input_file: str, status: str, content_hash: Optional[str] = None,
+                  output: Optional[str] = None, stats: Optional[dict] = None, save: bool = True) -> None:
+        entry = self.stage(name)["files"].setdefault(input_file, {})
+        entry["status"] = status
+        if content_hash is not None:
+            entry["hash"] = content_hash
+        if output is not None:
+            entry["output"] = output
+        if stats is not None:
+            entry["stats"] = stats
+        if save:
+            self.save()
+
+    def is_file_done(self, name: str, input_file: str, content_hash: str) -> bool:
+        entry = self.stage(name)["files"].get(input_file)
+        return entry is not None and entry.get("status") == DONE and entry.get("hash") == content_hash
+
+    def completed_output(self, name: str, input_files: list[str]) -> Optional[str]:
+        """
+        ステージが完了しており, 入力ファイルの集合とその内容が記録と一致すれば出力先を返す
+        """
+        stage = self.data["stages"].get(name)
+        if stage is None or stage.get("status") != DONE or set(stage["files"]) != set(input_files):
+            return None
+        if not all(self.is_file_done(name, input_file, file_hash(input_file)) for input_file in input_files):
+            return None
+        return stage.get("output")
+
+
+def run_stage(manifest: Optional[RunManifest], name: str, input_dir: str, execute: Callable[[], str],
+              *, logger) -> str:
+    """
+    ステージを実行して出力先を返す. manifest に完了が記録されていれば実行せずに記録された出力先を返す.
+    execute の中で入力ファイルを FAILED にした場合はステージを完了にせず, 次の --resume でやり直す
+    """
+    paths = [os.path.join(input_dir, filename) for filename in input_files(input_dir)]
+    if manifest is None:
+        return execute()
+
+    output = manifest.completed_output(name, paths)
+    if output is not None:
+        logger.info(f"Skipping {name}: already completed in {output}")
+        return output
+
+    manifest.start_stage(name, input_dir=input_dir)
+    output = execute()
+
+    files = manifest.stage(name)["files"]
+    failed = [path for path in paths if files.get(path, {}).get("status") == FAILED]
+    for path in paths:
+        if path not in failed:
+            manifest.mark_file(name, path, DONE, file_hash(path), output=output, save=False)
+    if failed:
+        manifest.save()
+        logger.error(f"{len(failed)} files failed in {name}. Run again with --resume to retry them")
+        return output
+
+    stats = {}
+    if os.path.exists(os.path.join(output, MANIFEST_FILENAME)):
+        stats = {key: value for key, value in read_manifest(output).items() if key != "shards"}
+    manifest.finish_stage(name, output, stats)
+    return output
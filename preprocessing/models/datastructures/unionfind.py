@@ -1,51 +1,151 @@
+from typing import Union
+
+import numpy as np
+
+
 class UnionFind():
-    def __init__(self, elements: list[str]) -> None:
-        self.element_map = {element: index for index, element in enumerate(elements)}
-        self.root = [-1] * len(elements)
-        self.rank = [0] * len(elements)  # Initialize rank
-
-    def find(self, element: str) -> int:
-        x = self.element_map[element]
-        if self.root[x] < 0:
-            return x
+    """
+    配列で親を保持する UnionFind.
+
+    要素数 n または要素 (文書ID) のリストで初期化する. 文字列の要素は一度だけ 0..n-1 の整数に変換し,
+    内部では int32 (n >= 2**31 の場合は int64) の親配列のみを保持するため, 1要素あたり 4 バイトで済む.
+    根は常に連結成分内で最小の整数をもつ要素になる.
+    """
+
+    def __init__(self, elements: Union[list[str], int]) -> None:
+        if isinstance(elements, int):
+            self.elements = None
+            self.element_map = None
+            n = elements
         else:
-            self.root[x] = self.find(list(self.element_map.keys())[self.root[x]])  # Path compression
-            return self.root[x]
+            self.elements = list(elements)
+            self.element_map = {element: index for index, element in enumerate(self.elements)}
+            n = len(self.elements)
+
+        self.dtype = np.int32 if n < np.iinfo(np.int32).max else np.int64
+        self.root = np.arange(n, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return len(self.root)
+
+    def index(self, element) -> int:
+        return element if self.element_map is None else self.element_map[element]
+
+    def _element(self, index: int):
+        return index if self.elements is None else self.elements[index]
+
+    def _find(self, x: int) -> int:
+        root = self.root
+        while root[x] != x:
+            root[x] = root[root[x]]  # Path halving
+            x = root[x]
+        return int(x)
+
+    def _compress(self) -> None:
+        """
+        全要素の親を根に付け替える (pointer jumping)
+        """
+        root = self.root
+        while True:
+            grandparent = root[root]
+            if np.array_equal(grandparent, root):
+                return
+            root[:] = grandparent
+
+    def find(self, element) -> int:
+        return self._find(self.index(element))
 
-    def union(self, element1: str, element2: str):
+    def union(self, element1, element2):
         root1: int = self.find(element1)
         root2: int = self.find(element2)
 
         if root1 == root2:
             return
 
-        # Attach smaller rank tree under root of higher rank tree
-        if self.rank[root1] < self.rank[root2]:
-            self.root[root1] = root2
-        elif self.rank[root1] > self.rank[root2]:
+        # Attach the root with the larger index under the smaller one
+        if root1 < root2:
             self.root[root2] = root1
         else:
-            self.root[root2] = root1
-            self.rank[root1] += 1  # Increase rank if both trees have same rank
+            self.root[root1] = root2
+
+    def union_edges(self, src: np.ndarray, dst: np.ndarray) -> None:
+        """
+        整数インデックスの辺 (src[i], dst[i]) をまとめて併合する
+        """
+        src = np.asarray(src, dtype=self.dtype)
+        dst = np.asarray(dst, dtype=self.dtype)
+        if len(src) != len(dst):
+            raise ValueError("src and dst must have the same length")
+
+        self._compress()
+        while len(src) > 0:
+            root_src = self.root[src]
+            root_dst = self.root[dst]
+            unresolved = root_src != root_dst
+            if not unresolved.any():
+                return
+
+            src, dst = src[unresolved], dst[unresolved]
+            root_src, root_dst = root_src[unresolved], root_dst[unresolved]
+            np.minimum.at(self.root, np.maximum(root_src, root_dst), np.minimum(root_src, root_dst))
+            self._compress()
+
+    def labels(self) -> np.ndarray:
+        """
+        各要素の連結成分番号 (0..group_count-1) を一度の走査で求める
+        """
+        self._compress()
+        is_root = self.root == np.arange(len(self.root), dtype=self.dtype)
+        root_labels = np.cumsum(is_root, dtype=self.dtype) - 1
+        return root_labels[self.root]
 
     def size(self, element):
-        return -self.root[self.find(element)]
+        root = self.find(element)
+        self._compress()
+        return int(np.count_nonzero(self.root == root))
 
     def same(self, element1, element2):
         return self.find(element1) == self.find(element2)
 
     def members(self, element):
         root = self.find(element)
-        return [elem for elem, idx in self.element_map.items() if self.find(elem) == root]
+        self._compress()
+        return [self._element(int(i)) for i in np.flatnonzero(self.root == root)]
 
     def roots(self):
-        return [list(self.element_map.keys())[i] for i, x in enumerate(self.root) if x < 0]
+        self._compress()
+        return [self._element(int(i)) for i in np.flatnonzero(self.root == np.arange(len(self.root)))]
 
     def group_count(self):
-        return len(self.roots())
+        self._compress()
+        return int(np.count_nonzero(self.root == np.arange(len(self.root))))
+
+    def group_offsets(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        連結成分ごとに並べた整数インデックスと, 各成分の開始位置 (長さ group_count+1) を返す.
+        i 番目の成分は order[offsets[i]:offsets[i+1]]
+        """
+        labels = self.labels()
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels))))
+        return order, offsets
+
+    def group_indices(self) -> list[np.ndarray]:
+        """
+        連結成分ごとの整数インデックスの配列
+        """
+        order, offsets = self.group_offsets()
+        if len(order) == 0:
+            return []
+        return np.split(order, offsets[1:-1])
 
     def all_group_members(self):
-        return {r: self.members(r) for r in self.roots()}
+        return {self._element(int(indices[0])): self._group_members(indices) for indices in self.group_indices()}
 
     def groups(self):
-        return [self.members(r) for r in self.roots()]
+        return [self._group_members(indices) for indices in self.group_indices()]
+
+    def _group_members(self, indices: np.ndarray):
+        if self.elements is None:
+            return indices.tolist()
+        return [self.elements[i] for i in indices.tolist()]
@@ -0,0 +1,135 @@
+import gzip
+import io
+import json
+import os
+import re
+from typing import BinaryIO, Iterable, Optional
+
+
+COMPRESSIONS = {
+    "none": ".jsonl",
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def _open_compressed(path: str, compression: str, buffer_size: int) -> BinaryIO:
+    """
+    圧縮前のバイト列を buffer_size ずつまとめて圧縮器に渡す
+    """
+    if compression == "none":
+        return open(path, "wb", buffering=buffer_size)
+    if compression == "gzip":
+        return io.BufferedWriter(gzip.GzipFile(path, mode="wb", compresslevel=6), buffer_size)
+    if compression == "zstd":
+        import zstandard  # zstd を使うときだけ必要
+        return io.BufferedWriter(zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb")), buffer_size)
+    raise ValueError(f"Unknown compression: {compression}. Available: {', '.join(COMPRESSIONS)}")
+
+
+class ShardedWriter():
+    """
+    1行1文書の JSONL を, max_bytes (圧縮前のバイト数) または max_rows 行ごとにシャードへ分けて書き出す.
+    シャードは {prefix}{番号:05d}.jsonl[.gz|.zst] という名前で, close したときにシャードごとの文書数と
+    バイト数を manifest.json に書き出す. 中断した実行をやり直したときに残っている余分なシャードは close で削除する
+    """
+
+    def __init__(self, output_dir: str, prefix: str = "", max_bytes: Optional[int] = 1 << 30,
+                 max_rows: Optional[int] = None, compression: str = "none", buffer_size: int = 8 << 20) -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}. Available: {', '.join(COMPRESSIONS)}")
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.shards: list[dict] = []
+
+        self._writer: Optional[BinaryIO] = None
+        self._num_rows = 0
+        self._num_bytes = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _shard_filename(self, shard: int) -> str:
+        return f"{self.prefix}{shard:05d}{COMPRESSIONS[self.compression]}"
+
+    def _open_shard(self) -> None:
+        path = os.path.join(self.output_dir, self._shard_filename(len(self.shards)))
+        self._writer = _open_compressed(path, self.compression, self.buffer_size)
+        self._num_rows = 0
+        self._num_bytes = 0
+
+    def _close_shard(self) -> None:
+        if self._writer is None:
+            return
+        self._writer.close()
+        filename = self._shard_filename(len(self.shards))
+        self.shards.append({
+            "file": filename,
+            "num_docs": self._num_rows,
+            "num_bytes": self._num_bytes,
+            "file_bytes": os.path.getsize(os.path.join(self.output_dir, filename)),
+        })
+        self._writer = None
+
+    def _is_full(self) -> bool:
+        return (self.max_rows is not None and self._num_rows >= self.max_rows) or \
+            (self.max_bytes is not None and self._num_bytes >= self.max_bytes)
+
+    def write(self, line: str) -> None:
+        """
+        改行を含まない1行 (JSON) を書き込む
+        """
+        if self._writer is not None and self._is_full():
+            self._close_shard()
+        if self._writer is None:
+            self._open_shard()
+
+        data = line.encode("utf-8") + b"\n"
+        self._writer.write(data)
+        self._num_rows += 1
+        self._num_bytes += len(data)
+
+    def write_many(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def write_text(self, text: str) -> None:
+        self.write(json.dumps({"text": text}, ensure_ascii=False))
+
+    @property
+    def num_docs(self) -> int:
+        return sum(shard["num_docs"] for shard in self.shards) + (self._num_rows if self._writer is not None else 0)
+
+    def _remove_stale_shards(self) -> None:
+        pattern = re.compile(re.escape(self.prefix) + r"\d{5}\.jsonl(\.gz|\.zst)?")
+        written = {shard["file"] for shard in self.shards}
+        for filename in os.listdir(self.output_dir):
+            if pattern.fullmatch(filename) and filename not in written:
+                os.remove(os.path.join(self.output_dir, filename))
+
+    def close(self) -> None:
+        self._close_shard()
+        self._remove_stale_shards()
+        manifest = {
+            "compression": self.compression,
+            "num_docs": sum(shard["num_docs"] for shard in self.shards),
+            "num_bytes": sum(shard["num_bytes"] for shard in self.shards),
+            "shards": self.shards,
+        }
+        with open(os.path.join(self.output_dir, f"{self.prefix}{MANIFEST_FILENAME}"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    def __enter__(self) -> "ShardedWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def read_manifest(output_dir: str, prefix: str = "") -> dict:
+    with open(os.path.join(output_dir, f"{prefix}{MANIFEST_FILENAME}"), "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,369 @@
+import gzip
+import mmap
+import os
+import queue
+import struct
+import threading
+from typing import Iterator, Optional
+
+import numpy as np
+
+
+class JsonlReader():
+    """
+    JSONL ファイルをメモリマップし, 改行の位置をまとめて求めて行を切り出す.
+    行は改行を除いたバイト列のまま返すので, デコードは使う側で必要になったときに行う.
+
+    バイト範囲 [start, end) は改行の直後に揃えて分割するため, 複数のワーカーが同じファイルの別の範囲を
+    互いに読み飛ばしなしで並列に読める
+    """
+
+    def __init__(self, path: str, block_size: int = 64 << 20) -> None:
+        self.path = path
+        self.block_size = block_size
+        self.size = os.path.getsize(path)
+        self._file = None
+        self._mmap: Optional[mmap.mmap] = None
+
+    def open(self) -> "JsonlReader":
+        if self._mmap is None and self.size > 0:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __enter__(self) -> "JsonlReader":
+        return self.open()
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def align(self, position: int) -> int:
+        """
+        position 以降で最初の行頭のバイト位置
+        """
+        if position <= 0:
+            return 0
+        if position >= self.size:
+            return self.size
+        newline = self.open()._mmap.find(b"\n", position - 1)
+        return self.size if newline < 0 else newline + 1
+
+    def split(self, num_chunks: int) -> list[tuple[int, int]]:
+        """
+        ファイルをおよそ等しい大きさの num_chunks 個の, 行の境界に揃ったバイト範囲に分ける. 空の範囲は除く
+        """
+        boundaries = sorted({self.align(self.size * i // num_chunks) for i in range(num_chunks)} | {self.size})
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+    def split_by_size(self, chunk_bytes: int) -> list[tuple[int, int]]:
+        return self.split(max(1, -(-self.size // chunk_bytes)))
+
+    def line_starts(self, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """
+        行頭が [start, end) にある行の, 行頭のバイト位置の配列 (末尾にその範囲の行の終わりを加える).
+        start は行頭に揃っている必要がある
+        """
+        end = self.size if end is None else end
+        starts = [np.array([start], dtype=np.int64)] if start < end else []
+        position = start
+        while position < end:
+            block_end = min(position + self.block_size, end)
+            block = np.frombuffer(self.open()._mmap, dtype=np.uint8, count=block_end - position, offset=position)
+            starts.append(np.flatnonzero(block == ord("\n")).astype(np.int64) + position + 1)
+            position = block_end
+        if not starts:
+            return np.array([start], dtype=np.int64)
+        starts = np.concatenate(starts)
+        if starts[-1] < end:
+            # 改行で終わらない最後の行
+            starts = np.append(starts, end)
+        return starts
+
+    def iter_blocks(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        [start, end) を行の境界に揃った block_size 程度のバイト列に分けて返す
+        """
+        end = self.size if end is None else end
+        position = start
+        while position < end:
+            block_end = self.align(min(position + self.block_size, end))
+            yield self.open()._mmap[position:block_end]
+            position = block_end
+
+    def iter_raw(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        [start, end) の各行を改行を除いたバイト列として返す. start と end は行頭に揃っている必要がある
+        """
+        for block in self.iter_blocks(start, end):
+            lines = block.split(b"\n")
+            if lines[-1] == b"":
+                lines.pop()
+            yield from lines
+
+    def iter_with_offsets(self, start: int = 0, end: Optional[int] = None) -> Iterator[tuple[int, bytes]]:
+        """
+        各行の行頭のバイト位置と, 改行を除いたバイト列
+        """
+        starts = self.line_starts(start, end)
+        for offset, line in zip(starts[:-1].tolist(), self.iter_raw(start, end)):
+            yield offset, line
+
+    def iter_lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """
+        ブロックごとにまとめてデコードした各行
+        """
+        for block in self.iter_blocks(start, end):
+            lines = block.decode("utf-8").split("\n")
+            if lines[-1] == "":
+                lines.pop()
+            yield from lines
+
+
+def read_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    with JsonlReader(path) as reader:
+        yield from reader.iter_lines(start, end)
+
+
+INPUT_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+# seekable zstd 形式 (zstd の contrib/seekable_format) の末尾にあるシークテーブルのマジックナンバー
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_SKIPPABLE_MAGIC = 0x184D2A5E
+
+
+def is_input_file(filename: str) -> bool:
+    return filename.endswith(INPUT_SUFFIXES)
+
+
+def _is_plain(path: str) -> bool:
+    return os.fspath(path).endswith(".jsonl")
+
+
+def _prefetch(iterator: Iterator[bytes], depth: int = 4) -> Iterator[bytes]:
+    """
+    別スレッドで iterator を先読みする. 展開処理は GIL を解放するので, 呼び出し側の処理と並行して進む
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                buffer.put(item)
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            buffer.put(e)
+        finally:
+            buffer.put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 途中で読むのをやめた場合も, 先読みのスレッドを止める
+        stop.set()
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+def _decompressed_chunks(path: str, chunk_size: int) -> Iterator[bytes]:
+    if os.fspath(path).endswith(".gz"):
+        stream = gzip.open(path, "rb")
+    elif os.fspath(path).endswith(".zst"):
+        import zstandard  # zstd を使うときだけ必要
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    else:
+        stream = open(path, "rb")
+    with stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _line_blocks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    展開したバイト列を, 行の境界で終わるブロックにまとめ直す
+    """
+    rest = b""
+    for chunk in chunks:
+        chunk = rest + chunk
+        newline = chunk.rfind(b"\n")
+        if newline < 0:
+            rest = chunk
+            continue
+        rest = chunk[newline + 1:]
+        yield chunk[:newline + 1]
+    if rest:
+        yield rest
+
+
+def zstd_seek_table(path: str) -> Optional[np.ndarray]:
+    """
+    seekable zstd のシークテーブルを (フレーム数, 2) の [圧縮後のサイズ, 展開後のサイズ] として読む. なければ None
+    """
+    size = os.path.getsize(path)
+    if size < 9:
+        return None
+    with open(path, "rb") as f:
+        f.seek(size - 9)
+        num_frames, descriptor, magic = struct.unpack("<IBI", f.read(9))
+        if magic != _SEEKABLE_MAGIC:
+            return None
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = 8 + num_frames * entry_size + 9
+        if table_size > size:
+            return None
+        f.seek(size - table_size)
+        skippable_magic, _ = struct.unpack("<II", f.read(8))
+        if skippable_magic != _SKIPPABLE_MAGIC:
+            return None
+        entries = np.frombuffer(f.read(num_frames * entry_size), dtype="<u4").reshape(num_frames, entry_size // 4)
+    return entries[:, :2].astype(np.int64)
+
+
+class _SeekableZstd():
+    def __init__(self, path: str, table: np.ndarray) -> None:
+        import zstandard  # zstd を使うときだけ必要
+        self.path = path
+        self.offsets = np.concatenate(([0], np.cumsum(table[:, 0])))
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.offsets) - 1
+
+    def frame_index(self, offset: int) -> int:
+        return min(int(np.searchsorted(self.offsets, offset)), self.num_frames)
+
+    def frame(self, f, index: int) -> bytes:
+        f.seek(int(self.offsets[index]))
+        return self.decompressor.decompressobj().decompress(f.read(int(self.offsets[index + 1] - self.offsets[index])))
+
+    def units(self, unit_bytes: int) -> list[tuple[int, int]]:
+        """
+        フレームの境界で, 圧縮後のおよそ unit_bytes ごとに分ける
+        """
+        boundaries = [0]
+        for offset in self.offsets[1:].tolist():
+            if offset - boundaries[-1] >= unit_bytes:
+                boundaries.append(offset)
+        if boundaries[-1] != self.offsets[-1]:
+            boundaries.append(int(self.offsets[-1]))
+        return [(start, end) for start, end in zip(boundaries, boundaries[1:])]
+
+    def iter_blocks(self, start: int, end: int) -> Iterator[bytes]:
+        """
+        行頭が [start, end) のフレームにある行を返す. 範囲の前のフレームから続く行は読み飛ばし,
+        範囲の最後の行が後のフレームに続く場合はその行の終わりまで読む
+        """
+        first, last = self.frame_index(start), self.frame_index(end)
+        with open(self.path, "rb") as f:
+            skip = first > 0 and not self.frame(f, first - 1).endswith(b"\n")
+            ends_with_newline = True
+            for index in range(first, last):
+                data = self.frame(f, index)
+                if skip:
+                    newline = data.find(b"\n")
+                    if newline < 0:
+                        continue
+                    data = data[newline + 1:]
+                    skip = False
+                if data:
+                    ends_with_newline = data.endswith(b"\n")
+                    yield data
+
+            if skip or ends_with_newline:
+                return
+            for index in range(last, self.num_frames):
+                data = self.frame(f, index)
+                newline = data.find(b"\n")
+                if newline >= 0:
+                    yield data[:newline + 1]
+                    return
+                yield data
+
+
+def split_input(path: str, unit_bytes: int = 32 << 20) -> list[tuple[int, int]]:
+    """
+    入力ファイルを並列に読めるバイト範囲に分ける. JSONL は行の境界で, シークテーブルのある zstd はフレームの境界で分け,
+    それ以外の圧縮ファイルは分けない
+    """
+    if _is_plain(path):
+        with JsonlReader(path) as reader:
+            return reader.split_by_size(unit_bytes)
+    if os.fspath(path).endswith(".zst"):
+        table = zstd_seek_table(path)
+        if table is not None:
+            return _SeekableZstd(path, table).units(unit_bytes)
+    size = os.path.getsize(path)
+    return [(0, size)] if size > 0 else []
+
+
+def iter_input_blocks(path: str, start: int = 0, end: Optional[int] = None,
+                      block_size: int = 16 << 20) -> Iterator[bytes]:
+    """
+    split_input で分けた範囲の, 行の境界で終わる展開後のブロック. 圧縮ファイルは別スレッドで展開する
+    """
+    if _is_plain(path):
+        with JsonlReader(path, block_size=block_size) as reader:
+            yield from reader.iter_blocks(start, end)
+        return
+    if os.fspath(path).endswith(".zst"):
+        table = zstd_seek_table(path)
+        if table is not None:
+            zst = _SeekableZstd(path, table)
+            yield from _line_blocks(_prefetch(zst.iter_blocks(start, int(zst.offsets[-1]) if end is None else end)))
+            return
+    if start == 0:
+        yield from _line_blocks(_prefetch(_decompressed_chunks(path, block_size)))
+
+
+def read_input_lines(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """
+    JSONL (.jsonl, .jsonl.gz, .jsonl.zst) の各行を, 改行を除いた文字列として返す
+    """
+    for block in iter_input_blocks(path, start, end):
+        lines = block.decode("utf-8").split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        yield from lines
+
+
+def iter_input_with_offsets(path: str) -> Iterator[tuple[int, bytes]]:
+    """
+    各行の (展開後の) 行頭のバイト位置と, 改行を除いたバイト列
+    """
+    if _is_plain(path):
+        with JsonlReader(path) as reader:
+            yield from reader.iter_with_offsets()
+        return
+    offset = 0
+    for block in iter_input_blocks(path):
+        lines = block.split(b"\n")
+        if lines[-1] == b"":
+            lines.pop()
+        for line in lines:
+            yield offset, line
+            offset += len(line) + 1
@@ -0,0 +1,129 @@
+import functools
+import os
+import signal
+import time
+from copy import copy
+from logging import Logger
+from multiprocessing import Pool
+from typing import Iterator, NamedTuple, Optional, Sequence, Type
+
+from hojichar import Compose, Document
+
+from preprocessing.reader import read_input_lines, split_input
+
+
+class WorkUnit(NamedTuple):
+    """
+    入力ファイルの, 行の境界 (seekable zstd はフレームの境界) に揃ったバイト範囲 [start, end)
+    """
+    path: str
+    start: int
+    end: int
+
+
+class UnitResult(NamedTuple):
+    unit: WorkUnit
+    rows: list[tuple]
+    pid: int
+    busy: float
+    stats: object
+
+
+def split_work_units(input_files: Sequence[str], unit_bytes: int = 32 << 20) -> list[WorkUnit]:
+    """
+    ファイルを unit_bytes ごとのバイト範囲に分け, 大きい順に並べる.
+    空いたワーカーが共有のキューから順に次の範囲を取るので, 大きさの揃わないファイルでも末尾で待つワーカーが少なくなる
+    """
+    units = [WorkUnit(path, start, end) for path in input_files for start, end in split_input(path, unit_bytes)]
+    return sorted(units, key=lambda unit: unit.end - unit.start, reverse=True)
+
+
+_compose: Optional[Compose] = None
+_document_class: Type[Document] = Document
+_fields: tuple[str, ...] = ()
+
+
+def _init_worker(compose: Compose, document_class: Type[Document], fields: tuple[str, ...]) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global _compose, _document_class, _fields
+    _compose = Compose(copy(compose.filters))
+    _document_class = document_class
+    _fields = fields
+
+
+def _process_unit(unit: WorkUnit) -> UnitResult:
+    start = time.perf_counter()
+    rows = []
+    for line in read_input_lines(unit.path, unit.start, unit.end):
+        document = _compose.apply(_document_class(line))
+        rows.append(tuple(getattr(document, field, None) for field in _fields))
+    return UnitResult(unit, rows, os.getpid(), time.perf_counter() - start, _compose.statistics_obj)
+
+
+class StagePool():
+    """
+    ステージの間ずっと使い回すプロセスプール. Tagger や辞書の読み込みはワーカーごとに一度だけ行う.
+
+    入力ファイルを WorkUnit に分けて共有のキューに入れ, 処理の終わった範囲から順に
+    各文書の fields の値のタプルを返す. 文書そのものは送り返さない
+    """
+
+    def __init__(self, compose: Compose, document_class: Type[Document] = Document,
+                 fields: Sequence[str] = ("text", "is_rejected"), num_jobs: int = 1, unit_bytes: int = 32 << 20) -> None:
+        self.compose = compose
+        self.document_class = document_class
+        self.fields = tuple(fields)
+        self.num_jobs = num_jobs
+        self.unit_bytes = unit_bytes
+        self.busy: dict[int, float] = {}
+        self.num_units: dict[int, int] = {}
+        self._stats: dict[int, object] = {}
+        self._pool = None
+        self._started = 0.0
+
+    def __enter__(self) -> "StagePool":
+        self._pool = Pool(self.num_jobs, initializer=_init_worker,
+                          initargs=(self.compose, self.document_class, self.fields))
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def imap(self, input_files: Sequence[str]) -> Iterator[UnitResult]:
+        units = split_work_units(input_files, self.unit_bytes)
+        for result in self._pool.imap_unordered(_process_unit, units):
+            self.busy[result.pid] = self.busy.get(result.pid, 0.0) + result.busy
+            self.num_units[result.pid] = self.num_units.get(result.pid, 0) + 1
+            self._stats[result.pid] = result.stats
+            yield result
+
+    def rows(self, input_files: Sequence[str]) -> Iterator[tuple]:
+        for result in self.imap(input_files):
+            yield from result.rows
+
+    @property
+    def statistics(self) -> dict:
+        """
+        全ワーカーのフィルタの統計の合計
+        """
+        if not self._stats:
+            return self.compose.statistics
+        return functools.reduce(lambda x, y: x + y, self._stats.values()).get_human_readable_values()
+
+    def utilization(self) -> dict[int, float]:
+        """
+        プールを開いてからの経過時間に対する, ワーカーごとの処理時間の割合
+        """
+        elapsed = max(time.perf_counter() - self._started, 1e-9)
+        return {pid: busy / elapsed for pid, busy in self.busy.items()}
+
+    def log_utilization(self, logger: Logger, name: str = "") -> None:
+        utilization = self.utilization()
+        for pid, ratio in sorted(utilization.items()):
+            logger.info(f"{name} worker {pid}: {self.num_units[pid]} units, utilization {ratio:.1%}")
+        if utilization:
+            logger.info(f"{name} mean worker utilization {sum(utilization.values()) / self.num_jobs:.1%}")
@@ -5,5 +5,9 @@ worker_id=$2
 input_dir=$3
 log_dir=$4
 basename=$5
+shingler=${6:-gpt2}
+offset_dir=${7:-}
+signature_dir=${8:-}
+edge_dir=${9:-}
 
-cd $rootdir && python -m preprocessing.dedup.worker --worker_id=$worker_id --input_dir=$input_dir --log_dir=$log_dir --basename=$basename
+cd $rootdir && python -m preprocessing.dedup.worker --worker_id=$worker_id --input_dir=$input_dir --log_dir=$log_dir --basename=$basename --shingler=$shingler --offset_dir=$offset_dir --signature_dir=$signature_dir --edge_dir=$edge_dir
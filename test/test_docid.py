@@ -0,0 +1,22 @@
+import json
+
+import numpy as np
+
+from preprocessing.dedup.docid import DocumentReader, doc_ids_from_offsets, iter_lines_with_offsets, \
+    load_offset_index, save_offset_index
+
+
+class TestDocId:
+    def test_read_documents_by_id(self, tmp_path):
+        texts = ["これはテストです", "second document", "", "改行\nを含む文書"]
+        with open(tmp_path / "0.jsonl", "w", encoding="utf-8") as f:
+            for text in texts:
+                f.write(json.dumps({"text": text}, ensure_ascii=False) + "\n")
+
+        offsets = np.array([(offset, len(line)) for offset, line in iter_lines_with_offsets(tmp_path / "0.jsonl")])
+        save_offset_index(str(tmp_path / "offsets"), "0.jsonl", offsets)
+        doc_ids = doc_ids_from_offsets(0, load_offset_index(str(tmp_path / "offsets"), "0.jsonl"))
+
+        with DocumentReader(str(tmp_path), ["0.jsonl"]) as reader:
+            assert [reader.read_text(doc_id) for doc_id in doc_ids] == texts
+        assert doc_ids == doc_ids_from_offsets(0, offsets)
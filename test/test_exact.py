@@ -0,0 +1,31 @@
+import json
+from logging import getLogger
+
+import numpy as np
+
+from preprocessing.dedup.exact import exact_digests, last_occurrences
+from preprocessing.dedup.local import deduplicate_local, select_survivors
+from preprocessing.dedup.minhash import compute_signatures
+
+
+class TestExactDedup:
+    def test_last_occurrences(self):
+        digests = exact_digests(["Hello, World!", "hello world", "別の文書", "ＨＥＬＬＯ world"])
+        assert last_occurrences(digests).tolist() == [False, False, True, True]
+
+    def test_same_survivors_as_minhash_only(self, tmp_path):
+        rng = np.random.default_rng(0)
+        base = ["".join(rng.choice(list("あいうえおかきくけこ"), size=200)) for _ in range(20)]
+        texts = [base[i] if i % 3 else base[i].upper() + "!" for i in rng.integers(0, len(base), size=90)]
+        texts += [text[:150] + "さしすせそ" * 10 for text in base[:5]]
+        input_files = []
+        for i in range(3):
+            path = tmp_path / f"{i}.jsonl"
+            path.write_text("".join(json.dumps({"text": text}, ensure_ascii=False) + "\n"
+                                    for text in texts[i::3]), encoding="utf-8")
+            input_files.append(str(path))
+
+        doc_ids_by_file, survivors = deduplicate_local(input_files, logger=getLogger(__name__))
+        ordered = [text for i in range(3) for text in texts[i::3]]
+        assert survivors == select_survivors(compute_signatures(ordered).astype(np.uint32))
+        assert sum(len(doc_ids) for doc_ids in doc_ids_by_file.values()) == len(texts)
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from preprocessing.dedup.index import MinHashIndex
+
+
+def random_signatures(num_docs, seed):
+    return np.random.default_rng(seed).integers(0, 1 << 32, size=(num_docs, 128), dtype=np.uint64).astype(np.uint32)
+
+
+class TestMinHashIndex:
+    def test_query_then_insert_across_runs(self, tmp_path):
+        first = random_signatures(50, 0)
+        second = random_signatures(50, 1)
+
+        index = MinHashIndex(str(tmp_path), label="week1")
+        assert not index.query(first).any()
+        index.add(first, [f"a:{i}" for i in range(50)])
+
+        # やり直した実行は自身が追加した文書と突き合わせない
+        assert not MinHashIndex(str(tmp_path), label="week1").query(first).any()
+
+        index = MinHashIndex(str(tmp_path), label="week2")
+        assert index.query(first).all()
+        assert not index.query(second).any()
+        index.add(second, [f"b:{i}" for i in range(50)])
+        assert len(index) == 100
+
+        version = index.data["current"]
+        index.compact()
+        assert len(index.segments()) == 1
+        assert MinHashIndex(str(tmp_path)).query(np.concatenate([first, second])).all()
+
+        index.checkout(version - 1)
+        assert not MinHashIndex(str(tmp_path)).query(second).any()
+        index.checkout(version + 1)
+        removed = index.prune(keep=1)
+        assert len(removed) == 2
+        assert sorted(name for name in os.listdir(tmp_path) if name.startswith("segment-")) == \
+            [segment.name for segment in index.segments()]
@@ -0,0 +1,39 @@
+from collections import Counter
+
+import numpy as np
+from hojichar import Document
+
+from preprocessing.dedup.lines import LineCounter, line_hash, line_hashes
+from preprocessing.filters.document_filters import MergeTokens, NewLineSentenceTokenizer
+from preprocessing.filters.token_filters import RemoveFrequentLines
+
+
+class TestLineCounter:
+    def test_counts_documents_per_line(self, tmp_path):
+        rng = np.random.default_rng(0)
+        documents = [rng.integers(0, 1 << 62, size=rng.integers(0, 20)).astype(np.uint64) for _ in range(300)]
+        documents = [np.unique(np.concatenate((hashes, rng.integers(0, 50, size=5).astype(np.uint64))))
+                     for hashes in documents]
+        expected = Counter(value for hashes in documents for value in hashes.tolist())
+
+        # 小さなバッファで何度も書き出し, 分割をまたいで合計する
+        with LineCounter(spill_dir=str(tmp_path), num_partitions=4, buffer_size=100) as counter:
+            for hashes in documents:
+                counter.add(hashes)
+            stats: dict = {}
+            frequent = counter.frequent(20, stats)
+
+        assert frequent.tolist() == sorted(value for value, count in expected.items() if count >= 20)
+        assert stats["distinct"] == len(expected)
+
+    def test_line_hashes(self):
+        assert line_hashes(["Home | About", "home about", "", "!!"]).tolist() == [line_hash("home about")]
+
+
+class TestRemoveFrequentLines:
+    def test_remove(self):
+        frequent = np.sort(np.array([line_hash("利用規約"), line_hash("Copyright 2024")], dtype=np.uint64))
+        document = Document("本文です。\n利用規約\n続きの本文。\ncopyright 2024.")
+        for f in [NewLineSentenceTokenizer(), RemoveFrequentLines(frequent), MergeTokens(delimiter="\n")]:
+            document = f.apply_filter(document) if isinstance(f, RemoveFrequentLines) else f.apply(document)
+        assert document.text == "本文です。\n続きの本文。"
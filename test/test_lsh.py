@@ -0,0 +1,62 @@
+import numpy as np
+from datasketch import MinHashLSH
+
+from preprocessing.dedup.local import band_edges, cluster_signatures
+from preprocessing.dedup.lsh import iter_band_edges
+from preprocessing.dedup.minhash import lsh_params, to_minhash
+from preprocessing.models.datastructures.unionfind import UnionFind
+
+
+def near_duplicate_signatures(num_docs, seed=0):
+    rng = np.random.default_rng(seed)
+    signatures = rng.integers(0, 1 << 32, size=(num_docs, 128), dtype=np.uint64).astype(np.uint32)
+    for i in range(1, num_docs):
+        if rng.random() < 0.5:
+            signatures[i] = signatures[rng.integers(i)]
+            signatures[i, rng.integers(128, size=3)] = rng.integers(0, 1 << 32, size=3)
+    return signatures
+
+
+def canonical(uf):
+    return sorted(sorted(group) for group in uf.groups())
+
+
+class TestSortLSH:
+    def test_same_clusters_as_minhash_lsh(self):
+        signatures = near_duplicate_signatures(300)
+        b, r = lsh_params(0.9, 128)
+        lsh = MinHashLSH(threshold=0.9, num_perm=128)
+        for i, signature in enumerate(signatures):
+            lsh.insert(i, to_minhash(signature))
+        uf = UnionFind(len(signatures))
+        for i, signature in enumerate(signatures):
+            for j in lsh.query(to_minhash(signature)):
+                uf.union(i, j)
+
+        assert canonical(cluster_signatures(signatures)) == canonical(uf)
+        src, dst = band_edges(signatures, b, r)
+        assert np.all(dst < src)
+
+    def test_spill_matches_in_memory(self, tmp_path):
+        signatures = near_duplicate_signatures(500, seed=1)
+        b, r = lsh_params(0.9, 128)
+        in_memory = sorted(zip(*(np.concatenate(a) for a in zip(*iter_band_edges(signatures, b, r)))))
+        spilled = sorted(zip(*(np.concatenate(a) for a in zip(*iter_band_edges(
+            signatures, b, r, max_memory=4096, spill_dir=str(tmp_path), chunk_rows=64)))))
+        assert len(in_memory) > 0
+        assert spilled == in_memory
+        assert list(tmp_path.iterdir()) == []
+
+    def test_verification_drops_chance_band_collisions(self):
+        rng = np.random.default_rng(2)
+        signatures = rng.integers(0, 1 << 32, size=(4, 128), dtype=np.uint64).astype(np.uint32)
+        b, r = lsh_params(0.9, 128)
+        # 0 と 1 は1つのバンドだけが一致し, 2 と 3 はほぼ同じ
+        signatures[1, :r] = signatures[0, :r]
+        signatures[3] = signatures[2]
+        signatures[3, -2:] += 1
+
+        assert canonical(cluster_signatures(signatures, verify=False)) == [[0, 1], [2, 3]]
+        stats = {}
+        assert canonical(cluster_signatures(signatures, stats=stats)) == [[0], [1], [2, 3]]
+        assert stats == {"candidates": 6, "rejected": 1}
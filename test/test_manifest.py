@@ -0,0 +1,53 @@
+import logging
+import os
+
+from preprocessing.manifest import FAILED, RunManifest, run_stage
+from preprocessing.output import ShardedWriter
+
+
+class TestRunManifest:
+    def test_skip_completed_stage_until_input_changes(self, tmp_path):
+        input_dir = tmp_path / "input"
+        input_dir.mkdir()
+        for i in range(2):
+            (input_dir / f"{i}.jsonl").write_text('{"text": "a"}\n', encoding="utf-8")
+
+        calls = []
+
+        def execute():
+            calls.append(1)
+            output_dir = str(tmp_path / "stage")
+            with ShardedWriter(output_dir) as writer:
+                writer.write_text("a")
+            return output_dir
+
+        logger = logging.getLogger(__name__)
+        output = run_stage(RunManifest(str(tmp_path)), "stage", str(input_dir), execute, logger=logger)
+        manifest = RunManifest(str(tmp_path))
+        assert manifest.stage("stage")["stats"]["num_docs"] == 1
+        assert run_stage(manifest, "stage", str(input_dir), execute, logger=logger) == output
+        assert len(calls) == 1
+
+        (input_dir / "1.jsonl").write_text('{"text": "b"}\n', encoding="utf-8")
+        run_stage(RunManifest(str(tmp_path)), "stage", str(input_dir), execute, logger=logger)
+        assert len(calls) == 2
+
+    def test_failed_file_keeps_stage_open(self, tmp_path):
+        input_dir = tmp_path / "input"
+        input_dir.mkdir()
+        (input_dir / "0.jsonl").write_text('{"text": "a"}\n', encoding="utf-8")
+        manifest = RunManifest(str(tmp_path))
+
+        def execute():
+            manifest.mark_file("stage", str(input_dir / "0.jsonl"), FAILED)
+            return str(tmp_path)
+
+        run_stage(manifest, "stage", str(input_dir), execute, logger=logging.getLogger(__name__))
+        assert RunManifest(str(tmp_path)).completed_output("stage", [str(input_dir / "0.jsonl")]) is None
+
+    def test_writer_removes_stale_shards(self, tmp_path):
+        with ShardedWriter(str(tmp_path), max_rows=1) as writer:
+            writer.write_many(['{"text": "a"}'] * 3)
+        with ShardedWriter(str(tmp_path), max_rows=1) as writer:
+            writer.write('{"text": "a"}')
+        assert sorted(os.listdir(tmp_path)) == ["00000.jsonl", "manifest.json"]
@@ -1,4 +1,23 @@
-from src.dedup.minhash import deduplicate_documents, create_minhash_lsh, create_minhash_index
+import random
+
+import numpy as np
+from datasketch import MinHash
+
+from preprocessing.dedup.minhash import deduplicate_documents, deduplicate_ids, create_minhash_lsh, create_minhash_index, minhash_signatures
+
+
+class DictSignatureCache:
+    def __init__(self):
+        self.signatures = {}
+
+    def get_many(self, doc_ids):
+        return {doc_id: self.signatures[doc_id] for doc_id in doc_ids if doc_id in self.signatures}
+
+    def set_many(self, doc_ids, signatures):
+        self.signatures.update(zip(doc_ids, signatures))
+
+    def flush(self):
+        pass
 
 
 class TestMinhash:
@@ -12,11 +31,44 @@ class TestMinhash:
         }
 
         lsh = create_minhash_lsh(threshold=0.5)
-        create_minhash_index(lsh, documents)
+        create_minhash_index(lsh, documents, shingler="char")
 
-        deduplicated = deduplicate_documents(documents, lsh)
-        assert deduplicated == {
-            "2": "This is a test document",
-            "3": "This is the test document",
-            "5": "これもテストドキュメントです",
-        }
+        deduplicated = deduplicate_documents(documents, lsh, shingler="char")
+        assert deduplicated == [
+            "This is a test document",
+            "This is the test document",
+            "これはテストドキュメントです",
+            "これもテストドキュメントです",
+        ]
+
+    def test_parallel_query_matches_serial(self):
+        rng = random.Random(0)
+        base = ["".join(rng.choice("あいうえおかきくけこ") for _ in range(200)) for _ in range(20)]
+        documents = {f"0:{i}:1": base[i % 20] + ("" if i < 20 else str(i)) for i in range(60)}
+
+        cache = DictSignatureCache()
+        lsh = create_minhash_lsh(threshold=0.5)
+        create_minhash_index(lsh, documents, cache=cache)
+
+        serial = deduplicate_ids(list(documents), lsh, cache=cache)
+        parallel = deduplicate_ids(list(documents), lsh, cache=cache, batch_size=7, num_jobs=3)
+        assert parallel == serial
+        assert len(serial) == 20
+
+    def test_minhash_signatures_match_datasketch(self):
+        rng = random.Random(0)
+        shingle_sets = [
+            {f"{rng.randint(0, 500)} {rng.randint(0, 500)}" for _ in range(rng.randint(0, 300))}
+            for _ in range(50)
+        ]
+
+        signatures = minhash_signatures(shingle_sets, num_perm=128, chunk_size=1000)
+
+        expected = []
+        for shingles in shingle_sets:
+            minhash = MinHash(num_perm=128)
+            for shingle in shingles:
+                minhash.update(shingle.encode('utf8'))
+            expected.append(minhash.hashvalues)
+        assert signatures.shape == (50, 128)
+        assert np.array_equal(signatures, np.array(expected))
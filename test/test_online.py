@@ -0,0 +1,23 @@
+import numpy as np
+
+from preprocessing.dedup.online import merge_edges
+
+
+class TestMergeEdges:
+    def test_edges_between_files(self):
+        offsets_by_file = [
+            np.array([[0, 10], [11, 5], [17, 3]]),
+            None,
+            np.array([[0, 4], [5, 4]]),
+        ]
+        edges = [
+            np.array([[0, 17, 0, 0], [2, 5, 0, 11]]),
+            # 索引のないファイルへの辺は無視する
+            np.array([[1, 0, 0, 0]]),
+        ]
+        uf = merge_edges(offsets_by_file, edges)
+        assert len(uf) == 5
+        assert uf.same(0, 2)
+        assert uf.same(1, 4)
+        assert not uf.same(0, 1)
+        assert not uf.same(3, 0)
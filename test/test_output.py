@@ -0,0 +1,24 @@
+import gzip
+import json
+
+from preprocessing.output import ShardedWriter, read_manifest
+
+
+class TestShardedWriter:
+    def test_roll_shards_and_write_manifest(self, tmp_path):
+        texts = [f"文書{i}" for i in range(25)]
+        with ShardedWriter(str(tmp_path), max_rows=10, compression="gzip") as writer:
+            for text in texts:
+                writer.write_text(text)
+
+        manifest = read_manifest(str(tmp_path))
+        assert [shard["num_docs"] for shard in manifest["shards"]] == [10, 10, 5]
+        assert manifest["num_docs"] == 25
+
+        read = []
+        for shard in manifest["shards"]:
+            with gzip.open(tmp_path / shard["file"], "rt", encoding="utf-8") as f:
+                read.extend(json.loads(line)["text"] for line in f)
+        assert read == texts
+        assert manifest["num_bytes"] == sum(len(json.dumps({"text": text}, ensure_ascii=False).encode()) + 1
+                                            for text in texts)
@@ -0,0 +1,55 @@
+import gzip
+import json
+import struct
+
+import pytest
+
+from preprocessing.reader import JsonlReader, iter_input_with_offsets, read_input_lines, split_input
+
+
+class TestJsonlReader:
+    def test_split_and_offsets(self, tmp_path):
+        lines = ['{"text": "短い"}', '{"text": "' + "長い" * 100 + '"}', "", '{"text": "改行で終わらない"}']
+        path = tmp_path / "0.jsonl"
+        data = "\n".join(lines).encode("utf-8")
+        path.write_bytes(data)
+
+        with JsonlReader(str(path), block_size=16) as reader:
+            assert list(reader.iter_lines()) == lines
+            for num_chunks in [1, 2, 3, 50]:
+                chunks = reader.split(num_chunks)
+                assert all(start == 0 or data[start - 1:start] == b"\n" for start, _ in chunks)
+                assert [line for start, end in chunks for line in reader.iter_lines(start, end)] == lines
+            for offset, line in reader.iter_with_offsets():
+                assert data[offset:offset + len(line)] == line
+
+
+def write_seekable_zstd(path, data: bytes, frame_size: int) -> None:
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    entries = []
+    with open(path, "wb") as f:
+        for i in range(0, len(data), frame_size):
+            frame = compressor.compress(data[i:i + frame_size])
+            f.write(frame)
+            entries.append(struct.pack("<II", len(frame), len(data[i:i + frame_size])))
+        table = b"".join(entries) + struct.pack("<IBI", len(entries), 0, 0x8F92EAB1)
+        f.write(struct.pack("<II", 0x184D2A5E, len(table)) + table)
+
+
+class TestCompressedInput:
+    def test_read_split_compressed_files(self, tmp_path):
+        lines = [json.dumps({"text": "あ" * (i % 50)}, ensure_ascii=False) for i in range(300)]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with gzip.open(tmp_path / "0.jsonl.gz", "wb") as f:
+            f.write(data)
+        write_seekable_zstd(tmp_path / "1.jsonl.zst", data, frame_size=101)
+
+        for path in [str(tmp_path / "0.jsonl.gz"), str(tmp_path / "1.jsonl.zst")]:
+            assert list(read_input_lines(path)) == lines
+            for unit_bytes in [1, 200, 1 << 20]:
+                assert [line for start, end in split_input(path, unit_bytes)
+                        for line in read_input_lines(path, start, end)] == lines
+            assert [data[offset:offset + len(line)] for offset, line in iter_input_with_offsets(path)] == \
+                [line.encode("utf-8") for line in lines]
+        assert len(split_input(str(tmp_path / "1.jsonl.zst"), 200)) > 1
@@ -0,0 +1,60 @@
+import random
+
+import nltk
+
+from preprocessing.filters.repetition import NgramRepetitionDetector, TOP_NGRAM_CHARACTER_FRACTIONS, DUPLICATE_NGRAM_CHARACTER_FRACTIONS
+
+
+def legacy_is_repetitive(word_list: list[str], text_length: int) -> bool:
+    for ngram, threshold in TOP_NGRAM_CHARACTER_FRACTIONS:
+        fdist = nltk.FreqDist(nltk.ngrams(word_list, ngram))
+        for gram, repeat in fdist.items():
+            char_count = sum([len(word) for word in gram])
+            if char_count * (repeat - 1) / text_length > threshold:
+                return True
+
+    for ngram, threshold in DUPLICATE_NGRAM_CHARACTER_FRACTIONS:
+        fdist = {}
+        mark = [0] * len(word_list)
+        for i in range(len(word_list) - ngram + 1):
+            bag = tuple(word_list[i: i + ngram])
+            if bag in fdist:
+                for j in range(i, i + ngram):
+                    mark[j] = len(word_list[j])
+                fdist[bag] += 1
+            else:
+                fdist[bag] = 1
+
+        if sum(mark) / float(text_length) > threshold:
+            return True
+
+    return False
+
+
+class TestNgramRepetitionDetector:
+    def test_matches_legacy_decisions(self):
+        rng = random.Random(0)
+        detector = NgramRepetitionDetector()
+        rejected = 0
+        for _ in range(2000):
+            vocab = ["語" * rng.randint(1, 4) + str(i) for i in range(rng.randint(1, 60))]
+            words = [rng.choice(vocab) for _ in range(rng.randint(0, 120))]
+            if words and rng.random() < 0.5:
+                start = rng.randrange(len(words))
+                span = words[start:start + rng.randint(1, 15)]
+                words = words + span * rng.randint(1, 4)
+            text_length = sum(len(word) for word in words) + rng.randint(0, 200)
+            if text_length == 0:
+                continue
+
+            expected = legacy_is_repetitive(words, text_length)
+            assert detector.is_repetitive(words, text_length) == expected
+            rejected += expected
+
+        assert 0 < rejected < 2000
+
+    def test_short_documents(self):
+        detector = NgramRepetitionDetector()
+        assert not detector.is_repetitive([], 0)
+        assert not detector.is_repetitive(["鏡餅"], 2)
+        assert detector.is_repetitive(["鏡餅", "鏡餅", "鏡餅"], 6)
@@ -0,0 +1,26 @@
+import json
+
+from preprocessing.reader import JsonlReader
+from preprocessing.scheduler import split_work_units
+
+
+class TestWorkUnits:
+    def test_units_cover_every_line_once(self, tmp_path):
+        paths = []
+        for i, num_lines in enumerate([0, 1, 37]):
+            path = tmp_path / f"{i}.jsonl"
+            with open(path, "w", encoding="utf-8") as f:
+                for j in range(num_lines):
+                    f.write(json.dumps({"text": "あ" * j}, ensure_ascii=False) + "\n")
+            paths.append(str(path))
+
+        for unit_bytes in [1, 5, 64, 1 << 20]:
+            units = split_work_units(paths, unit_bytes)
+            assert [unit.end - unit.start for unit in units] == \
+                sorted((unit.end - unit.start for unit in units), reverse=True)
+            for path in paths:
+                with JsonlReader(path) as reader:
+                    lines = [line for unit in sorted(units) if unit.path == path
+                             for line in reader.iter_lines(unit.start, unit.end)]
+                with open(path, encoding="utf-8") as f:
+                    assert lines == f.read().splitlines()
@@ -0,0 +1,33 @@
+import json
+
+import numpy as np
+
+from preprocessing.dedup.substring import build_buffer, iter_deduplicated, mark_repeats
+
+
+class TestSubstringDedup:
+    def run(self, tmp_path, texts, length, **kwargs):
+        path = tmp_path / "input.jsonl"
+        path.write_text("".join(json.dumps({"text": text}, ensure_ascii=False) + "\n" for text in texts),
+                        encoding="utf-8")
+        bounds = build_buffer([str(path)], str(tmp_path / "buffer.bin"))
+        mark_repeats(str(tmp_path / "buffer.bin"), str(tmp_path / "flags.bin"), length=length,
+                     spill_dir=str(tmp_path), **kwargs)
+        return list(iter_deduplicated(str(tmp_path / "buffer.bin"), str(tmp_path / "flags.bin"), bounds, length,
+                                      batch_size=2))
+
+    def test_keep_first_occurrence(self, tmp_path):
+        passage = "いろはにほへとちりぬるをわかよたれそつねならむ"
+        texts = ["前置き" + passage + "後書き", "別の文書、" + passage, "短い" + passage[:5], passage]
+        assert self.run(tmp_path, texts, 30) == ["前置き" + passage + "後書き", "別の文書、", "短い" + passage[:5], ""]
+
+    def test_partitioned(self, tmp_path):
+        rng = np.random.default_rng(0)
+        chars = list("あいうえおかきくけこ")
+        texts = ["".join(rng.choice(chars, size=200)) for _ in range(50)]
+        texts += [texts[i][50:150] + "".join(rng.choice(list("さしす"), size=20)) for i in range(10)]
+        expected = self.run(tmp_path, texts, 90)
+        # 小さなメモリとチャンクで分割して書き出しても結果は変わらない
+        assert self.run(tmp_path, texts, 90, max_memory=20_000, chunk_bytes=1000) == expected
+        assert expected[:50] == texts[:50]
+        assert all(len(text) == 20 for text in expected[50:])
@@ -0,0 +1,61 @@
+import random
+
+import numpy as np
+
+from preprocessing.models.datastructures.unionfind import UnionFind
+
+
+def reference_groups(n: int, edges: list[tuple[int, int]]) -> list[list[int]]:
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            x = parent[x]
+        return x
+
+    for a, b in edges:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    groups: dict[int, list[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values())
+
+
+class TestUnionFind:
+    def test_union_and_groups(self):
+        uf = UnionFind(["a", "b", "c", "d"])
+        uf.union("a", "c")
+        uf.union("d", "c")
+
+        assert uf.same("a", "d")
+        assert not uf.same("a", "b")
+        assert uf.size("c") == 3
+        assert uf.members("d") == ["a", "c", "d"]
+        assert uf.roots() == ["a", "b"]
+        assert uf.groups() == [["a", "c", "d"], ["b"]]
+        assert uf.all_group_members() == {"a": ["a", "c", "d"], "b": ["b"]}
+
+    def test_union_edges_matches_reference(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            n = rng.randint(1, 60)
+            edges = [(rng.randrange(n), rng.randrange(n)) for _ in range(rng.randint(0, 80))]
+
+            uf = UnionFind(n)
+            half = len(edges) // 2
+            for a, b in edges[:half]:
+                uf.union(a, b)
+            uf.union_edges(np.array([a for a, _ in edges[half:]]), np.array([b for _, b in edges[half:]]))
+
+            expected = reference_groups(n, edges)
+            assert sorted(uf.groups()) == expected
+            assert uf.group_count() == len(expected)
+            assert len(set(uf.labels().tolist())) == len(expected)
+
+    def test_empty(self):
+        uf = UnionFind([])
+        uf.union_edges(np.array([]), np.array([]))
+        assert uf.groups() == []
+        assert uf.group_count() == 0